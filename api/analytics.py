@@ -0,0 +1,265 @@
+# api/analytics.py
+import sqlite3
+import threading
+import time
+import warnings
+from datetime import timedelta
+
+import numpy as np
+from django.db.models import Avg, Q
+from django.utils import timezone
+
+from .cache import response_cache
+from .models import HeroScore
+
+# Seconds before a process-wide score matrix picks up rows written by another process
+SCORE_MATRIX_MAX_AGE = 60
+
+# How far before the last load a refresh looks back, for writes that committed after it
+# but were stamped before it
+SCORE_MATRIX_OVERLAP = timedelta(seconds=60)
+
+# SQLite adds REAL values up in scan order, with Kahan-Babuska-Neumaier compensation
+# since 3.43. Window means add the days up the same way, so they equal Avg('score').
+COMPENSATED_SUM = sqlite3.sqlite_version_info >= (3, 43, 0)
+
+
+def window_averages(hero_ids=None, windows=(7, 30), now=None):
+    """Average score per hero over each trailing window of days, in one grouped query.
+
+    `hero_ids` may be a list or a queryset of ids; None means every hero with scores.
+    Returns {hero_id: {days: average}}; heroes without scores in a window get 0,
+    matching the `aggregate(Avg('score')) or 0` it replaces.
+    """
+    now = now or timezone.now()
+    cutoffs = {days: now - timedelta(days=days) for days in windows}
+
+    scores = HeroScore.objects.filter(date__gte=min(cutoffs.values()))
+    if hero_ids is not None:
+        scores = scores.filter(hero_id__in=hero_ids)
+    rows = scores.values('hero_id').annotate(**{
+        f'avg_{days}': Avg('score', filter=Q(date__gte=cutoff)) for days, cutoff in cutoffs.items()
+    })
+
+    averages = {}
+    for row in rows:
+        averages[row['hero_id']] = {days: row[f'avg_{days}'] or 0 for days in windows}
+    return averages
+
+
+def performance_change(averages, short=7, long=30):
+    """Relative change of the short window average against the long one."""
+    if not averages:
+        return 0
+    short_avg = averages.get(short, 0)
+    long_avg = averages.get(long, 0)
+    return (short_avg - long_avg) / long_avg if long_avg else 0
+
+
+class HeroScoreMatrix:
+    """Dense hero x date matrix of daily scores for whole-league analytics.
+
+    Rows follow `hero_ids` (see `hero_index` for the reverse lookup) and column 0 is
+    `start_date`. Missing scores are NaN. Values are float64 like the score column,
+    and window means are bit-for-bit the SQL averages.
+    """
+
+    def __init__(self, dtype=np.float64):
+        self.dtype = dtype
+        self.hero_ids = []
+        self.hero_index = {}
+        self.start_date = None
+        self.values = np.empty((0, 0), dtype=dtype)
+        self.loaded_until = None
+        self.refreshed_at = None
+        self.lock = threading.RLock()
+
+    @classmethod
+    def from_db(cls):
+        matrix = cls()
+        matrix.refresh(full=True)
+        return matrix
+
+    @property
+    def end_date(self):
+        if self.start_date is None:
+            return None
+        return self.start_date + timedelta(days=self.values.shape[1] - 1)
+
+    def refresh(self, full=False):
+        """Load scores written since the last load, whatever day they are for.
+
+        Rows that disappeared from the table cannot be seen that way, so if the
+        matrix then holds more scores than the table it is rebuilt from scratch.
+        """
+        started = timezone.now()
+        scores = HeroScore.objects.all()
+        if not full and self.loaded_until is not None:
+            scores = scores.filter(updated_at__gte=self.loaded_until - SCORE_MATRIX_OVERLAP)
+        rows = list(scores.values_list('hero_id', 'date', 'score').iterator(chunk_size=5000))
+        if full or self.loaded_until is None:
+            # Built aside so readers keep the old matrix until the new one is complete
+            fresh = HeroScoreMatrix(self.dtype)
+            fresh.update(rows)
+            with self.lock:
+                self.hero_ids, self.hero_index = fresh.hero_ids, fresh.hero_index
+                self.start_date, self.values = fresh.start_date, fresh.values
+        else:
+            self.update(rows)
+            if HeroScore.objects.count() != self.score_count():
+                return self.refresh(full=True)
+        with self.lock:
+            self.loaded_until = started
+            self.refreshed_at = time.monotonic()
+
+    def score_count(self):
+        with self.lock:
+            return int(np.count_nonzero(~np.isnan(self.values)))
+
+    def update(self, rows):
+        """Apply (hero_id, date, score) rows, growing the matrix for unseen heroes or dates."""
+        rows = list(rows)
+        if not rows:
+            return
+        with self.lock:
+            hero_ids, dates, scores = zip(*rows)
+            for hero_id in hero_ids:
+                if hero_id not in self.hero_index:
+                    self.hero_index[hero_id] = len(self.hero_ids)
+                    self.hero_ids.append(hero_id)
+
+            first, last = min(dates), max(dates)
+            if self.start_date is None:
+                self.start_date = first
+                self.values = np.full((0, 0), np.nan, dtype=self.dtype)
+            shift = max(0, (self.start_date - first).days)
+            width = max(self.values.shape[1] + shift, (last - self.start_date).days + shift + 1)
+            height = len(self.hero_ids)
+            if shift or width > self.values.shape[1] or height > self.values.shape[0]:
+                grown = np.full((height, width), np.nan, dtype=self.dtype)
+                grown[:self.values.shape[0], shift:shift + self.values.shape[1]] = self.values
+                self.values = grown
+                self.start_date -= timedelta(days=shift)
+
+            row_idx = np.fromiter((self.hero_index[hero_id] for hero_id in hero_ids), dtype=np.intp, count=len(rows))
+            col_idx = np.fromiter(((date - self.start_date).days for date in dates), dtype=np.intp, count=len(rows))
+            self.values[row_idx, col_idx] = np.asarray(scores, dtype=self.dtype)
+
+    def rows_for(self, hero_ids):
+        return np.fromiter((self.hero_index.get(hero_id, -1) for hero_id in hero_ids), dtype=np.intp)
+
+    def window_mean(self, days, now=None):
+        """Mean score per hero over dates on or after `now - days`; 0 where a hero has no scores.
+
+        An explicit `now` also ends the window on its date, for averages as of a past day.
+        """
+        if self.start_date is None:
+            return np.zeros(len(self.hero_ids))
+        end = None
+        if now is not None:
+            end = max(0, (timezone.localtime(now, timezone.get_default_timezone()).date() - self.start_date).days + 1)
+        now = now or timezone.now()
+        # Same datetime -> date conversion a DateField lookup applies
+        cutoff = timezone.localtime(now - timedelta(days=days), timezone.get_default_timezone()).date()
+        start = max(0, (cutoff - self.start_date).days)
+        return _ordered_mean(self.values[:, start:end])
+
+    def window_averages(self, hero_ids=None, windows=(7, 30), now=None):
+        """Same result shape as analytics.window_averages(), computed from the matrix."""
+        with self.lock:
+            means = {days: self.window_mean(days, now) for days in windows}
+            ids = self.hero_ids if hero_ids is None else [hero_id for hero_id in hero_ids if hero_id in self.hero_index]
+            rows = self.rows_for(ids)
+            return {
+                hero_id: {days: float(means[days][row]) for days in windows}
+                for hero_id, row in zip(ids, rows)
+            }
+
+    def rolling_mean(self, window):
+        """Trailing `window`-day mean for every hero and date, ignoring missing days."""
+        filled = np.nan_to_num(self.values, nan=0.0).astype(np.float64)
+        present = (~np.isnan(self.values)).astype(np.float64)
+        sums = _trailing_sum(filled, window)
+        counts = _trailing_sum(present, window)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts > 0, sums / counts, np.nan)
+
+    def rolling_median(self, window):
+        """Trailing `window`-day median for every hero and date, ignoring missing days."""
+        padded = np.pad(self.values, ((0, 0), (window - 1, 0)), constant_values=np.nan)
+        windows = np.lib.stride_tricks.sliding_window_view(padded, window, axis=1)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return np.nanmedian(windows, axis=2)
+
+    def pct_change(self, periods=1):
+        """Relative change against the score `periods` days earlier."""
+        current = self.values[:, periods:].astype(np.float64)
+        previous = self.values[:, :-periods].astype(np.float64)
+        change = np.full(self.values.shape, np.nan)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            change[:, periods:] = np.where(previous != 0, (current - previous) / previous, np.nan)
+        return change
+
+    @staticmethod
+    def rank(values, descending=True):
+        """1-based rank of each entry, NaN last."""
+        values = np.asarray(values, dtype=np.float64)
+        keys = np.where(np.isnan(values), -np.inf if descending else np.inf, values)
+        order = np.argsort(-keys if descending else keys, kind='stable')
+        ranks = np.empty(len(values), dtype=np.int64)
+        ranks[order] = np.arange(1, len(values) + 1)
+        return ranks
+
+
+def _ordered_mean(values):
+    """Mean of each row's non-NaN values, summed column by column like AVG() does; 0 for an empty row."""
+    sums = np.zeros(len(values))
+    errors = np.zeros(len(values))
+    counts = np.zeros(len(values))
+    for column in values.T.astype(np.float64):
+        present = ~np.isnan(column)
+        column = np.where(present, column, 0.0)
+        total = sums + column
+        if COMPENSATED_SUM:
+            errors += np.where(np.abs(sums) > np.abs(column), (sums - total) + column, (column - total) + sums)
+        sums = total
+        counts += present
+    return np.divide(sums + errors, counts, out=np.zeros(len(values)), where=counts > 0)
+
+
+def _trailing_sum(values, window):
+    cumsum = np.cumsum(values, axis=1)
+    result = cumsum.copy()
+    result[:, window:] -= cumsum[:, :-window]
+    return result
+
+
+_score_matrix = None
+_score_matrix_generation = None
+_score_matrix_lock = threading.Lock()
+
+
+def get_score_matrix(max_age=SCORE_MATRIX_MAX_AGE):
+    """Process-wide HeroScoreMatrix, built on first use and topped up once older than `max_age` seconds.
+
+    It is also topped up as soon as the response cache has seen a new 'scores' generation, so a
+    response cached under that generation is never computed from scores older than it.
+    """
+    global _score_matrix, _score_matrix_generation
+    generation = (response_cache.generations or {}).get('scores')
+    with _score_matrix_lock:
+        if _score_matrix is None:
+            _score_matrix = HeroScoreMatrix.from_db()
+        elif max_age is not None and (
+            time.monotonic() - _score_matrix.refreshed_at > max_age or generation != _score_matrix_generation
+        ):
+            _score_matrix.refresh()
+        _score_matrix_generation = generation
+        return _score_matrix
+
+
+def update_score_matrix(rows):
+    """Push freshly written (hero_id, date, score) rows into the matrix if this process has one."""
+    if _score_matrix is not None:
+        _score_matrix.update(rows)
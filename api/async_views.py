@@ -0,0 +1,141 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from django.views.decorators.http import require_GET
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+
+from .analytics import performance_change, window_averages
+from .cache import cached_response
+from .ingest import build_market_snapshots
+from .models import Hero, StarSwingSnapshot, TournamentScore
+from .search import aget_search_index
+from .views import MARKET_DATA_FIELDS, SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT, market_data, parse_as_of
+from .management.commands.predict_star_swings import Command as PredictStarSwingsCommand
+
+# Async-native versions of the read endpoints in views.py, for ASGI deployments (settings.API_ASYNC_VIEWS).
+# Bodies are rendered with DRF's JSONRenderer so they are byte-identical to the sync views.
+
+renderer = JSONRenderer()
+
+def json_response(data, status=status.HTTP_200_OK):
+	response = HttpResponse(renderer.render(data), content_type=renderer.media_type, status=status)
+	patch_vary_headers(response, ('Accept',))
+	return response
+
+@cached_response('predictions', 'heroes', 'scores')
+@require_GET
+async def predict_star_swings(request):
+	snapshots = StarSwingSnapshot.objects.order_by('-poll_ts')
+
+	as_of = request.GET.get('as_of')
+	if as_of:
+		as_of_ts = parse_as_of(as_of)
+		if as_of_ts is None:
+			return json_response({'error': 'as_of must be an ISO date or datetime'}, status=status.HTTP_400_BAD_REQUEST)
+		snapshots = snapshots.filter(poll_ts__lte=as_of_ts)
+
+	snapshot = await snapshots.only('id', 'poll_ts', 'etag').afirst()
+	if snapshot is None:
+		if as_of:
+			return json_response({'error': 'No predictions available for the given as_of'}, status=status.HTTP_404_NOT_FOUND)
+		# Nothing has been materialized by the poller yet
+		json_data = await sync_to_async(PredictStarSwingsCommand().handle)()
+		return json_response(json.loads(json_data))
+
+	etag = f'"{snapshot.etag}"'
+	last_modified = int(snapshot.poll_ts.timestamp())
+	not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+	if not_modified is not None:
+		return not_modified
+
+	data = await StarSwingSnapshot.objects.values_list('data', flat=True).aget(id=snapshot.id)
+	response = json_response(data)
+	response['ETag'] = etag
+	response['Last-Modified'] = http_date(last_modified)
+	return response
+
+@cached_response('heroes', 'scores')
+@require_GET
+async def hero_performance(request, hero_id):
+	# The grouped average query has no async form; it runs in a thread next to the hero lookup
+	hero, averages = await asyncio.gather(
+		Hero.objects.filter(id=hero_id).values('id', 'name').afirst(),
+		sync_to_async(window_averages)([hero_id]),
+	)
+	if hero is None:
+		return json_response({'error': 'Hero not found'}, status=status.HTTP_404_NOT_FOUND)
+
+	averages = averages.get(hero['id'], {7: 0, 30: 0})
+
+	return json_response({
+		'hero_id': hero['id'],
+		'name': hero['name'],
+		'seven_day_avg': averages[7],
+		'thirty_day_avg': averages[30],
+		'performance_change': performance_change(averages)
+	})
+
+@cached_response('heroes')
+@require_GET
+async def hero_market_data(request, hero_id):
+	hero = await Hero.objects.filter(id=hero_id).values(*MARKET_DATA_FIELDS).afirst()
+	if hero is None:
+		return json_response({'error': 'Hero not found'}, status=status.HTTP_404_NOT_FOUND)
+
+	snapshot = hero['market_snapshot']
+	if snapshot is None:
+		snapshot = (await sync_to_async(build_market_snapshots)([hero_id]))[hero_id]
+	return json_response(market_data(hero['id'], hero['name'], hero['volume'], hero['last_sale'], snapshot))
+
+async def tournament_scores_for(hero_id):
+	return [row async for row in TournamentScore.objects.filter(hero_id=hero_id).order_by('index').values_list('index', 'score')]
+
+@cached_response('heroes', 'tournaments')
+@require_GET
+async def hero_tournament_scores(request, hero_id):
+	# The hero and its scores are independent queries
+	hero, tournament_scores = await asyncio.gather(
+		Hero.objects.filter(id=hero_id).values('id', 'name').afirst(),
+		tournament_scores_for(hero_id),
+	)
+	if hero is None:
+		return json_response({'error': 'Hero not found'}, status=status.HTTP_404_NOT_FOUND)
+
+	tournament_scores_data = [{'tournament_label': len(tournament_scores) - index - 7, 'score': score} for index, score in tournament_scores]
+	tournament_scores_data = tournament_scores_data[:-11]
+
+	return json_response({
+		'hero_id': hero['id'],
+		'name': hero['name'],
+		'tournament_scores': tournament_scores_data
+	})
+
+@require_GET
+async def search_heroes_by_handle(request):
+	handle = request.GET.get('handle', None)
+	if not handle:
+		return json_response({'error': 'Handle parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+	try:
+		limit = min(max(int(request.GET.get('limit', SEARCH_DEFAULT_LIMIT)), 1), SEARCH_MAX_LIMIT)
+		offset = max(int(request.GET.get('offset', 0)), 0)
+	except ValueError:
+		return json_response({'error': 'limit and offset must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+
+	index = await aget_search_index()
+	count, heroes = index.search(handle, limit=limit, offset=offset)
+
+	if not count:
+		return json_response({'error': 'No heroes found with the given handle'}, status=status.HTTP_404_NOT_FOUND)
+
+	return json_response({
+		'count': count,
+		'limit': limit,
+		'offset': offset,
+		'heroes': heroes
+	})
@@ -0,0 +1,104 @@
+# api/backtest.py
+import os
+import time
+from datetime import timedelta
+
+import numpy as np
+
+from .predictions import HERO_FIELDS, build_predictions
+
+# Prediction side -> sign of the star change it calls
+SIDES = {'potential_gainers': 1, 'potential_losers': -1}
+
+# Set in each pool worker by init_worker()
+_worker = {}
+
+
+def matrix_state(matrix):
+    """Plain (hero_ids, start_date, values) of a HeroScoreMatrix, to rebuild it in another process."""
+    with matrix.lock:
+        return list(matrix.hero_ids), matrix.start_date, matrix.values
+
+
+def init_worker(state, buckets, limit):
+    """Pool initializer: set up Django if the worker was spawned, then rebuild the score matrix once."""
+    from django.apps import apps
+    if not apps.ready:
+        import django
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fantasy_backend.settings')
+        django.setup()
+    from .analytics import HeroScoreMatrix
+
+    hero_ids, start_date, values = state
+    matrix = HeroScoreMatrix()
+    matrix.hero_ids = hero_ids
+    matrix.hero_index = {hero_id: index for index, hero_id in enumerate(hero_ids)}
+    matrix.start_date = start_date
+    matrix.values = values
+    _worker.update(matrix=matrix, buckets=buckets, limit=limit)
+
+
+def evaluate_point(ts, rows, later_stars):
+    """Predict as of `ts` from `rows` (HERO_FIELDS tuples ordered by current_rank) and score the calls.
+
+    The name column of `rows` holds the hero id, so calls map back to heroes.
+    `later_stars` maps hero id to the stars the hero had at the end of the horizon;
+    heroes missing from it are left out of both the calls and the movers.
+    Returns {'ts', 'heroes', 'seconds', side: {'calls', 'hits', 'movers'}}.
+    """
+    started = time.perf_counter()
+    predictions, _ = build_predictions(rows, _worker['matrix'], _worker['limit'], _worker['buckets'], now=ts)
+    seconds = time.perf_counter() - started
+
+    id_index, stars_index = HERO_FIELDS.index('id'), HERO_FIELDS.index('stars')
+    moves = {
+        row[id_index]: np.sign(later_stars[row[id_index]] - row[stars_index])
+        for row in rows if row[id_index] in later_stars
+    }
+    result = {'ts': ts, 'heroes': len(rows), 'seconds': seconds}
+    for side, sign in SIDES.items():
+        called = [hero['name'] for hero in predictions[side] if hero['name'] in moves]
+        result[side] = {
+            'calls': len(called),
+            'hits': sum(1 for hero_id in called if moves[hero_id] == sign),
+            'movers': sum(1 for move in moves.values() if move == sign),
+        }
+    return result
+
+
+def ratio(numerator, denominator):
+    return numerator / denominator if denominator else None
+
+
+def summarize(results):
+    """Precision and recall per side over every point, counting each call once."""
+    summary = {}
+    for side in SIDES:
+        calls = sum(result[side]['calls'] for result in results)
+        hits = sum(result[side]['hits'] for result in results)
+        movers = sum(result[side]['movers'] for result in results)
+        summary[side] = {
+            'calls': calls, 'hits': hits, 'movers': movers,
+            'precision': ratio(hits, calls), 'recall': ratio(hits, movers),
+        }
+    seconds = [result['seconds'] for result in results]
+    summary['seconds'] = {
+        'mean': float(np.mean(seconds)) if seconds else None,
+        'max': max(seconds, default=None),
+    }
+    return summary
+
+
+def horizon_pairs(days, step, horizon):
+    """(point, horizon end) pairs among the recorded `days`, one point every `step` days."""
+    recorded = set(days)
+    pairs = []
+    next_point = None
+    for day in sorted(days):
+        if next_point is not None and day < next_point:
+            continue
+        later = day + timedelta(days=horizon)
+        if later in recorded:
+            pairs.append((day, later))
+            next_point = day + timedelta(days=step)
+    return pairs
@@ -0,0 +1,315 @@
+# api/cache.py
+import asyncio
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+from wsgiref.util import is_hop_by_hop
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+from .models import SyncWatermark
+
+DEFAULTS = {
+    'BACKEND': 'local',
+    'ALIAS': 'default',
+    'MAX_ENTRIES': 5000,
+    'MAX_BYTES': 64 * 1024 * 1024,
+    'TIMEOUT': 3600,
+    'GENERATION_CHECK_INTERVAL': 2,
+}
+
+# The poller bumps one watermark per scope after every committed write; its timestamp is
+# that scope's generation
+GENERATION_SOURCE = 'api.response_cache'
+
+# What a cached response can depend on
+SCOPES = (
+    'heroes',  # Hero rows, market snapshots included
+    'scores',  # HeroScore
+    'tournaments',  # TournamentScore
+    'cards',  # Card
+    'predictions',  # StarSwingSnapshot
+)
+
+# Stored apart (Content-Type), recomputed (Content-Length) or set per response (X-Cache);
+# hop-by-hop headers are never stored either
+UNCACHED_HEADERS = {'content-type', 'content-length', 'x-cache'}
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+
+class LocalBackend:
+    """Size-bounded in-process LRU. Entries are evicted by count and by total body bytes."""
+
+    def __init__(self, stats, max_entries, max_bytes, **kwargs):
+        self.stats = stats
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        size = len(entry['content'])
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = entry
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.stats.evictions += 1
+
+    def invalidate(self, scopes):
+        with self.lock:
+            for key in [key for key, entry in self.entries.items() if not scopes.isdisjoint(entry['scopes'])]:
+                self._remove(key)
+                self.stats.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.stats.invalidations += len(self.entries)
+            self.entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.size -= len(entry['content'])
+
+    def info(self):
+        return {'entries': len(self.entries), 'bytes': self.size}
+
+
+class DjangoCacheBackend:
+    """Stores entries in a configured Django cache (file-based, Redis, ...) shared between processes.
+
+    Size limits and eviction are up to the cache itself.
+    """
+
+    def __init__(self, stats, alias, timeout, **kwargs):
+        self.stats = stats
+        self.cache = caches[alias]
+        self.timeout = timeout
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, entry):
+        self.cache.set(key, entry, self.timeout)
+
+    def invalidate(self, scopes):
+        # Entries of older generations are unreachable and expire on their own
+        pass
+
+    def clear(self):
+        pass
+
+    def info(self):
+        return {}
+
+
+BACKENDS = {
+    'local': LocalBackend,
+    'django': DjangoCacheBackend,
+}
+
+
+class ResponseCache:
+    """Caches rendered GET responses of the read API until the next poll cycle commits."""
+
+    def __init__(self, options=None):
+        options = {**DEFAULTS, **(options or {})}
+        self.stats = CacheStats()
+        self.backend = BACKENDS[options['BACKEND']](
+            self.stats,
+            alias=options['ALIAS'],
+            timeout=options['TIMEOUT'],
+            max_entries=options['MAX_ENTRIES'],
+            max_bytes=options['MAX_BYTES'],
+        )
+        self.check_interval = options['GENERATION_CHECK_INTERVAL']
+        self.generations = None
+        self.checked_at = None
+        self.lock = threading.Lock()
+
+    def generation_due(self):
+        """Whether this caller should re-read the generations. Only one concurrent caller is told to
+        once they are known; the others keep using them until the new values are read."""
+        with self.lock:
+            now = time.monotonic()
+            if self.checked_at is not None and now - self.checked_at < self.check_interval:
+                return False
+            if self.generations is not None:
+                self.checked_at = now
+            return True
+
+    def generation_query(self):
+        return SyncWatermark.objects.filter(source=GENERATION_SOURCE).values_list('key', 'updated_at')
+
+    def set_generations(self, rows):
+        updated = dict(rows)
+        generations = {scope: updated[scope].isoformat() if updated.get(scope) else '0' for scope in SCOPES}
+        with self.lock:
+            if self.generations is not None:
+                changed = {scope for scope in SCOPES if generations[scope] != self.generations[scope]}
+                if changed:
+                    self.backend.invalidate(changed)
+            self.generations = generations
+            self.checked_at = time.monotonic()
+        return generations
+
+    def current_generations(self):
+        if self.generation_due():
+            return self.set_generations(self.generation_query())
+        return self.generations
+
+    async def acurrent_generations(self):
+        if self.generation_due():
+            return self.set_generations([row async for row in self.generation_query()])
+        return self.generations
+
+    def key_for(self, request, scopes, generations=None):
+        generations = generations or self.current_generations()
+        version = ','.join(generations[scope] for scope in scopes)
+        query = urlencode(sorted(request.GET.lists()), doseq=True)
+        raw = f"{version}|{request.path}?{query}|{request.META.get('HTTP_ACCEPT', '')}"
+        return f'api-cache:{hashlib.sha1(raw.encode()).hexdigest()}'
+
+    async def akey_for(self, request, scopes):
+        return self.key_for(request, scopes, await self.acurrent_generations())
+
+    def lookup(self, request, key):
+        """The cached response for `key` (a 304 when the client's copy is current), or None."""
+        entry = self.backend.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        response = HttpResponse(entry['content'], content_type=entry['content_type'])
+        for header, value in entry['headers'].items():
+            response[header] = value
+        response['X-Cache'] = 'HIT'
+        # The response itself, or a 304 carrying its validators when the client's copy is current
+        return get_conditional_response(
+            request,
+            etag=response.get('ETag'),
+            last_modified=parse_http_date_safe(response.get('Last-Modified')),
+            response=response,
+        )
+
+    def store(self, key, response, scopes):
+        if response.status_code != 200 or response.streaming:
+            return
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.render()
+        self.backend.set(key, {
+            'content': response.content,
+            'content_type': response['Content-Type'],
+            'scopes': scopes,
+            'headers': {
+                header: value for header, value in response.items()
+                if header.lower() not in UNCACHED_HEADERS and not is_hop_by_hop(header)
+            },
+        })
+        response['X-Cache'] = 'MISS'
+
+    def clear(self):
+        self.backend.clear()
+        self.checked_at = None
+
+    def metrics(self):
+        lookups = self.stats.hits + self.stats.misses
+        return {
+            'hits': self.stats.hits,
+            'misses': self.stats.misses,
+            'hit_rate': round(self.stats.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.stats.evictions,
+            'invalidations': self.stats.invalidations,
+            'generations': self.generations,
+            **self.backend.info(),
+        }
+
+
+response_cache = ResponseCache(getattr(settings, 'API_RESPONSE_CACHE', None))
+
+
+def check_scopes(scopes):
+    unknown = set(scopes) - set(SCOPES)
+    if unknown:
+        raise ValueError(f"Unknown response cache scopes: {', '.join(sorted(unknown))}")
+
+
+def bump_generation(*scopes):
+    """Invalidate the cached responses that depend on any of `scopes` once the current transaction commits."""
+    if not scopes:
+        raise ValueError('bump_generation() needs at least one scope')
+    check_scopes(scopes)
+
+    def bump():
+        for scope in scopes:
+            SyncWatermark.objects.update_or_create(source=GENERATION_SOURCE, key=scope)
+    transaction.on_commit(bump)
+
+
+def cached_response(*scopes):
+    """Cache successful GET responses of a view, keyed by path, query string and Accept header.
+
+    `scopes` are what the view reads (every scope if none are given). Entries live until
+    the generation of one of them changes: the poller runs in its own process, so the
+    shared generations are the only invalidation that reaches the web workers.
+    Works on sync and async views alike.
+    """
+    check_scopes(scopes)
+    scopes = scopes or SCOPES
+
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def async_wrapped(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return await view(request, *args, **kwargs)
+                key = await response_cache.akey_for(request, scopes)
+                cached = response_cache.lookup(request, key)
+                if cached is not None:
+                    return cached
+                response = await view(request, *args, **kwargs)
+                response_cache.store(key, response, scopes)
+                return response
+            return async_wrapped
+
+        @functools.wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            key = response_cache.key_for(request, scopes)
+            cached = response_cache.lookup(request, key)
+            if cached is not None:
+                return cached
+            response = view(request, *args, **kwargs)
+            response_cache.store(key, response, scopes)
+            return response
+        return wrapped
+    return decorator
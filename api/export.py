@@ -0,0 +1,89 @@
+# api/export.py
+import csv
+from datetime import datetime, time
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Card, Hero, HeroScore
+
+CHUNK_SIZE = 2000
+
+
+def concrete_fields(model, exclude=()):
+    return [field.attname for field in model._meta.concrete_fields if field.name not in exclude]
+
+
+# dataset -> (model, exported columns, column filtered by ?since=)
+EXPORTS = {
+    'heroes': (Hero, concrete_fields(Hero, exclude=['market_snapshot']), 'updated_at'),
+    'cards': (Card, concrete_fields(Card), 'updated_at'),
+    'hero-scores': (HeroScore, ['hero_id', 'date', 'score'], 'date'),
+}
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def parse_since(value, date_only=False):
+    """A date or datetime for `since=`; dates are the start of that day. Raises ValueError."""
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        return day if date_only else timezone.make_aware(datetime.combine(day, time.min))
+    if date_only:
+        return parsed.date()
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+
+def export_rows(dataset, since=None):
+    """Stream (columns, row iterator) for a dataset; rows are tuples read `CHUNK_SIZE` at a time."""
+    model, columns, since_field = EXPORTS[dataset]
+    rows = model.objects.order_by('pk')
+    if since is not None:
+        # Walk the since_field index rather than scanning the table for recent rows
+        rows = model.objects.filter(**{f'{since_field}__gte': since}).order_by(since_field)
+    return columns, rows.values_list(*columns).iterator(chunk_size=CHUNK_SIZE)
+
+
+class Echo:
+    """File-like object whose write() hands the line back, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def encode_ndjson(columns, rows):
+    encoder = DjangoJSONEncoder(separators=(',', ':'), ensure_ascii=False)
+    lines = []
+    for row in rows:
+        lines.append(encoder.encode(dict(zip(columns, row))) + '\n')
+        if len(lines) >= CHUNK_SIZE:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+def encode_csv(columns, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    lines = []
+    for row in rows:
+        lines.append(writer.writerow(row))
+        if len(lines) >= CHUNK_SIZE:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+ENCODERS = {
+    'ndjson': encode_ndjson,
+    'csv': encode_csv,
+}
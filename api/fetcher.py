@@ -0,0 +1,105 @@
+# api/fetcher.py
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Thread-safe requests-per-second budget shared by every worker of a fetcher."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        # A 429 throttles the whole pool, not just the worker that received it
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+
+def parse_retry_after(value, default=1.0):
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class DetailFetcher:
+    """Fetches JSON documents for many keys concurrently within a rate budget.
+
+    `path_template` is formatted with each key and requested through an UpstreamClient,
+    e.g. '/hero/{}'. `params`, if given, maps a key to its query parameters, which is
+    how pages of a listing are fetched. At most `max_in_flight` requests run at once
+    and no more than `rate` start per second. With `conditional`, requests revalidate
+    against the client's response cache and the responses themselves are returned
+    unparsed (see UpstreamClient.get).
+    """
+
+    def __init__(self, client, path_template, rate=5.0, max_in_flight=4, max_retries=3, params=None, conditional=False):
+        self.client = client
+        self.path_template = path_template
+        self.params = params
+        self.conditional = conditional
+        self.bucket = TokenBucket(rate)
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+
+    def fetch(self, key):
+        path = self.path_template.format(key)
+        params = self.params(key) if self.params else None
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            response = self.client.get(path, params=params, endpoint=self.path_template, conditional=self.conditional)
+            if response.status_code == 429 and attempt < self.max_retries:
+                delay = parse_retry_after(response.headers.get('Retry-After'), default=2.0 ** attempt)
+                logger.warning(f"Rate limited on {path}, retrying in {delay:.1f}s")
+                self.bucket.pause(delay)
+                continue
+            response.raise_for_status()
+            return response if self.conditional else response.json()
+
+    def fetch_all(self, keys):
+        """Yield (key, data, error) tuples in completion order."""
+        keys = list(keys)
+        if not keys:
+            return
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            futures = {executor.submit(self.fetch, key): key for key in keys}
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    yield key, future.result(), None
+                except Exception as e:
+                    yield key, None, e
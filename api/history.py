@@ -0,0 +1,174 @@
+# api/history.py
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from .models import FloorPrice, HeroStatHistory, HighestBid, Hero, HistoryResolution, MarketPriceHistory
+
+BATCH_SIZE = 500
+
+HERO_STAT_FIELDS = ['stars', 'current_rank', 'fantasy_score', 'volume', 'last_sale']
+MARKET_PRICE_FIELDS = ['rarity', 'floor_price', 'highest_bid']
+
+# How long rows of each resolution are kept; day rows are kept forever.
+# A range query uses the finest resolution still covering its start.
+RETENTION = {
+    HistoryResolution.RAW: timedelta(days=2),
+    HistoryResolution.HOUR: timedelta(days=90),
+    HistoryResolution.DAY: None,
+}
+
+# An unchanged hero still gets a raw row this often, so a recent raw range has a point to start from
+RAW_HEARTBEAT = timedelta(hours=1)
+
+# The resolution that takes over once a pruned resolution's rows are gone
+NEXT_RESOLUTION = {
+    HistoryResolution.RAW: HistoryResolution.HOUR,
+    HistoryResolution.HOUR: HistoryResolution.DAY,
+}
+
+
+def bucket_start(ts, resolution):
+    if resolution == HistoryResolution.HOUR:
+        return ts.replace(minute=0, second=0, microsecond=0)
+    if resolution == HistoryResolution.DAY:
+        return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    return ts
+
+
+def last_raw_ts(model):
+    """Timestamp of the hero's latest raw row in `model`: one seek on the (hero, resolution, ts) index."""
+    return Subquery(
+        model.objects.filter(hero_id=OuterRef('pk'), resolution=HistoryResolution.RAW).order_by('-ts').values('ts')[:1]
+    )
+
+
+def last_raw_samples(model, fields, last_ts):
+    """{hero_id: set of `fields` tuples} of the raw rows each hero has at its `last_ts` timestamp."""
+    samples = {}
+    rows = model.objects.filter(
+        resolution=HistoryResolution.RAW, hero_id__in=list(last_ts), ts__in=set(last_ts.values()),
+    ).values_list('hero_id', 'ts', *fields)
+    for hero_id, ts, *values in rows:
+        # Heroes sampled together share timestamps, so the ts__in above can match other heroes' samples
+        if ts == last_ts[hero_id]:
+            samples.setdefault(hero_id, set()).add(tuple(values))
+    return samples
+
+
+def record_history(ts=None):
+    """Append the current stats and market prices of every HERO to the history tables.
+
+    A hero's stats, and its market prices, are written as raw rows only when they differ
+    from its previous raw sample or that one is RAW_HEARTBEAT old, so an idle hero does
+    not grow the table every poll.
+    Every sample is upserted into its hour and day buckets, so the rollups always end
+    with the latest sample and a range query never has to mix resolutions.
+    Returns the number of heroes and market rows sampled and of raw rows written.
+
+    Only the history endpoints read these tables and they are not in the response
+    cache, so a sample leaves the cache generation alone.
+    """
+    ts = ts or timezone.now()
+    rows = Hero.objects.filter(status='HERO').annotate(
+        last_stats_ts=last_raw_ts(HeroStatHistory), last_prices_ts=last_raw_ts(MarketPriceHistory),
+    ).values_list('id', *HERO_STAT_FIELDS, 'last_stats_ts', 'last_prices_ts')
+    heroes = []
+    last_stats_ts = {}
+    last_prices_ts = {}
+    for hero_id, stars, current_rank, fantasy_score, volume, last_sale, stats_ts, prices_ts in rows:
+        heroes.append((hero_id, stars, current_rank, fantasy_score, None if volume is None else float(volume), last_sale))
+        if stats_ts is not None:
+            last_stats_ts[hero_id] = stats_ts
+        if prices_ts is not None:
+            last_prices_ts[hero_id] = prices_ts
+    hero_ids = [row[0] for row in heroes]
+    prices = {}
+    for hero_id, rarity, price in FloorPrice.objects.filter(hero_id__in=hero_ids).values_list('hero_id', 'rarity', 'price'):
+        prices[(hero_id, rarity)] = [price, None]
+    for hero_id, rarity, price in HighestBid.objects.filter(hero_id__in=hero_ids).values_list('hero_id', 'rarity', 'price'):
+        prices.setdefault((hero_id, rarity), [None, None])[1] = price
+
+    previous_stats = last_raw_samples(HeroStatHistory, HERO_STAT_FIELDS, last_stats_ts)
+    due = lambda last_ts, hero_id: hero_id not in last_ts or ts - last_ts[hero_id] >= RAW_HEARTBEAT
+    changed_stats = [row for row in heroes if previous_stats.get(row[0]) != {row[1:]} or due(last_stats_ts, row[0])]
+    current_prices = {}
+    for (hero_id, rarity), (floor_price, highest_bid) in prices.items():
+        current_prices.setdefault(hero_id, set()).add((rarity, floor_price, highest_bid))
+    previous_prices = last_raw_samples(MarketPriceHistory, MARKET_PRICE_FIELDS, last_prices_ts)
+    changed_prices = {
+        key: value for key, value in prices.items()
+        if previous_prices.get(key[0]) != current_prices[key[0]] or due(last_prices_ts, key[0])
+    }
+
+    with transaction.atomic():
+        for resolution in HistoryResolution:
+            bucket = bucket_start(ts, resolution)
+            raw = resolution == HistoryResolution.RAW
+            HeroStatHistory.objects.bulk_create(
+                [
+                    HeroStatHistory(
+                        hero_id=hero_id, resolution=resolution, ts=bucket, stars=stars, current_rank=current_rank,
+                        fantasy_score=fantasy_score, volume=volume, last_sale=last_sale,
+                    )
+                    for hero_id, stars, current_rank, fantasy_score, volume, last_sale in (changed_stats if raw else heroes)
+                ],
+                batch_size=BATCH_SIZE,
+                update_conflicts=True,
+                unique_fields=['hero', 'resolution', 'ts'],
+                update_fields=HERO_STAT_FIELDS,
+            )
+            MarketPriceHistory.objects.bulk_create(
+                [
+                    MarketPriceHistory(
+                        hero_id=hero_id, resolution=resolution, ts=bucket, rarity=rarity,
+                        floor_price=floor_price, highest_bid=highest_bid,
+                    )
+                    for (hero_id, rarity), (floor_price, highest_bid) in (changed_prices if raw else prices).items()
+                ],
+                batch_size=BATCH_SIZE,
+                update_conflicts=True,
+                unique_fields=['hero', 'resolution', 'ts', 'rarity'],
+                update_fields=['floor_price', 'highest_bid'],
+            )
+
+    return {
+        'heroes': len(heroes), 'prices': len(prices), 'raw_heroes': len(changed_stats), 'raw_prices': len(changed_prices),
+    }
+
+
+def prune_history(now=None):
+    """Delete rows past their resolution's retention. Returns {resolution label: rows deleted}."""
+    now = now or timezone.now()
+    deleted = {}
+    with transaction.atomic():
+        for resolution, retention in RETENTION.items():
+            if retention is None:
+                continue
+            # Cut on a bucket boundary of the next resolution, so a pruned period is always
+            # covered by whole buckets there
+            cutoff = bucket_start(now - retention, NEXT_RESOLUTION[resolution])
+            count = 0
+            for model in (HeroStatHistory, MarketPriceHistory):
+                count += model.objects.filter(resolution=resolution, ts__lt=cutoff).delete()[0]
+            deleted[resolution.label] = count
+    return deleted
+
+
+def resolution_for(start, now=None):
+    """The finest resolution whose rows still reach back to `start`."""
+    now = now or timezone.now()
+    for resolution, retention in RETENTION.items():
+        if retention is None or start >= now - retention:
+            return resolution
+    return HistoryResolution.DAY
+
+
+def history_points(model, fields, hero_id, resolution, start, end, ordering=('ts',), **filters):
+    """Rows of one hero between `start` and `end` (inclusive), oldest first, read through the (hero, resolution, ts) index."""
+    rows = model.objects.filter(
+        hero_id=hero_id, resolution=resolution, ts__gte=start, ts__lte=end, **filters
+    ).order_by(*ordering).values_list('ts', *fields)
+    return [dict(zip(('ts', *fields), row)) for row in rows]
@@ -0,0 +1,441 @@
+# api/ingest.py
+import hashlib
+import json
+import logging
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from .analytics import update_score_matrix
+from .cache import bump_generation
+from .models import Card, Hero, HeroScore, FloorPrice, HighestBid, CardSupply, SyncWatermark, TournamentScore
+
+BATCH_SIZE = 500
+
+HERO_SOURCE = 'portal.hero'
+HERO_DETAIL_SOURCE = 'portal.hero_detail'
+TOURNAMENT_SOURCE = 'huddle.tournament'
+CARD_SOURCE = 'portal.card'
+
+HERO_SCORE_SUMMARY_FIELDS = ['current_score', 'median_7_days', 'median_14_days', 'change_1_day', 'change_7_days']
+
+
+def payload_hash(*parts):
+    """Stable content hash of upstream JSON payloads, used to skip unchanged rows."""
+    encoded = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def load_watermarks(source, keys):
+    return dict(SyncWatermark.objects.filter(source=source, key__in=list(keys)).values_list('key', 'content_hash'))
+
+
+def save_watermarks(source, hashes, updated_at=None):
+    """Upsert {key: content_hash} watermarks for `source` in one statement."""
+    updated_at = updated_at or {}
+    SyncWatermark.objects.bulk_create(
+        [
+            SyncWatermark(source=source, key=key, content_hash=content_hash, upstream_updated_at=updated_at.get(key))
+            for key, content_hash in hashes.items()
+        ],
+        batch_size=BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['source', 'key'],
+        update_fields=['content_hash', 'upstream_updated_at', 'updated_at'],
+    )
+
+
+def get_source_watermark(source):
+    return SyncWatermark.objects.filter(source=source, key='').values_list('upstream_updated_at', flat=True).first()
+
+
+def get_source_cursor(source):
+    """(upstream_updated_at, id) of the last row a keyset crawl of `source` wrote, or None."""
+    return SyncWatermark.objects.filter(source=source, key='', upstream_updated_at__isnull=False).values_list('upstream_updated_at', 'cursor').first()
+
+
+def set_source_watermark(source, upstream_updated_at, cursor=''):
+    SyncWatermark.objects.update_or_create(
+        source=source, key='', defaults={'upstream_updated_at': upstream_updated_at, 'cursor': cursor},
+    )
+
+
+def validate_fields(model, values):
+    """Clean `values` in place against the model fields and return {field: message} for rejected ones."""
+    errors = {}
+    for name in list(values):
+        field = model._meta.get_field(name)
+        try:
+            value = field.to_python(values[name])
+            if value is None and not field.null:
+                raise ValidationError(field.error_messages['null'], code='null')
+            field.run_validators(value)
+        except ValidationError as e:
+            errors[name] = '; '.join(e.messages)
+        else:
+            values[name] = value
+    return errors
+
+
+def _dedupe(rows, key_fields):
+    # ON CONFLICT cannot touch the same row twice in one statement; the last payload entry wins
+    return list({tuple(row[field] for field in key_fields): row for row in rows}.values())
+
+
+def bulk_upsert(model, rows, key_fields, update_fields, scope):
+    """Insert or update `rows` (dicts of field values) matched on `key_fields`.
+
+    Existing keys are looked up with a single query restricted by `scope`, so the
+    whole batch costs one SELECT plus one bulk INSERT and one bulk UPDATE.
+    """
+    if not rows:
+        return 0, 0
+
+    existing = {}
+    for pk, *key in model.objects.filter(**scope).values_list('pk', *key_fields):
+        existing.setdefault(tuple(key), []).append(pk)
+
+    to_create = []
+    to_update = []
+    for row in rows:
+        pks = existing.get(tuple(row[field] for field in key_fields))
+        if pks:
+            to_update.extend(model(**{**row, 'pk': pk}) for pk in pks)
+        else:
+            to_create.append(model(**row))
+
+    model.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+    if to_update:
+        model.objects.bulk_update(to_update, update_fields, batch_size=BATCH_SIZE)
+    return len(to_create), len(to_update)
+
+
+# Market tables and the columns copied into Hero.market_snapshot
+MARKET_SNAPSHOT_FIELDS = (
+    ('floor_prices', FloorPrice, ('rarity', 'price')),
+    ('highest_bids', HighestBid, ('rarity', 'price')),
+    ('card_supplies', CardSupply, ('rarity', 'amount', 'burnt', 'total')),
+)
+
+
+def build_market_snapshots(hero_ids):
+    """{hero_id: market snapshot} read from the market tables, one query per table."""
+    snapshots = {hero_id: {key: [] for key, _, _ in MARKET_SNAPSHOT_FIELDS} for hero_id in hero_ids}
+    for key, model, fields in MARKET_SNAPSHOT_FIELDS:
+        rows = model.objects.filter(hero_id__in=hero_ids).order_by('hero_id', 'rarity').values('hero_id', *fields)
+        for row in rows:
+            snapshots[row.pop('hero_id')][key].append(row)
+    return snapshots
+
+
+class HeroPageWriter:
+    """Collects one fetched page of heroes and their market data and writes it in one transaction.
+
+    Only the hero fields passed to `add()` are written, so list pages and detail
+    batches can be written separately. Content hashes are saved under `source`.
+    Rows that fail field validation are reported in `errors` ({hero_id: {field: message}})
+    and left out of the batch instead of being retried one by one.
+    """
+
+    def __init__(self, source=HERO_SOURCE):
+        self.source = source
+        self._reset()
+
+    def _reset(self):
+        self.heroes = []
+        self.floor_prices = []
+        self.highest_bids = []
+        self.card_supplies = []
+        self.market_hero_ids = []
+        self.hashes = {}
+        self.upstream_updated_at = {}
+        self.errors = {}
+
+    def add(self, hero_id, hero_defaults, hero_detail_data=None, content_hash=None):
+        has_market_data = hero_detail_data is not None
+        hero_detail_data = hero_detail_data or {}
+        hero_row = {'id': hero_id, **hero_defaults}
+        floor_prices = [
+            {'hero_id': hero_id, 'rarity': fp['rarity'], 'price': fp['price']}
+            for fp in hero_detail_data.get('floor_prices', [])
+        ]
+        highest_bids = [
+            {'hero_id': hero_id, 'rarity': hb['rarity'], 'price': hb['price']}
+            for hb in hero_detail_data.get('highest_bids', [])
+        ]
+        card_supplies = [
+            {'hero_id': hero_id, 'rarity': cs['rarity'], 'amount': cs['amount'], 'burnt': cs['burnt'], 'total': cs['total']}
+            for cs in hero_detail_data.get('card_supply', [])
+        ]
+
+        errors = validate_fields(Hero, hero_row)
+        for prefix, model, rows in (
+            ('floor_prices', FloorPrice, floor_prices),
+            ('highest_bids', HighestBid, highest_bids),
+            ('card_supply', CardSupply, card_supplies),
+        ):
+            for row in rows:
+                for field, message in validate_fields(model, row).items():
+                    errors[f"{prefix}[{row['rarity']}].{field}"] = message
+
+        if errors:
+            self.errors[hero_id] = errors
+            return False
+
+        self.heroes.append(hero_row)
+        self.floor_prices.extend(floor_prices)
+        self.highest_bids.extend(highest_bids)
+        self.card_supplies.extend(card_supplies)
+        if has_market_data:
+            self.market_hero_ids.append(hero_id)
+        if content_hash:
+            # Recorded in the same transaction as the rows, so a failed page is retried next cycle
+            self.hashes[hero_id] = content_hash
+            self.upstream_updated_at[hero_id] = hero_row.get('updated_at')
+        return True
+
+    def flush(self):
+        """Write the collected page and reset the writer, `errors` included. Returns the number of heroes written."""
+        if not self.heroes:
+            self._reset()
+            return 0
+
+        now = timezone.now()
+        for row in self.heroes:
+            # bulk_update() bypasses auto_now, so stamp it the way save() would.
+            # The upstream value is kept on the watermark instead.
+            row['updated_at'] = now
+        # A list page mixes heroes with and without detail fields; each shape keeps its own columns
+        shapes = {}
+        for row in self.heroes:
+            shapes.setdefault(tuple(field for field in row if field != 'id'), []).append(row)
+
+        with transaction.atomic():
+            for hero_fields, rows in shapes.items():
+                bulk_upsert(Hero, rows, ('id',), list(hero_fields), {'id__in': [row['id'] for row in rows]})
+            # (hero, rarity) is unique, so market rows upsert with a single INSERT ... ON CONFLICT
+            for model, rows, update_fields in (
+                (FloorPrice, self.floor_prices, ['price']),
+                (HighestBid, self.highest_bids, ['price']),
+                (CardSupply, self.card_supplies, ['amount', 'burnt', 'total']),
+            ):
+                model.objects.bulk_create(
+                    [model(**row) for row in _dedupe(rows, ('hero_id', 'rarity'))],
+                    batch_size=BATCH_SIZE,
+                    update_conflicts=True,
+                    unique_fields=['hero', 'rarity'],
+                    update_fields=update_fields,
+                )
+            if self.market_hero_ids:
+                # Rebuilt from the tables so rarities missing from this payload are still included
+                snapshots = build_market_snapshots(self.market_hero_ids)
+                Hero.objects.bulk_update(
+                    [Hero(id=hero_id, market_snapshot=snapshot) for hero_id, snapshot in snapshots.items()],
+                    ['market_snapshot'],
+                    batch_size=BATCH_SIZE,
+                )
+            if self.hashes:
+                save_watermarks(self.source, self.hashes, self.upstream_updated_at)
+            if self.source != HERO_DETAIL_SOURCE and self.market_hero_ids:
+                # Detail fields written from elsewhere (the list's defaults for non-HEROes) make the
+                # detail hash stale: the next detail fetch of these heroes must not be skipped
+                SyncWatermark.objects.filter(source=HERO_DETAIL_SOURCE, key__in=self.market_hero_ids).delete()
+            bump_generation('heroes')
+
+        written = len(self.heroes)
+        self._reset()
+        return written
+
+
+def safe_float(value, hero_id, default=0.0):
+    # Convert string fields to float, handling None values
+    try:
+        return float(value) if value is not None else default
+    except ValueError:
+        logging.warning(f"Could not convert {value} to float for hero {hero_id}")
+        return default
+
+
+def ingest_hero_scores(hero_data_list):
+    """Apply a huddle heroes-scores payload with a constant number of queries.
+
+    Existing (hero, date) scores are loaded in one query and diffed against the
+    payload: only new dates are inserted and only changed scores are updated.
+    Hero summary fields are written with a single bulk_update.
+    """
+    summaries = {}
+    scores = {}
+    names = {}
+    for hero_data in hero_data_list:
+        hero_id = hero_data.get('hero_id')
+        names[hero_id] = hero_data.get('name')
+        summaries[hero_id] = {
+            field: safe_float(hero_data.get(field), hero_id) for field in HERO_SCORE_SUMMARY_FIELDS
+        }
+        hero_scores = scores[hero_id] = {}
+        for date_str, score_str in zip(hero_data.get('dates', []), hero_data.get('data', [])):
+            try:
+                date = datetime.strptime(date_str[:10], '%Y-%m-%d').date()
+            except (TypeError, ValueError) as e:
+                logging.warning(f"Error processing date or score for hero {hero_id}: {e}")
+                continue
+            hero_scores[date] = safe_float(score_str, hero_id)
+
+    heroes = {hero.id: hero for hero in Hero.objects.filter(id__in=list(summaries)).only('id', 'name', *HERO_SCORE_SUMMARY_FIELDS)}
+    for hero_id in summaries.keys() - heroes.keys():
+        logging.warning(f"Hero not found: id={hero_id}, name={names[hero_id]}")
+
+    existing = {}
+    for pk, hero_id, date, score in HeroScore.objects.filter(hero_id__in=list(heroes)).values_list('pk', 'hero_id', 'date', 'score'):
+        existing[(hero_id, date)] = (pk, score)
+
+    now = timezone.now()
+    to_create = []
+    to_update = []
+    changes = []
+    for hero_id in heroes:
+        for date, score in scores[hero_id].items():
+            current = existing.get((hero_id, date))
+            if current is None:
+                to_create.append(HeroScore(hero_id=hero_id, date=date, score=score, updated_at=now))
+            elif current[1] != score:
+                # bulk_update() skips auto_now, and the score matrix reloads by updated_at
+                to_update.append(HeroScore(pk=current[0], score=score, updated_at=now))
+            else:
+                continue
+            changes.append((hero_id, date, score))
+
+    changed_heroes = []
+    for hero_id, hero in heroes.items():
+        values = dict(summaries[hero_id])
+        if names[hero_id]:
+            values['name'] = names[hero_id]
+        if any(getattr(hero, field) != value for field, value in values.items()):
+            for field, value in values.items():
+                setattr(hero, field, value)
+            hero.updated_at = now
+            changed_heroes.append(hero)
+
+    with transaction.atomic():
+        HeroScore.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+        HeroScore.objects.bulk_update(to_update, ['score', 'updated_at'], batch_size=BATCH_SIZE)
+        Hero.objects.bulk_update(changed_heroes, ['name', 'updated_at', *HERO_SCORE_SUMMARY_FIELDS], batch_size=BATCH_SIZE)
+        if changes or changed_heroes:
+            bump_generation(*(['scores'] if changes else []), *(['heroes'] if changed_heroes else []))
+    update_score_matrix(changes)
+
+    return {
+        'heroes': len(heroes),
+        'heroes_updated': len(changed_heroes),
+        'scores_created': len(to_create),
+        'scores_updated': len(to_update),
+    }
+
+
+def ingest_tournament_scores(items):
+    """Sync huddle tournament score arrays onto TournamentScore(hero, index) rows.
+
+    Heroes whose array hash matches the stored watermark are skipped. For the rest the
+    delta against the stored rows is applied with bulk insert/update/delete in one
+    transaction, so readers see either the old array or the new one.
+    """
+    arrays = {item.get('hero_id'): (item.get('name'), item.get('data', [])) for item in items}
+    known_ids = set(Hero.objects.filter(id__in=list(arrays)).values_list('id', flat=True))
+    for hero_id in arrays.keys() - known_ids:
+        logging.warning(f"Hero not found: id={hero_id}, name={arrays[hero_id][0]}")
+
+    hashes = {hero_id: payload_hash(arrays[hero_id][1]) for hero_id in known_ids}
+    known_hashes = load_watermarks(TOURNAMENT_SOURCE, hashes)
+    changed = {hero_id: content_hash for hero_id, content_hash in hashes.items() if known_hashes.get(hero_id) != content_hash}
+
+    existing = {}
+    for pk, hero_id, index, score in TournamentScore.objects.filter(hero_id__in=list(changed)).values_list('pk', 'hero_id', 'index', 'score'):
+        existing[(hero_id, index)] = (pk, score)
+
+    to_create = []
+    to_update = []
+    for hero_id in changed:
+        for index, score in enumerate(arrays[hero_id][1]):
+            current = existing.pop((hero_id, index), None)
+            if current is None:
+                to_create.append(TournamentScore(hero_id=hero_id, index=index, score=score))
+            elif current[1] != score:
+                to_update.append(TournamentScore(pk=current[0], score=score))
+    # Whatever is left is past the end of the new arrays
+    to_delete = [pk for pk, _ in existing.values()]
+
+    with transaction.atomic():
+        TournamentScore.objects.filter(pk__in=to_delete).delete()
+        TournamentScore.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+        TournamentScore.objects.bulk_update(to_update, ['score'], batch_size=BATCH_SIZE)
+        if changed:
+            save_watermarks(TOURNAMENT_SOURCE, changed)
+            bump_generation('tournaments')
+
+    return {
+        'heroes': len(known_ids),
+        'heroes_changed': len(changed),
+        'scores_created': len(to_create),
+        'scores_updated': len(to_update),
+        'scores_deleted': len(to_delete),
+    }
+
+
+CARD_FIELDS = [
+    'owner', 'hero_id', 'rarity', 'hero_rarity_index', 'token_id', 'season', 'created_at', 'updated_at',
+    'tx_hash', 'blocknumber', 'timestamp', 'picture',
+]
+
+
+def build_card_row(card_data):
+    return {
+        'id': card_data['id'],
+        'owner': card_data.get('owner', ''),
+        'hero_id': card_data.get('hero_id', ''),
+        'rarity': card_data.get('rarity', 0),
+        'hero_rarity_index': card_data.get('hero_rarity_index', ''),
+        'token_id': card_data.get('token_id', ''),
+        'season': card_data.get('season', 0),
+        'created_at': card_data.get('created_at'),
+        'updated_at': card_data.get('updated_at'),
+        'tx_hash': card_data.get('tx_hash', ''),
+        'blocknumber': card_data.get('blocknumber', 0),
+        'timestamp': card_data.get('timestamp'),
+        'picture': card_data.get('picture', ''),
+    }
+
+
+def ingest_cards(items, save_checkpoint=True):
+    """Upsert one page of portal cards with a single INSERT ... ON CONFLICT.
+
+    The card crawl walks the portal in (`updated_at`, `id`) order. With `save_checkpoint`,
+    the last valid card of the page is saved as the CARD_SOURCE cursor in the same
+    transaction, so an interrupted crawl resumes right after the last card written. Rows
+    that fail field validation are reported in `errors` ({card_id: {field: message}}) and skipped.
+    """
+    rows = []
+    errors = {}
+    for card_data in items:
+        row = build_card_row(card_data)
+        row_errors = validate_fields(Card, row)
+        if row_errors:
+            errors[row['id']] = row_errors
+        else:
+            rows.append(row)
+
+    with transaction.atomic():
+        Card.objects.bulk_create(
+            [Card(**row) for row in _dedupe(rows, ('id',))],
+            batch_size=BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['id'],
+            update_fields=CARD_FIELDS,
+        )
+        if rows:
+            if save_checkpoint:
+                set_source_watermark(CARD_SOURCE, rows[-1]['updated_at'], rows[-1]['id'])
+            bump_generation('cards')
+
+    return {'cards': len(rows), 'errors': errors}
@@ -0,0 +1,119 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from datetime import date, datetime, time as day_start, timedelta, timezone as dt_timezone
+from concurrent.futures import ProcessPoolExecutor
+from api import backtest
+from api.analytics import HeroScoreMatrix
+from api.models import HeroStatHistory, HistoryResolution
+from api.predictions import DEFAULT_STAR_BUCKETS, star_buckets
+import os
+import time
+
+
+def parse_numbers(value):
+    return [float(number) for number in value.split(',') if number.strip()]
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay the daily hero snapshots and scores in the database through the star swing predictions '
+        'and report the precision and recall of the gainer and loser calls. '
+        'Set DATABASE_PATH to run against a copy or fixture of the production database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help='First day to predict from, YYYY-MM-DD (default: the first recorded day)')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last day to predict from, YYYY-MM-DD (default: the last day with a full horizon)')
+        parser.add_argument('--step', type=int, default=1, help='Days between prediction points')
+        parser.add_argument('--horizon', type=int, default=7, help='Days after a prediction its calls are checked against the recorded stars')
+        parser.add_argument('--limit', type=int, default=20, help='Calls per side at each point, as in predict_star_swings')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes; 1 runs every point in this process')
+        parser.add_argument('--thresholds', type=parse_numbers, help='Comma separated percentile thresholds to try instead of STAR_SWING_BUCKETS')
+        parser.add_argument('--stars', type=parse_numbers, help='Comma separated stars per bucket, one more than the thresholds')
+
+    def handle(self, *args, **options):
+        if options['step'] < 1 or options['horizon'] < 1 or options['limit'] < 1 or options['workers'] < 1:
+            raise CommandError('--step, --horizon, --limit and --workers must be positive')
+        configured = getattr(settings, 'STAR_SWING_BUCKETS', DEFAULT_STAR_BUCKETS)
+        try:
+            buckets = star_buckets({
+                'THRESHOLDS': options['thresholds'] or configured['THRESHOLDS'],
+                'STARS': options['stars'] or configured['STARS'],
+            })
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        points = self.load_points(options['start'], options['end'], options['step'], options['horizon'])
+        if not points:
+            raise CommandError('No recorded day has a day snapshot `--horizon` days later; run poll_data longer or widen the range')
+        matrix = HeroScoreMatrix.from_db()
+        self.stdout.write(
+            f"{len(points)} points, {options['horizon']} day horizon, thresholds {buckets[0].tolist()} stars {buckets[1].tolist()}"
+        )
+
+        started = time.perf_counter()
+        results = self.run_points(points, backtest.matrix_state(matrix), buckets, options['limit'], options['workers'])
+        wall = time.perf_counter() - started
+
+        self.stdout.write(f"{'date':<12}{'heroes':>8}{'gainers':>16}{'losers':>16}{'ms':>10}")
+        for result in results:
+            sides = [
+                f"{result[side]['hits']}/{result[side]['calls']} of {result[side]['movers']}"
+                for side in backtest.SIDES
+            ]
+            self.stdout.write(f"{result['ts'].date().isoformat():<12}{result['heroes']:>8}{sides[0]:>16}{sides[1]:>16}{result['seconds'] * 1000:>10.2f}")
+
+        summary = backtest.summarize(results)
+        for side in backtest.SIDES:
+            totals = summary[side]
+            self.stdout.write(self.style.SUCCESS(
+                f"{side}: precision {self.percent(totals['precision'])} ({totals['hits']}/{totals['calls']} calls), "
+                f"recall {self.percent(totals['recall'])} ({totals['hits']}/{totals['movers']} movers)"
+            ))
+        self.stdout.write(
+            f"Prediction time per point: mean {summary['seconds']['mean'] * 1000:.2f} ms, max {summary['seconds']['max'] * 1000:.2f} ms; "
+            f"wall clock {wall:.2f} s on {min(options['workers'], len(points))} worker(s)"
+        )
+
+    def percent(self, value):
+        return 'n/a' if value is None else f'{value:.1%}'
+
+    def load_points(self, start, end, step, horizon):
+        """[(ts, rows, later_stars)] for each prediction point, from the day rows of HeroStatHistory."""
+        days = HeroStatHistory.objects.filter(resolution=HistoryResolution.DAY)
+        if start:
+            days = days.filter(ts__gte=datetime.combine(start, day_start(), dt_timezone.utc))
+        if end:
+            # Horizon ends may fall past --end
+            days = days.filter(ts__lte=datetime.combine(end, day_start(), dt_timezone.utc) + timedelta(days=horizon))
+        recorded = list(days.order_by('ts').values_list('ts', flat=True).distinct())
+        pairs = backtest.horizon_pairs(recorded, step, horizon)
+        if end:
+            pairs = [(ts, later) for ts, later in pairs if ts.date() <= end]
+
+        snapshots = {}
+        needed = {ts for pair in pairs for ts in pair}
+        rows = HeroStatHistory.objects.filter(resolution=HistoryResolution.DAY, ts__in=needed, stars__isnull=False)
+        for ts, hero_id, current_rank, fantasy_score, stars in rows.values_list('ts', 'hero_id', 'current_rank', 'fantasy_score', 'stars'):
+            snapshots.setdefault(ts, []).append((hero_id, current_rank, fantasy_score, stars))
+
+        points = []
+        for ts, later in pairs:
+            # predict_star_swings orders by current_rank, which puts unranked heroes first on SQLite.
+            # History has no medians or daily changes; the hero id stands in for the name.
+            heroes = sorted(snapshots.get(ts, []), key=lambda hero: (hero[1] is not None, hero[1] or 0, hero[0]))
+            rows = [(hero_id, hero_id, rank, score, stars, None, None, None, None) for hero_id, rank, score, stars in heroes]
+            later_stars = {hero_id: stars for hero_id, _, _, stars in snapshots.get(later, [])}
+            points.append((ts, rows, later_stars))
+        return points
+
+    def run_points(self, points, state, buckets, limit, workers):
+        columns = list(zip(*points))
+        if workers == 1:
+            backtest.init_worker(state, buckets, limit)
+            return list(map(backtest.evaluate_point, *columns))
+        # Forked workers must not share this process's database connection
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=min(workers, len(points)), initializer=backtest.init_worker, initargs=(state, buckets, limit)) as executor:
+            return list(executor.map(backtest.evaluate_point, *columns, chunksize=max(1, len(points) // (workers * 4))))
@@ -0,0 +1,151 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Avg
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from api import async_views, views
+from api.analytics import HeroScoreMatrix, get_score_matrix, performance_change, window_averages
+from api.cache import response_cache
+from api.search import get_search_index
+from api.models import Hero, HeroScore
+from api.serializers import HeroSerializer, ValuesSerializer
+from asgiref.sync import async_to_sync, sync_to_async
+from django.test import AsyncRequestFactory
+from rest_framework.renderers import JSONRenderer
+from datetime import timedelta
+import asyncio
+import time
+
+
+class Command(BaseCommand):
+    help = 'Time hot code paths against the implementations they replaced, on the current database'
+
+    suites = ['performance', 'matrix', 'serializers', 'load']
+
+    def add_arguments(self, parser):
+        parser.add_argument('suite', nargs='*', help=f"Suites to run: {', '.join(self.suites)} (default: all)")
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per implementation; the best time is reported')
+        parser.add_argument('--concurrency', type=int, default=200, help='Concurrent requests per round in the load suite')
+
+    def handle(self, *args, **options):
+        for suite in options['suite'] or self.suites:
+            if suite not in self.suites:
+                raise CommandError(f"Unknown suite '{suite}'. Choose from: {', '.join(self.suites)}")
+            self.stdout.write(self.style.SUCCESS(f'== {suite} =='))
+            getattr(self, f'bench_{suite}')(**options)
+
+    def measure(self, label, func, repeat):
+        best = None
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                result = func()
+                elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        self.stdout.write(f'{label:<40} {best * 1000:>10.2f} ms {len(queries):>8} queries')
+        return result, best
+
+    def bench_performance(self, repeat, **options):
+        hero_ids = list(Hero.objects.filter(status='HERO').values_list('id', flat=True))
+        self.stdout.write(f'{len(hero_ids)} HERO heroes')
+
+        def per_hero():
+            # The two aggregate() queries per hero that predict_star_swings and hero_performance used to run
+            now = timezone.now()
+            changes = {}
+            for hero_id in hero_ids:
+                seven_day_avg = HeroScore.objects.filter(
+                    hero_id=hero_id, date__gte=now - timedelta(days=7)
+                ).aggregate(Avg('score'))['score__avg'] or 0
+                thirty_day_avg = HeroScore.objects.filter(
+                    hero_id=hero_id, date__gte=now - timedelta(days=30)
+                ).aggregate(Avg('score'))['score__avg'] or 0
+                changes[hero_id] = (seven_day_avg - thirty_day_avg) / thirty_day_avg if thirty_day_avg else 0
+            return changes
+
+        def grouped():
+            averages = window_averages(hero_ids)
+            return {hero_id: performance_change(averages.get(hero_id)) for hero_id in hero_ids}
+
+        expected, old = self.measure('per-hero aggregate (N+1)', per_hero, repeat)
+        result, new = self.measure('window_averages (grouped)', grouped, repeat)
+        self.report(old, new, all(abs(result[k] - expected[k]) < 1e-9 for k in expected))
+
+    def bench_matrix(self, repeat, **options):
+        hero_ids = list(Hero.objects.filter(status='HERO').values_list('id', flat=True))
+        matrix, _ = self.measure('HeroScoreMatrix.from_db (one-off)', HeroScoreMatrix.from_db, 1)
+        self.stdout.write(f'matrix shape: {matrix.values.shape}')
+
+        expected, old = self.measure('window_averages (SQL)', lambda: window_averages(hero_ids), repeat)
+        result, new = self.measure('HeroScoreMatrix.window_averages', lambda: matrix.window_averages(hero_ids), repeat)
+        self.report(old, new, all(result[k] == expected[k] for k in expected))
+
+        def league_trends():
+            rolling = matrix.rolling_mean(7)
+            return matrix.rank(rolling[:, -1]), matrix.rolling_median(7), matrix.pct_change(7)
+
+        self.measure('rolling mean/median, pct_change, rank', league_trends, repeat)
+
+    def bench_serializers(self, repeat, **options):
+        self.stdout.write(f'{Hero.objects.count()} heroes')
+        renderer = JSONRenderer()
+
+        def model_serializer():
+            return renderer.render(HeroSerializer(Hero.objects.order_by('id'), many=True).data)
+
+        def values_serializer():
+            serializer = ValuesSerializer(HeroSerializer())
+            rows = Hero.objects.order_by('id').values(*serializer.sources)
+            return renderer.render([serializer.to_representation(row) for row in rows])
+
+        expected, old = self.measure('HeroSerializer (ModelSerializer)', model_serializer, repeat)
+        result, new = self.measure('ValuesSerializer', values_serializer, repeat)
+        self.report(old, new, all(result[k] == expected[k] for k in expected))
+
+    def bench_load(self, repeat, concurrency, **options):
+        # Requests go to the views the way ASGIHandler dispatches them: sync views through
+        # sync_to_async (one shared thread), async views awaited on the event loop
+        hero_ids = list(Hero.objects.order_by('current_rank').values_list('id', flat=True)[:50])
+        if not hero_ids:
+            raise CommandError('The load suite needs heroes in the database')
+        get_score_matrix()
+        get_search_index()
+        factory = AsyncRequestFactory()
+        routes = [
+            ('hero-performance', 'hero_performance'),
+            ('hero-market-data', 'hero_market_data'),
+            ('hero-tournament-scores', 'hero_tournament_scores'),
+        ]
+        calls = []
+        for i in range(concurrency):
+            hero_id = hero_ids[i % len(hero_ids)]
+            path, name = routes[i % len(routes)]
+            calls.append((factory.get(f'/api/{path}/{hero_id}/'), name, {'hero_id': hero_id}))
+        self.stdout.write(f'{concurrency} concurrent requests over {len(hero_ids)} heroes')
+
+        async def run(module, is_async):
+            async def one(request, name, kwargs):
+                view = getattr(module, name)
+                return await (view(request, **kwargs) if is_async else sync_to_async(view)(request, **kwargs))
+            return await asyncio.gather(*(one(*call) for call in calls))
+
+        def round_trip(module, is_async, cold):
+            def func():
+                if cold:
+                    response_cache.clear()
+                return async_to_sync(run)(module, is_async)
+            return func
+
+        def body(response):
+            return response.content
+
+        for cold in (True, False):
+            self.stdout.write('-- response cache cleared per round --' if cold else '-- response cache warm --')
+            expected, old = self.measure('sync views under ASGI', round_trip(views, False, cold), repeat)
+            result, new = self.measure('async views', round_trip(async_views, True, cold), repeat)
+            self.stdout.write(f'throughput: {concurrency / old:.0f} req/s sync, {concurrency / new:.0f} req/s async')
+            self.report(old, new, [body(r) for r in result] == [body(r) for r in expected])
+
+    def report(self, old, new, matches):
+        speedup = old / new if new else float('inf')
+        self.stdout.write(f'speedup: {speedup:.1f}x, results match: {matches}')
@@ -1,73 +1,217 @@
 # api/management/commands/poll_data.py
 import requests
 from django.core.management.base import BaseCommand
-from api.models import Card, Hero, Player, HeroScore, FloorPrice, HighestBid, CardSupply, TournamentScore
+from api.models import Hero, Player
+from api.ingest import (
+	CARD_SOURCE, HERO_DETAIL_SOURCE, HERO_SOURCE, HeroPageWriter, get_source_cursor, get_source_watermark, ingest_cards, ingest_hero_scores,
+	ingest_tournament_scores, load_watermarks, payload_hash, set_source_watermark,
+)
+from api.fetcher import DetailFetcher
+from api.history import prune_history, record_history
+from api.pipeline import DBWriter, Stage
+from api.scheduler import Scheduler, Source
+from api.tokens import TokenManager, jwt_expiry
+from api.upstream import PortalClient, HuddleClient, ResponseCache
+from api.management.commands.predict_star_swings import Command as PredictStarSwingsCommand
 from dotenv import load_dotenv
-from datetime import datetime
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 import os
-import time
 import logging
-from django.db import IntegrityError
+from datetime import datetime, timezone as dt_timezone
 from decimal import Decimal
-from playwright.sync_api import sync_playwright
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError, sync_playwright
 
 load_dotenv()
 
 FANTASY_TOP_API_KEY = os.getenv('FANTASY_TOP_API_KEY')
+FANTASY_TOP_API_URL = os.getenv('FANTASY_TOP_API_URL', 'https://portal.fantasy.top')
+HUDDLE_API_URL = os.getenv('HUDDLE_API_URL', 'https://api.huddle.wtf')
 HUDDLE_API_TOKEN = os.getenv('HUDDLE_API_TOKEN')
+# Where refreshed Huddle tokens are kept across restarts; empty keeps them in memory only
+HUDDLE_TOKEN_FILE = os.getenv('HUDDLE_TOKEN_FILE', '.huddle-token')
+# Seconds before its JWT expiry that the Huddle token is renewed
+HUDDLE_TOKEN_MARGIN = float(os.getenv('HUDDLE_TOKEN_MARGIN', '900'))
 TWITTER_USERNAME = os.getenv('TWITTER_USERNAME')
 TWITTER_PASSWORD = os.getenv('TWITTER_PASSWORD')
 
+HERO_DETAIL_RPS = float(os.getenv('HERO_DETAIL_RPS', '5'))
+HERO_DETAIL_CONCURRENCY = int(os.getenv('HERO_DETAIL_CONCURRENCY', '4'))
+HERO_DETAIL_BATCH_SIZE = 100
+HERO_LIST_RPS = float(os.getenv('HERO_LIST_RPS', '5'))
+CARD_RPS = float(os.getenv('CARD_RPS', '5'))
+CARD_CONCURRENCY = int(os.getenv('CARD_CONCURRENCY', '4'))
+CARD_MAX_PAGES = int(os.getenv('CARD_MAX_PAGES', '200'))
+CARD_PAGE_SIZE = 100
+CARD_PAGES_PER_BATCH = 20
+POLL_INTERVAL = float(os.getenv('POLL_INTERVAL', '60'))
+# ETags, Last-Modified dates and bodies of hero detail responses; empty disables conditional requests
+UPSTREAM_CACHE_DIR = os.getenv('UPSTREAM_CACHE_DIR', '.upstream-cache')
+
+# source -> (default interval, deadline) in seconds. Override the interval with POLL_<SOURCE>_INTERVAL;
+# 0 disables a source. Players stay off as they were before the scheduler.
+POLL_SOURCES = {
+	'hero_list': (POLL_INTERVAL, 300),
+	'hero_details': (POLL_INTERVAL, 1800),
+	'hero_scores': (POLL_INTERVAL, 120),
+	'tournament_scores': (POLL_INTERVAL, 120),
+	'cards': (300, 1800),
+	'players': (0, 120),
+	'star_swings': (POLL_INTERVAL, 300),
+	'history': (POLL_INTERVAL, 120),
+	# Only checks the token's expiry; the deadline leaves room for a browser login
+	'huddle_token': (60, 600),
+}
+
+def source_interval(name):
+	return float(os.getenv(f'POLL_{name.upper()}_INTERVAL', POLL_SOURCES[name][0]))
+
+def card_page_params(cursor, skip):
+	# Cards after `cursor`, an (updated_at, id) pair, oldest change first
+	params = {'$limit': CARD_PAGE_SIZE, '$skip': skip, '$sort[updated_at]': 1, '$sort[id]': 1}
+	if cursor:
+		updated_at, card_id = cursor
+		params.update({
+			'$or[0][updated_at][$gt]': updated_at,
+			'$or[1][updated_at]': updated_at,
+			'$or[1][id][$gt]': card_id,
+		})
+	return params
+
+# One pooled keep-alive client per upstream API, shared by every poller
+portal = PortalClient(
+	FANTASY_TOP_API_URL, FANTASY_TOP_API_KEY, pool_size=max(HERO_DETAIL_CONCURRENCY, 10),
+	cache=ResponseCache(UPSTREAM_CACHE_DIR) if UPSTREAM_CACHE_DIR else None,
+)
+huddle = HuddleClient(HUDDLE_API_URL)
+
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+def safe_decimal(value, default=Decimal('0')):
+	if value is None:
+		return Decimal('0')
+	try:
+		return Decimal(str(value).replace(',', '') or default)
+	except (ValueError, TypeError):
+		return default
+
 class Command(BaseCommand):
 	help = 'Poll data from fantasy.top API and save it to the database'
 
+	def add_arguments(self, parser):
+		parser.add_argument('--detail-rps', type=float, default=HERO_DETAIL_RPS, help='Hero detail requests started per second')
+		parser.add_argument('--detail-concurrency', type=int, default=HERO_DETAIL_CONCURRENCY, help='Maximum hero detail requests in flight')
+		parser.add_argument('--full-refresh', action='store_true', help='Rewrite every hero even when its payload hash is unchanged')
+		parser.add_argument(
+			'--changed-since', action='store_true',
+			help='Only list heroes updated upstream since the last crawl. Hero details are still refreshed for every HERO.',
+		)
+		parser.add_argument('--once', action='store_true', help='Poll every enabled source a single time and exit')
+
 	def handle(self, *args, **kwargs):
-		HUDDLE_API_TOKEN = None
-		while True:
+		self.huddle_tokens = TokenManager(
+			lambda token: self.refresh_huddle_token(HUDDLE_API_TOKEN=token),
+			token=HUDDLE_API_TOKEN, path=HUDDLE_TOKEN_FILE or None, margin=HUDDLE_TOKEN_MARGIN,
+		)
+		# Every database write of the poller goes through this one thread
+		db_writer = DBWriter()
+		try:
+			scheduler = Scheduler(self.build_sources(db_writer, **kwargs), db_writer=db_writer, persist=db_writer.submit)
+			if kwargs['once']:
+				for name, status in scheduler.run_once().items():
+					self.stdout.write(f'{name}: {status}')
+				self.report_upstream_stats()
+				return
+
+			self.stdout.write(self.style.SUCCESS('Starting data polling...'))
 			try:
-				self.stdout.write(self.style.SUCCESS('Starting data polling...'))
-				
-				HUDDLE_API_TOKEN = self.check_and_refresh_huddle_token(HUDDLE_API_TOKEN)
-				# self.poll_cards()
-				# self.poll_players()
-				self.poll_heroes()
-				self.fetch_hero_scores(HUDDLE_API_TOKEN)
-				self.fetch_tournament_scores(HUDDLE_API_TOKEN)
-				
-				self.stdout.write(self.style.SUCCESS('Data polling completed. Waiting for 1 minute before next run...'))
-				time.sleep(60)  # Wait for 60 seconds (1 minute)
+				scheduler.run_forever()
 			except KeyboardInterrupt:
-				self.stdout.write(self.style.WARNING('Polling interrupted by user. Exiting...'))
-				break
-			except Exception as e:
-				self.stdout.write(self.style.ERROR(f'An error occurred: {str(e)}'))
-				self.stdout.write(self.style.WARNING('Retrying in 1 minute...'))
-				time.sleep(60)
-
-	def check_and_refresh_huddle_token(self, HUDDLE_API_TOKEN):
-		url = "https://api.huddle.wtf/api/analytics/heroes-scores"
-		headers = {
-			"accept": "application/json, text/plain, */*",
-			"authorization": f"Bearer {HUDDLE_API_TOKEN}",
-			"cache-control": "no-cache",
-			"expires": "0",
-			"pragma": "no-cache",
-		}
+				self.stdout.write(self.style.WARNING('Polling interrupted by user. Waiting for running sources, then exiting...'))
+		finally:
+			db_writer.close()
+
+	def build_sources(self, db_writer, **kwargs):
+		incremental = not kwargs['full_refresh']
+
+		def reported(fetch):
+			# Logs the upstream request stats gathered since the last report
+			def wrapper():
+				payload = fetch()
+				self.report_upstream_stats()
+				return payload
+			return wrapper
+
+		# The crawling stages write page by page through the DB writer themselves
+		stages = [
+			Stage('hero_list', fetch=reported(lambda: self.poll_hero_list(
+				incremental=incremental, changed_since=kwargs['changed_since'], db_writer=db_writer,
+			))),
+			Stage('hero_details', fetch=reported(lambda: self.poll_hero_details(
+				detail_rps=kwargs['detail_rps'], detail_concurrency=kwargs['detail_concurrency'],
+				incremental=incremental, db_writer=db_writer,
+			))),
+			Stage('hero_scores', fetch=reported(self.fetch_hero_scores), write=self.write_hero_scores),
+			Stage('tournament_scores', fetch=reported(self.fetch_tournament_scores), write=self.write_tournament_scores),
+			Stage('cards', fetch=reported(lambda: self.poll_cards(incremental=incremental, db_writer=db_writer))),
+			Stage('players', fetch=reported(self.fetch_players), write=self.write_players),
+			# Predictions are refreshed after any of the sources they read has new data
+			Stage(
+				'star_swings', write=lambda _: self.save_star_swing_snapshot(timezone.now()),
+				depends_on=['hero_list', 'hero_details', 'hero_scores', 'tournament_scores'], skip_on_failure=False,
+			),
+			# Samples on a fixed cadence rather than after other sources, so history points are evenly spaced
+			Stage('history', write=lambda _: self.record_history()),
+			Stage('huddle_token', fetch=reported(self.check_huddle_token)),
+		]
+		return [Source(stage, source_interval(stage.name), deadline=POLL_SOURCES[stage.name][1]) for stage in stages]
+
+	def save_star_swing_snapshot(self, poll_ts):
+		snapshot = PredictStarSwingsCommand(stdout=self.stdout, stderr=self.stderr).save_snapshot(poll_ts)
+		if snapshot:
+			self.stdout.write(self.style.SUCCESS(f'Star swing predictions saved for poll at {poll_ts.isoformat()}'))
+		else:
+			self.stdout.write('Star swing predictions unchanged since the last snapshot')
+
+	def record_history(self):
+		stats = record_history()
+		pruned = prune_history()
+		self.stdout.write(
+			f"History recorded for {stats['heroes']} heroes ({stats['raw_heroes']} changed) and "
+			f"{stats['prices']} market prices ({stats['raw_prices']} changed); "
+			f"pruned {', '.join(f'{count} {label}' for label, count in pruned.items())} rows"
+		)
+		return f"{stats['heroes']} heroes"
+
+	def report_upstream_stats(self):
+		for client in (portal, huddle):
+			for endpoint, stats in client.pop_stats().items():
+				self.stdout.write(
+					f"{client.base_url}{endpoint}: {stats['requests']} requests, {stats['errors']} errors, "
+					f"{stats['not_modified']} not modified, {stats['bytes']} bytes, avg {stats['avg_ms']} ms, max {stats['max_ms']} ms"
+				)
 
+	def huddle_get_json(self, path):
+		"""GET a Huddle endpoint with the shared token, refreshing it once when it is rejected.
+
+		The data request itself tells whether the token still works; there is no separate probe.
+		"""
+		token = self.huddle_tokens.get()
 		try:
-			response = requests.get(url, headers=headers)
-			response.raise_for_status()
+			return huddle.get_json(path, headers=huddle.auth_headers(token))
 		except requests.exceptions.HTTPError as e:
-			if e.response.status_code == 401 or e.response.status_code == 403:
-				self.stdout.write(self.style.WARNING('HUDDLE token expired. Refreshing...'))
-				HUDDLE_API_TOKEN =self.refresh_huddle_token(HUDDLE_API_TOKEN)
-			else:
+			if e.response is None or e.response.status_code not in (401, 403):
 				raise
+		self.stdout.write(self.style.WARNING('HUDDLE token rejected. Refreshing...'))
+		# The other Huddle sources may have refreshed it in the meantime
+		token = self.huddle_tokens.refresh_if_current(token)
+		return huddle.get_json(path, headers=huddle.auth_headers(token))
 
-		return HUDDLE_API_TOKEN
+	def check_huddle_token(self):
+		"""Renew the Huddle token in the background before it expires, rather than on a rejected request."""
+		expires_in = self.huddle_tokens.refresh_if_expiring()
+		return 'expiry unknown' if expires_in is None else f'valid for {expires_in / 60:.0f} min'
 
 	def refresh_huddle_token(self, headless=False, HUDDLE_API_TOKEN=None):
 		with sync_playwright() as p:
@@ -98,9 +242,6 @@ class Command(BaseCommand):
 				logging.info("Filling username")
 				page.fill('input[autocomplete="username"]', TWITTER_USERNAME)
 
-				logging.info("Waiting before clicking 'Next' button")
-				time.sleep(2)  # Add a 2-second delay
-
 				logging.info("Attempting to click 'Next' button")
 				next_button_selectors = [
 					'div[role="button"]:has-text("Next")',
@@ -125,14 +266,12 @@ class Command(BaseCommand):
 				logging.info("Filling password")
 				page.fill('input[name="password"]', TWITTER_PASSWORD)
 
-				logging.info("Waiting before clicking 'Log in' button")
-				time.sleep(2)  # Add a 2-second delay
-
 				logging.info("Clicking 'Log in' button")
 				login_button = page.locator('div[role="button"]:has-text("Log in")')
-				if login_button.is_visible():
+				try:
+					login_button.wait_for(state="visible", timeout=5000)
 					login_button.click()
-				else:
+				except PlaywrightTimeoutError:
 					logging.warning("'Log in' button not visible")
 					# Try to find and click the button by its text content
 					page.click('text="Log in"', timeout=5000)
@@ -150,16 +289,18 @@ class Command(BaseCommand):
 				logging.info("Waiting for login to complete")
 				page.wait_for_url("https://www.huddle.wtf/", timeout=30000)
 
-				time.sleep(5)
-
 				logging.info("Extracting new token")
+				# The site stores the token shortly after the redirect
+				page.wait_for_function("() => localStorage.getItem('authToken')", timeout=30000)
 				new_token = page.evaluate("() => localStorage.getItem('authToken')")
 
 				if new_token:
-					logging.info(f"New token: {new_token}")
-					self.stdout.write(self.style.SUCCESS('HUDDLE token refreshed successfully'))
 					# remove first and last character from new_token
 					HUDDLE_API_TOKEN = new_token[1:-1]
+					# Never log the bearer token itself; its expiry tells refreshes apart
+					expires_at = jwt_expiry(HUDDLE_API_TOKEN)
+					logging.info(f"New token expires at {datetime.fromtimestamp(expires_at, dt_timezone.utc).isoformat() if expires_at else 'an unknown time'}")
+					self.stdout.write(self.style.SUCCESS('HUDDLE token refreshed successfully'))
 				else:
 					self.stdout.write(self.style.ERROR('Failed to retrieve new HUDDLE token'))
 
@@ -175,77 +316,123 @@ class Command(BaseCommand):
 				browser.close()
 				return HUDDLE_API_TOKEN
 
-	def poll_cards(self):
-		url = 'https://portal.fantasy.top/card'
-		headers = {'x-api-key': FANTASY_TOP_API_KEY}
-		params = {'$limit': 100, '$skip': 0}
+	def poll_cards(self, rps=CARD_RPS, concurrency=CARD_CONCURRENCY, incremental=True, max_pages=CARD_MAX_PAGES, db_writer=None):
+		# Every batch starts from a keyset cursor, the (updated_at, id) of the last card written, so
+		# offsets never count from further back and many cards sharing one updated_at can't stall the crawl
+		cursor = get_source_cursor(CARD_SOURCE) if incremental else None
+		if cursor:
+			self.stdout.write(f'Requesting cards updated since {cursor[0].isoformat()}, after card {cursor[1]}')
+			cursor = (cursor[0].isoformat(), cursor[1])
+		page_fetcher = DetailFetcher(
+			portal,
+			'/card',
+			rate=rps,
+			max_in_flight=concurrency,
+			# Reads the cursor of the batch being fetched
+			params=lambda skip: card_page_params(cursor, skip),
+		)
+		# With a DB writer, a batch of pages is written while the next one is being fetched
+		pending_writes = []
 		total_cards = 0
-
-		while True:
-			response = requests.get(url, headers=headers, params=params)
-			data = response.json()
-			cards = data.get('data', [])
-			
-			if not cards:
+		remaining = 0
+		pages_left = max_pages
+		failed_skip = None
+
+		while pages_left > 0:
+			# The first page gives the number of cards left past the cursor
+			data = portal.get_json('/card', params=card_page_params(cursor, 0))
+			pages_left -= 1
+			remaining = data.get('total', 0)
+			pages = [data.get('data', [])]
+			if not pages[0]:
+				break
+			# Pages overlap by one card: each starts with the last card of the one before
+			skips = [
+				index * (CARD_PAGE_SIZE - 1) for index in range(1, min(CARD_PAGES_PER_BATCH, pages_left + 1))
+				if index * (CARD_PAGE_SIZE - 1) + 1 < remaining
+			]
+			fetched = {}
+			for skip, page, error in page_fetcher.fetch_all(skips):
+				if error is not None:
+					self.stdout.write(self.style.ERROR(f'Error fetching cards at $skip={skip}: {error}'))
+					failed_skip = skip if failed_skip is None else min(failed_skip, skip)
+				else:
+					fetched[skip] = page.get('data', [])
+			pages_left -= len(skips)
+
+			shifted = False
+			for skip in skips:
+				if failed_skip is not None and skip >= failed_skip:
+					break
+				page = fetched[skip]
+				last = pages[-1][-1]
+				if not page or (page[0].get('id'), page[0].get('updated_at')) != (last.get('id'), last.get('updated_at')):
+					# A card before this page changed since the first page was read and moved the
+					# offsets; the pages up to here are contiguous, the next batch starts after them
+					shifted = True
+					break
+				if len(page) > 1:
+					pages.append(page[1:])
+
+			# Pages are written in crawl order, so each checkpoint only ever moves forward
+			for cards in pages:
+				if db_writer is None:
+					self.write_cards(cards)
+				else:
+					pending_writes.append(db_writer.submit(self.write_cards, cards))
+			batch_cards = sum(len(cards) for cards in pages)
+			total_cards += batch_cards
+			remaining -= batch_cards
+			last = pages[-1][-1]
+			cursor = (last['updated_at'], last['id'])
+			if failed_skip is not None:
+				break
+			self.stdout.write(f'Fetched {total_cards} cards, {remaining} left' + (' (offsets shifted, re-anchoring)' if shifted else '.'))
+			if not shifted and remaining <= 0:
 				break
 
-			for card_data in cards:
-				# Convert string dates to datetime objects if necessary
-				card_data['created_at'] = card_data.get('created_at')
-				card_data['updated_at'] = card_data.get('updated_at')
-				card_data['timestamp'] = card_data.get('timestamp')
-
-				# Ensure all required fields are present
-				card_defaults = {
-					'owner': card_data.get('owner', ''),
-					'hero_id': card_data.get('hero_id', ''),
-					'rarity': card_data.get('rarity', 0),
-					'hero_rarity_index': card_data.get('hero_rarity_index', ''),
-					'token_id': card_data.get('token_id', ''),
-					'season': card_data.get('season', 0),
-					'created_at': card_data.get('created_at'),
-					'updated_at': card_data.get('updated_at'),
-					'tx_hash': card_data.get('tx_hash', ''),
-					'blocknumber': card_data.get('blocknumber', 0),
-					'timestamp': card_data.get('timestamp'),
-					'picture': card_data.get('picture', ''),
-				}
-
-				Card.objects.update_or_create(
-					id=card_data['id'],
-					defaults=card_defaults
-				)
+		for future in pending_writes:
+			future.result()
 
-			total_cards += len(cards)
-			self.stdout.write(f'Processed {total_cards} cards so far.')
-			params['$skip'] += params['$limit']
-			time.sleep(1)  # Wait for 1 second before the next API call
+		if failed_skip is not None:
+			raise RuntimeError(f'Card crawl stopped after {total_cards} cards; the next run resumes after card {cursor[1]}')
+		self.stdout.write(f'All cards data updated. Total cards: {total_cards}' + (f', {remaining} left for the next run' if remaining > 0 else ''))
+		return f'{total_cards} cards' + (f', {remaining} left' if remaining > 0 else '')
 
-		self.stdout.write(f'All cards data updated. Total cards: {total_cards}')
+	def write_cards(self, cards):
+		stats = ingest_cards(cards)
+		for card_id, field_errors in stats['errors'].items():
+			for field, message in field_errors.items():
+				self.stdout.write(self.style.ERROR(f"Invalid value for card {card_id}, field '{field}': {message}"))
+		return stats
 
-	def poll_heroes(self):
-		url = 'https://portal.fantasy.top/hero'
-		headers = {'x-api-key': FANTASY_TOP_API_KEY}
+	def poll_hero_list(self, incremental=True, changed_since=False, db_writer=None):
 		params = {'$skip': 0}
 		total_heroes = 0
+		skipped_heroes = 0
 		status_counts = {}
-
+		latest_updated_at = None
+		# With a DB writer, a page is written while the next one is being fetched
+		pending_writes = []
+
+		if changed_since:
+			# Only list heroes the portal changed since the last completed crawl
+			watermark = get_source_watermark(HERO_SOURCE)
+			if watermark:
+				params['updated_at[$gt]'] = watermark.isoformat()
+				self.stdout.write(f'Requesting heroes updated since {watermark.isoformat()}')
+
+		# Pages are paced by the rate budget, and a 429 waits out its Retry-After
+		page_fetcher = DetailFetcher(portal, '/hero', rate=HERO_LIST_RPS, max_in_flight=1, params=lambda skip: {**params, '$skip': skip})
 		# Get initial response to get the total number of heroes
-		response = requests.get(url, headers=headers, params=params)
-		data = response.json()
+		data = page_fetcher.fetch(params['$skip'])
 		total = data.get('total', 0)
 
-		def safe_decimal(value, default=Decimal('0')):
-			if value is None:
-				return Decimal('0')
-			try:
-				return Decimal(str(value).replace(',', '') or default)
-			except (ValueError, TypeError):
-				return default
-
 		while params['$skip'] < total:
 			heroes = data.get('data', [])
-			
+			writer = HeroPageWriter(HERO_SOURCE)
+			known_hashes = load_watermarks(HERO_SOURCE, (hero_data['id'] for hero_data in heroes)) if incremental else {}
+
 			for hero_data in heroes:
 				# Convert string counts to integers
 				hero_data['favourites_count'] = int(hero_data.get('favourites_count', '0').replace(',', '') or 0)
@@ -259,239 +446,183 @@ class Command(BaseCommand):
 				hero_data['previous_stars'] = int(hero_data.get('previous_stars', 0) or 0)
 				hero_data['star_gain'] = int(hero_data.get('star_gain', 0) or 0)
 
-				# Fetch additional data only for heroes with status "HERO"
-				hero_detail_data = {}
-				if hero_data.get('status') == "HERO":
-					hero_detail_url = f'https://portal.fantasy.top/hero/{hero_data["id"]}'
-					hero_detail_response = requests.get(hero_detail_url, headers=headers)
-					hero_detail_data = hero_detail_response.json()
-					time.sleep(1)  # Wait for 1 second before the next API call
-
-
-				hero_defaults = {
-					'handle': hero_data.get('handle', ''),
-					'name': hero_data.get('name', ''),
-					'previous_rank': hero_data.get('previous_rank', 0),
-					'is_player': hero_data.get('is_player', False),
-					'is_blue_verified': hero_data.get('is_blue_verified', False),
-					'default_profile_image': hero_data.get('default_profile_image', False),
-					'description': hero_data.get('description', ''),
-					'fast_followers_count': hero_data.get('fast_followers_count', 0),
-					'favourites_count': hero_data.get('favourites_count', 0),
-					'followers_count': hero_data.get('followers_count', 0),
-					'friends_count': hero_data.get('friends_count', 0),
-					'listed_count': hero_data.get('listed_count', 0),
-					'location': hero_data.get('location', ''),
-					'media_count': hero_data.get('media_count', 0),
-					'possibly_sensitive': hero_data.get('possibly_sensitive', False),
-					'profile_banner_url': hero_data.get('profile_banner_url', ''),
-					'profile_image_url_https': hero_data.get('profile_image_url_https', ''),
-					'has_banner': hero_data.get('has_banner', False),
-					'verified': hero_data.get('verified', False),
-					'created_at': hero_data.get('created_at'),
-					'updated_at': hero_data.get('updated_at'),
-					'statuses_count': hero_data.get('statuses_count', 0),
-					'stars': hero_data.get('stars', 0),
-					'player_address': hero_data.get('player_address', ''),
-					'can_be_packed': hero_data.get('can_be_packed', False),
-					'previous_stars': hero_data.get('previous_stars', 0),
-					'star_gain': hero_data.get('star_gain', 0),
-					'status': hero_data.get('status', ''),
-					'current_rank': hero_detail_data.get('current_rank'),
-					'fantasy_score': float(hero_detail_data.get('fantasy_score', 0)),
-					'tactic_image_prefix': hero_detail_data.get('tactic_image_prefix', ''),
-					'volume': safe_decimal(hero_detail_data.get('volume')),
-					'last_sale': int(hero_detail_data.get('last_sale', 0)),
-				}
-
 				# Get the status and update the count
 				status = hero_data.get('status', 'Unknown')
 				status_counts[status] = status_counts.get(status, 0) + 1
 
-				# Print the status for each hero
-				self.stdout.write(f"Hero {hero_data['id']} status: {status}")				
+				upstream_updated_at = parse_datetime(hero_data.get('updated_at') or '')
+				if upstream_updated_at and (latest_updated_at is None or upstream_updated_at > latest_updated_at):
+					latest_updated_at = upstream_updated_at
 
-				for field, value in hero_defaults.items():
-					try:
-						Hero.objects.filter(id=hero_data['id']).update(**{field: value})
-					except Exception as e:
-						self.stdout.write(self.style.ERROR(f"Error updating field '{field}' with value '{value}': {str(e)}"))
-						self.stdout.write(self.style.ERROR(f"Type of value: {type(value)}"))
-						self.stdout.write(self.style.ERROR(f"Hero ID: {hero_data['id']}"))
+				content_hash = payload_hash(hero_data)
+				if known_hashes.get(hero_data['id']) == content_hash:
+					skipped_heroes += 1
+					continue
+				if hero_data.get('status') == "HERO":
+					# Rank and market data come from the hero_details source
+					writer.add(hero_data['id'], self.build_hero_defaults(hero_data), content_hash=content_hash)
+				else:
+					hero_defaults = {**self.build_hero_defaults(hero_data), **self.build_hero_detail_defaults({})}
+					writer.add(hero_data['id'], hero_defaults, {}, content_hash=content_hash)
 
-				try:
-					hero, created = Hero.objects.update_or_create(
-						id=hero_data['id'],
-						defaults=hero_defaults
-					)
-				except IntegrityError as e:
-					self.stdout.write(self.style.ERROR(f"IntegrityError for hero {hero_data['id']}: {str(e)}"))
-					self.stdout.write(self.style.ERROR(f"Hero data: {hero_defaults}"))
-				except Exception as e:
-					self.stdout.write(self.style.ERROR(f"Unexpected error for hero {hero_data['id']}: {str(e)}"))
-					self.stdout.write(self.style.ERROR(f"Hero data: {hero_defaults}"))
-
-				# Update or create FloorPrice instances
-				for floor_price_data in hero_detail_data.get('floor_prices', []):
-					FloorPrice.objects.update_or_create(
-						hero=hero,
-						rarity=floor_price_data['rarity'],
-						defaults={'price': floor_price_data['price']}
-					)
-
-				# Update or create HighestBid instances
-				for highest_bid_data in hero_detail_data.get('highest_bids', []):
-					HighestBid.objects.update_or_create(
-						hero=hero,
-						rarity=highest_bid_data['rarity'],
-						defaults={'price': int(highest_bid_data['price'])}
-					)
-
-				# Update or create CardSupply instances
-				for card_supply_data in hero_detail_data.get('card_supply', []):
-					CardSupply.objects.update_or_create(
-						hero=hero,
-						rarity=card_supply_data['rarity'],
-						defaults={
-							'amount': card_supply_data['amount'],
-							'burnt': card_supply_data['burnt'],
-							'total': card_supply_data['total']
-						}
-					)
+			self.report_writer_errors(writer)
+			changed = len(writer.heroes)
+			if db_writer is None:
+				writer.flush()
+			else:
+				pending_writes.append(db_writer.submit(writer.flush))
 
 			total_heroes += len(heroes)
-			self.stdout.write(f'Processed {total_heroes} heroes out of {total}.')
+			self.stdout.write(f'Processed {total_heroes} heroes out of {total}: {changed} of this page changed.')
 			params['$skip'] += len(heroes)
-			
+
 			if params['$skip'] < total:
-				response = requests.get(url, headers=headers, params=params)
-				data = response.json()
-			
-			time.sleep(1)  # Wait for 1 second before the next API call
+				data = page_fetcher.fetch(params['$skip'])
 
 		self.stdout.write("\nStatus Summary:")
 		for status, count in status_counts.items():
 			self.stdout.write(f"{status}: {count}")
 
-		self.stdout.write(f'All heroes data updated. Total heroes: {total_heroes}')
-
-	def poll_players(self):
-		url = 'https://portal.fantasy.top/players'
-		headers = {'x-api-key': FANTASY_TOP_API_KEY}
-		response = requests.get(url, headers=headers)
-		players = response.json()
-		for player_data in players:
-			Player.objects.update_or_create(id=player_data['id'], defaults=player_data)
-		self.stdout.write('Players data updated.')
-		
-
-	def fetch_hero_scores(self, HUDDLE_API_TOKEN):
-		url = "https://api.huddle.wtf/api/analytics/heroes-scores"
-		headers = {
-			"accept": "application/json, text/plain, */*",
-			"authorization": f"Bearer {HUDDLE_API_TOKEN}",
-			"cache-control": "no-cache",
-			"expires": "0",
-			"pragma": "no-cache",
-		}
-
-		try:
-			response = requests.get(url, headers=headers)
-			response.raise_for_status()
-			hero_data_list = response.json()  # Assuming the API returns a list of hero data
-
-			for hero_data in hero_data_list:
-				hero_id = hero_data.get('hero_id')
-				name = hero_data.get('name')
+		for future in pending_writes:
+			future.result()
 
-				# Convert string fields to float, handling None values
-				def safe_float(value, default=0.0):
-					try:
-						return float(value) if value is not None else default
-					except ValueError:
-						logging.warning(f"Could not convert {value} to float for hero {hero_id}")
-						return default
-
-				current_score = safe_float(hero_data.get('current_score'))
-				median_7_days = safe_float(hero_data.get('median_7_days'))
-				median_14_days = safe_float(hero_data.get('median_14_days'))
-				change_1_day = safe_float(hero_data.get('change_1_day'))
-				change_7_days = safe_float(hero_data.get('change_7_days'))
-
-				# Get the Hero instance
+		if latest_updated_at:
+			if db_writer is None:
+				set_source_watermark(HERO_SOURCE, latest_updated_at)
+			else:
+				db_writer.call(set_source_watermark, HERO_SOURCE, latest_updated_at)
+
+		self.stdout.write(f'All heroes data updated. Total heroes: {total_heroes}, unchanged and skipped: {skipped_heroes}')
+		return f'{total_heroes} heroes, {skipped_heroes} unchanged'
+
+	def poll_hero_details(self, detail_rps=HERO_DETAIL_RPS, detail_concurrency=HERO_DETAIL_CONCURRENCY, incremental=True, db_writer=None):
+		# Every stored HERO, including heroes a --changed-since listing left out
+		hero_ids = list(Hero.objects.filter(status='HERO').order_by('id').values_list('id', flat=True))
+		detail_fetcher = DetailFetcher(
+			portal,
+			'/hero/{}',
+			rate=detail_rps,
+			max_in_flight=detail_concurrency,
+			conditional=True,
+		)
+		skipped_heroes = 0
+		not_modified_heroes = 0
+		failed_heroes = 0
+		pending_writes = []
+
+		for offset in range(0, len(hero_ids), HERO_DETAIL_BATCH_SIZE):
+			batch = hero_ids[offset:offset + HERO_DETAIL_BATCH_SIZE]
+			writer = HeroPageWriter(HERO_DETAIL_SOURCE)
+			known_hashes = load_watermarks(HERO_DETAIL_SOURCE, batch) if incremental else {}
+
+			# Detail requests run concurrently and are handed to the writer as they complete
+			for hero_id, response, error in detail_fetcher.fetch_all(batch):
+				if error is not None:
+					failed_heroes += 1
+					self.stdout.write(self.style.ERROR(f"Error fetching details for hero {hero_id}: {error}"))
+					continue
+				not_modified_heroes += int(response.from_cache)
+				# A 304 or an identical body is skipped before it is parsed
+				if known_hashes.get(hero_id) == response.content_hash:
+					skipped_heroes += 1
+					continue
 				try:
-					hero = Hero.objects.get(id=hero_id)
-				except Hero.DoesNotExist:
-					logging.warning(f"Hero not found: id={hero_id}, name={name}")
+					hero_detail_data = response.json()
+				except ValueError as e:
+					failed_heroes += 1
+					self.stdout.write(self.style.ERROR(f"Error fetching details for hero {hero_id}: {e}"))
 					continue
+				writer.add(hero_id, self.build_hero_detail_defaults(hero_detail_data), hero_detail_data, content_hash=response.content_hash)
 
-				# Update Hero fields
-				hero.name = name
-				hero.current_score = current_score
-				hero.median_7_days = median_7_days
-				hero.median_14_days = median_14_days
-				hero.change_1_day = change_1_day
-				hero.change_7_days = change_7_days
-				hero.save()
-
-				# Process historical scores
-				dates = hero_data.get('dates', [])
-				data_scores = hero_data.get('data', [])
-
-				for date_str, score_str in zip(dates, data_scores):
-					# Parse the date and score
-					try:
-						date = datetime.strptime(date_str[:10], '%Y-%m-%d').date()
-						score = safe_float(score_str)
-
-						# Update or create HeroScore instance
-						HeroScore.objects.update_or_create(
-							hero=hero,
-							date=date,
-							defaults={'score': score}
-						)
-					except ValueError as e:
-						logging.warning(f"Error processing date or score for hero {hero_id}: {e}")
-
-		except requests.exceptions.HTTPError as http_err:
-			logging.error(f"HTTP error occurred: {http_err}")
-		except Exception as err:
-			logging.error(f"An error occurred: {err}")
-
-
-	# Add this method to the Command class
-	def fetch_tournament_scores(self, HUDDLE_API_TOKEN):
-		url = "https://api.huddle.wtf/api/analytics/tournament-scores"
-		headers = {
-			"accept": "application/json, text/plain, */*",
-			"authorization": f"Bearer {HUDDLE_API_TOKEN}",
-			"cache-control": "no-cache",
-			"expires": "0",
-			"pragma": "no-cache",
+			self.report_writer_errors(writer)
+			if db_writer is None:
+				writer.flush()
+			else:
+				pending_writes.append(db_writer.submit(writer.flush))
+			self.stdout.write(f'Fetched details for {min(offset + HERO_DETAIL_BATCH_SIZE, len(hero_ids))} of {len(hero_ids)} heroes.')
+
+		for future in pending_writes:
+			future.result()
+
+		self.stdout.write(
+			f'Hero details updated for {len(hero_ids)} heroes, unchanged and skipped: {skipped_heroes} '
+			f'({not_modified_heroes} not modified upstream), failed: {failed_heroes}'
+		)
+		return f'{len(hero_ids)} heroes, {skipped_heroes} unchanged, {not_modified_heroes} not modified, {failed_heroes} failed'
+
+	def report_writer_errors(self, writer):
+		for hero_id, field_errors in writer.errors.items():
+			for field, message in field_errors.items():
+				self.stdout.write(self.style.ERROR(f"Invalid value for hero {hero_id}, field '{field}': {message}"))
+
+	def build_hero_defaults(self, hero_data):
+		return {
+			'handle': hero_data.get('handle', ''),
+			'name': hero_data.get('name', ''),
+			'previous_rank': hero_data.get('previous_rank', 0),
+			'is_player': hero_data.get('is_player', False),
+			'is_blue_verified': hero_data.get('is_blue_verified', False),
+			'default_profile_image': hero_data.get('default_profile_image', False),
+			'description': hero_data.get('description', ''),
+			'fast_followers_count': hero_data.get('fast_followers_count', 0),
+			'favourites_count': hero_data.get('favourites_count', 0),
+			'followers_count': hero_data.get('followers_count', 0),
+			'friends_count': hero_data.get('friends_count', 0),
+			'listed_count': hero_data.get('listed_count', 0),
+			'location': hero_data.get('location', ''),
+			'media_count': hero_data.get('media_count', 0),
+			'possibly_sensitive': hero_data.get('possibly_sensitive', False),
+			'profile_banner_url': hero_data.get('profile_banner_url', ''),
+			'profile_image_url_https': hero_data.get('profile_image_url_https', ''),
+			'has_banner': hero_data.get('has_banner', False),
+			'verified': hero_data.get('verified', False),
+			'created_at': hero_data.get('created_at'),
+			'updated_at': hero_data.get('updated_at'),
+			'statuses_count': hero_data.get('statuses_count', 0),
+			'stars': hero_data.get('stars', 0),
+			'player_address': hero_data.get('player_address', ''),
+			'can_be_packed': hero_data.get('can_be_packed', False),
+			'previous_stars': hero_data.get('previous_stars', 0),
+			'star_gain': hero_data.get('star_gain', 0),
+			'status': hero_data.get('status', ''),
 		}
 
-		try:
-			response = requests.get(url, headers=headers)
-			response.raise_for_status()
-			tournament_data = response.json()
-
-			for item in tournament_data.get('data', []):
-				hero_id = item.get('hero_id')
-				name = item.get('name')
-				scores = item.get('data', [])
-
-				# Get or create the Hero instance
-				hero, created = Hero.objects.get_or_create(id=hero_id, defaults={'name': name})
-
-				# Create or update TournamentScore instances
-				for index, score in enumerate(scores):
-					TournamentScore.objects.update_or_create(
-						hero=hero,
-						index=index,
-						defaults={'score': score}
-					)
-
-			self.stdout.write(self.style.SUCCESS('Tournament scores updated successfully'))
-
-		except requests.exceptions.RequestException as e:
-			self.stdout.write(self.style.ERROR(f'Error fetching tournament scores: {e}'))
\ No newline at end of file
+	def build_hero_detail_defaults(self, hero_detail_data):
+		return {
+			'current_rank': hero_detail_data.get('current_rank'),
+			'fantasy_score': float(hero_detail_data.get('fantasy_score', 0)),
+			'tactic_image_prefix': hero_detail_data.get('tactic_image_prefix', ''),
+			'volume': safe_decimal(hero_detail_data.get('volume')),
+			'last_sale': int(hero_detail_data.get('last_sale', 0)),
+		}
+
+	def fetch_players(self):
+		return portal.get_json('/players')
+
+	def write_players(self, players):
+		for player_data in players:
+			Player.objects.update_or_create(id=player_data['id'], defaults=player_data)
+		self.stdout.write('Players data updated.')
+
+	def fetch_hero_scores(self):
+		# Assuming the API returns a list of hero data
+		return self.huddle_get_json('/api/analytics/heroes-scores')
+
+	def write_hero_scores(self, hero_data_list):
+		stats = ingest_hero_scores(hero_data_list)
+		self.stdout.write(
+			f"Hero scores updated: {stats['heroes']} heroes ({stats['heroes_updated']} changed), "
+			f"{stats['scores_created']} new and {stats['scores_updated']} changed daily scores"
+		)
+
+	def fetch_tournament_scores(self):
+		tournament_data = self.huddle_get_json('/api/analytics/tournament-scores')
+		return tournament_data.get('data', [])
+
+	def write_tournament_scores(self, items):
+		stats = ingest_tournament_scores(items)
+		self.stdout.write(
+			f"{stats['heroes_changed']} of {stats['heroes']} heroes changed: {stats['scores_created']} created, "
+			f"{stats['scores_updated']} updated, {stats['scores_deleted']} deleted"
+		)
+		self.stdout.write(self.style.SUCCESS('Tournament scores updated successfully'))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from api.scheduler import source_states
+
+
+class Command(BaseCommand):
+    help = 'Shows the scheduler state of every source polled by poll_data'
+
+    def handle(self, *args, **options):
+        states = source_states()
+        if not states:
+            self.stdout.write(self.style.WARNING('No poll state recorded yet. Is poll_data running?'))
+            return
+
+        now = timezone.now()
+        self.stdout.write(f"{'source':<20}{'status':<10}{'interval':>9}{'runs':>7}{'failed':>7}{'streak':>7}{'last run':>10}  {'last success':<14}{'next run':<10}")
+        for state in states:
+            style = {'failed': self.style.ERROR, 'overdue': self.style.WARNING}.get(state['status'], str)
+            self.stdout.write(style(
+                f"{state['source']:<20}{state['status']:<10}{state['interval']:>8.0f}s{state['runs']:>7}{state['failures']:>7}"
+                f"{state['consecutive_failures']:>7}{format_seconds(state['last_duration']):>10}  "
+                f"{format_age(state['last_success_at'], now, 'ago'):<14}{format_age(state['next_run_at'], now, 'in'):<10}"
+            ))
+            if state['last_error']:
+                self.stdout.write(self.style.ERROR(f"    {state['last_error']}"))
+
+
+def format_seconds(seconds):
+    return '-' if seconds is None else f'{seconds:.1f}s'
+
+
+def format_age(moment, now, direction):
+    if moment is None:
+        return '-'
+    if direction == 'ago':
+        return f'{(now - moment).total_seconds():.0f}s ago'
+    return f'in {max(0.0, (moment - now).total_seconds()):.0f}s'
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_syncwatermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StarSwingSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('poll_ts', models.DateTimeField(unique=True)),
+                ('etag', models.CharField(max_length=64)),
+                ('data', models.JSONField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:17
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def remove_duplicate_market_rows(apps, schema_editor):
+    # update_or_create without a unique constraint could leave several rows per (hero, rarity);
+    # keep the most recently inserted one before adding the constraint
+    for model_name in ('FloorPrice', 'HighestBid', 'CardSupply'):
+        model = apps.get_model('api', model_name)
+        keep = model.objects.values('hero_id', 'rarity').annotate(keep_id=Max('id')).values_list('keep_id', flat=True)
+        model.objects.exclude(id__in=list(keep)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_starswingsnapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_market_rows, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='cardsupply',
+            unique_together={('hero', 'rarity')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='floorprice',
+            unique_together={('hero', 'rarity')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='highestbid',
+            unique_together={('hero', 'rarity')},
+        ),
+        migrations.AddIndex(
+            model_name='hero',
+            index=models.Index(fields=['status', 'current_rank'], name='api_hero_status_e97881_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hero',
+            index=models.Index(fields=['status', 'created_at'], name='api_hero_status_b7b142_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hero',
+            index=models.Index(fields=['current_rank'], name='api_hero_current_9f7b41_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hero',
+            index=models.Index(fields=['created_at'], name='api_hero_created_792b2e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='heroscore',
+            index=models.Index(fields=['date'], name='api_herosco_date_23f0db_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='hero',
+            index=models.Index(fields=['updated_at'], name='api_hero_updated_689be5_idx'),
+        ),
+    ]
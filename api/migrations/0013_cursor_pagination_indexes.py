@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_hero_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='hero',
+            name='api_hero_current_9f7b41_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='hero',
+            name='api_hero_created_792b2e_idx',
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['created_at', 'id'], name='api_card_created_6e9c53_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hero',
+            index=models.Index(fields=['current_rank', 'id'], name='api_hero_current_c0c2d5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hero',
+            index=models.Index(fields=['created_at', 'id'], name='api_hero_created_e99811_idx'),
+        ),
+    ]
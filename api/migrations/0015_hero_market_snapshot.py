@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:25
+
+from django.db import migrations, models
+
+MARKET_SNAPSHOT_FIELDS = (
+    ('floor_prices', 'FloorPrice', ('rarity', 'price')),
+    ('highest_bids', 'HighestBid', ('rarity', 'price')),
+    ('card_supplies', 'CardSupply', ('rarity', 'amount', 'burnt', 'total')),
+)
+
+
+def backfill_market_snapshots(apps, schema_editor):
+    # Same shape as api.ingest.build_market_snapshots; heroes whose payload is unchanged are not rewritten by the poller
+    Hero = apps.get_model('api', 'Hero')
+    snapshots = {hero_id: {key: [] for key, _, _ in MARKET_SNAPSHOT_FIELDS} for hero_id in Hero.objects.values_list('id', flat=True)}
+    for key, model_name, fields in MARKET_SNAPSHOT_FIELDS:
+        model = apps.get_model('api', model_name)
+        for row in model.objects.order_by('hero_id', 'rarity').values('hero_id', *fields).iterator(chunk_size=5000):
+            snapshots[row.pop('hero_id')][key].append(row)
+    Hero.objects.bulk_update(
+        [Hero(id=hero_id, market_snapshot=snapshot) for hero_id, snapshot in snapshots.items()],
+        ['market_snapshot'],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_card_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hero',
+            name='market_snapshot',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_market_snapshots, migrations.RunPython.noop),
+    ]
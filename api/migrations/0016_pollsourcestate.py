@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_hero_market_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PollSourceState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=50, unique=True)),
+                ('status', models.CharField(default='idle', max_length=20)),
+                ('interval', models.FloatField()),
+                ('consecutive_failures', models.IntegerField(default=0)),
+                ('runs', models.IntegerField(default=0)),
+                ('failures', models.IntegerField(default=0)),
+                ('last_started_at', models.DateTimeField(null=True)),
+                ('last_finished_at', models.DateTimeField(null=True)),
+                ('last_success_at', models.DateTimeField(null=True)),
+                ('last_duration', models.FloatField(null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('next_run_at', models.DateTimeField(null=True)),
+            ],
+        ),
+    ]
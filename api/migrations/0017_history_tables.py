@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_pollsourcestate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HeroStatHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.PositiveSmallIntegerField(choices=[(0, 'raw'), (1, 'hour'), (2, 'day')])),
+                ('ts', models.DateTimeField()),
+                ('stars', models.IntegerField(null=True)),
+                ('current_rank', models.IntegerField(null=True)),
+                ('fantasy_score', models.FloatField(null=True)),
+                ('volume', models.FloatField(null=True)),
+                ('last_sale', models.BigIntegerField(null=True)),
+                ('hero', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stat_history', to='api.hero')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['resolution', 'ts'], name='api_herosta_resolut_24117a_idx')],
+                'unique_together': {('hero', 'resolution', 'ts')},
+            },
+        ),
+        migrations.CreateModel(
+            name='MarketPriceHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.PositiveSmallIntegerField(choices=[(0, 'raw'), (1, 'hour'), (2, 'day')])),
+                ('ts', models.DateTimeField()),
+                ('rarity', models.CharField(max_length=50)),
+                ('floor_price', models.FloatField(null=True)),
+                ('highest_bid', models.BigIntegerField(null=True)),
+                ('hero', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_history', to='api.hero')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['resolution', 'ts'], name='api_marketp_resolut_661c10_idx')],
+                'unique_together': {('hero', 'resolution', 'ts', 'rarity')},
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_history_tables'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='heroscore',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='heroscore',
+            index=models.Index(fields=['updated_at'], name='api_herosco_updated_2cf711_idx'),
+        ),
+    ]
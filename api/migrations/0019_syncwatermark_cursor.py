@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_heroscore_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncwatermark',
+            name='cursor',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+    ]
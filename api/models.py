@@ -16,6 +16,12 @@ class Card(models.Model):
     timestamp = models.DateTimeField(null=True)
     picture = models.URLField(max_length=500, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id']),  # Cursor pagination, see api/pagination.py
+            models.Index(fields=['updated_at']),  # Exports with since=
+        ]
+
     def __str__(self):
         return f"Card {self.id} ({self.hero_id})"
 
@@ -59,6 +65,17 @@ class Hero(models.Model):
     tactic_image_prefix = models.CharField(max_length=255, null=True)
     volume = models.DecimalField(max_digits=40, decimal_places=0, null=True)
     last_sale = models.BigIntegerField(null=True)
+    # Floor prices, highest bids and card supply per rarity, kept in sync by the poller
+    market_snapshot = models.JSONField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'current_rank']),  # predict_star_swings
+            models.Index(fields=['status', 'created_at']),  # new_heroes
+            models.Index(fields=['current_rank', 'id']),  # Cursor pagination, see api/pagination.py
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['updated_at']),  # Incremental search index refresh
+        ]
 
     def __str__(self):
         return f"Hero {self.name} (@{self.handle})"
@@ -67,9 +84,14 @@ class HeroScore(models.Model):
     hero = models.ForeignKey(Hero, on_delete=models.CASCADE, related_name='scores')
     date = models.DateField()
     score = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ('hero', 'date')  # Ensure one score per hero per date
+        indexes = [
+            models.Index(fields=['date']),  # Trailing window averages
+            models.Index(fields=['updated_at']),  # Incremental refresh of the score matrix
+        ]
 
     def __str__(self):
         return f"{self.hero.name} - {self.date}: {self.score}"	
@@ -84,6 +106,9 @@ class FloorPrice(models.Model):
     price = models.FloatField(null=True)
     rarity = models.CharField(max_length=50)
 
+    class Meta:
+        unique_together = ('hero', 'rarity')
+
     def __str__(self):
         return f"{self.hero.name} - {self.rarity}: {self.price}"
 
@@ -92,6 +117,9 @@ class HighestBid(models.Model):
     price = models.BigIntegerField()
     rarity = models.CharField(max_length=50)
 
+    class Meta:
+        unique_together = ('hero', 'rarity')
+
     def __str__(self):
         return f"{self.hero.name} - {self.rarity}: {self.price}"
 
@@ -101,6 +129,9 @@ class CardSupply(models.Model):
     amount = models.IntegerField()
     burnt = models.IntegerField()
     total = models.IntegerField()
+
+    class Meta:
+        unique_together = ('hero', 'rarity')
     
 
 class TournamentScore(models.Model):
@@ -112,4 +143,97 @@ class TournamentScore(models.Model):
         unique_together = ('hero', 'index')  # Ensure one score per hero per index
 
     def __str__(self):
-        return f"{self.hero.name} - Score {self.index}: {self.score}"
\ No newline at end of file
+        return f"{self.hero.name} - Score {self.index}: {self.score}"
+
+class SyncWatermark(models.Model):
+    source = models.CharField(max_length=50)
+    key = models.CharField(max_length=100)  # Upstream row id, or '' for the source-wide watermark
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+    upstream_updated_at = models.DateTimeField(null=True)
+    # Id of the last row a keyset crawl wrote at upstream_updated_at, to resume right after it
+    cursor = models.CharField(max_length=100, blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('source', 'key')
+
+    def __str__(self):
+        return f"{self.source}:{self.key} ({self.upstream_updated_at})"
+
+
+class StarSwingSnapshot(models.Model):
+    poll_ts = models.DateTimeField(unique=True)  # Start of the poll cycle the predictions were computed after
+    etag = models.CharField(max_length=64)
+    data = models.JSONField()
+
+    def __str__(self):
+        return f"Star swing predictions at {self.poll_ts}"
+
+
+class PollSourceState(models.Model):
+    """Scheduler state of one upstream source polled by poll_data (see api/scheduler.py)."""
+    source = models.CharField(max_length=50, unique=True)
+    status = models.CharField(max_length=20, default='idle')  # idle, running, ok, failed, overdue, disabled
+    interval = models.FloatField()
+    consecutive_failures = models.IntegerField(default=0)
+    runs = models.IntegerField(default=0)
+    failures = models.IntegerField(default=0)
+    last_started_at = models.DateTimeField(null=True)
+    last_finished_at = models.DateTimeField(null=True)
+    last_success_at = models.DateTimeField(null=True)
+    last_duration = models.FloatField(null=True)  # Seconds
+    last_error = models.TextField(blank=True, default='')
+    next_run_at = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return f"{self.source}: {self.status}"
+
+
+class HistoryResolution(models.IntegerChoices):
+    RAW = 0, 'raw'
+    HOUR = 1, 'hour'
+    DAY = 2, 'day'
+
+
+class HeroStatHistory(models.Model):
+    """Hero stats over time, recorded by the poller (see api/history.py).
+
+    Raw rows are the samples themselves; hour and day rows hold the last sample of
+    their bucket and are stamped with the start of it.
+    """
+    hero = models.ForeignKey(Hero, on_delete=models.CASCADE, related_name='stat_history')
+    resolution = models.PositiveSmallIntegerField(choices=HistoryResolution.choices)
+    ts = models.DateTimeField()
+    stars = models.IntegerField(null=True)
+    current_rank = models.IntegerField(null=True)
+    fantasy_score = models.FloatField(null=True)
+    volume = models.FloatField(null=True)
+    last_sale = models.BigIntegerField(null=True)
+
+    class Meta:
+        unique_together = ('hero', 'resolution', 'ts')  # Also serves the range queries
+        indexes = [
+            models.Index(fields=['resolution', 'ts']),  # Retention
+        ]
+
+    def __str__(self):
+        return f"{self.hero_id} at {self.ts} ({self.get_resolution_display()})"
+
+
+class MarketPriceHistory(models.Model):
+    """Floor price and highest bid per rarity over time, stored like HeroStatHistory."""
+    hero = models.ForeignKey(Hero, on_delete=models.CASCADE, related_name='price_history')
+    resolution = models.PositiveSmallIntegerField(choices=HistoryResolution.choices)
+    ts = models.DateTimeField()
+    rarity = models.CharField(max_length=50)
+    floor_price = models.FloatField(null=True)
+    highest_bid = models.BigIntegerField(null=True)
+
+    class Meta:
+        unique_together = ('hero', 'resolution', 'ts', 'rarity')  # Also serves the range queries
+        indexes = [
+            models.Index(fields=['resolution', 'ts']),  # Retention
+        ]
+
+    def __str__(self):
+        return f"{self.hero_id} rarity {self.rarity} at {self.ts} ({self.get_resolution_display()})"
@@ -0,0 +1,34 @@
+# api/pagination.py
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetCursorPagination(CursorPagination):
+    """Cursor pagination over one of the view's `cursor_ordering_fields`, chosen with `?ordering=`.
+
+    Pages are fetched with `WHERE field > last_seen ORDER BY field, id LIMIT n`, so the
+    cost of a page does not grow with its depth or with the size of the table. Rows
+    with a NULL in the ordering field cannot be positioned and are left out.
+    """
+
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = 'id'
+
+    def get_ordering(self, request, queryset, view):
+        allowed = getattr(view, 'cursor_ordering_fields', ('id',))
+        ordering = request.query_params.get('ordering') or allowed[0]
+        if ordering.lstrip('-') not in allowed:
+            raise ValidationError({'ordering': f"Must be one of: {', '.join(allowed)} (prefix with '-' to reverse)"})
+        field = ordering.lstrip('-')
+        if field == 'id':
+            return (ordering,)
+        # id breaks ties so rows sharing a value keep a stable order across pages
+        return (ordering, '-id' if ordering.startswith('-') else 'id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        field = self.get_ordering(request, queryset, view)[0].lstrip('-')
+        if queryset.model._meta.get_field(field).null:
+            queryset = queryset.filter(**{f'{field}__isnull': False})
+        return super().paginate_queryset(queryset, request, view)
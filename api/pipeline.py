@@ -0,0 +1,175 @@
+# api/pipeline.py
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.db import connection
+
+
+class DBWriter:
+    """Runs database writes on one dedicated thread, in submission order.
+
+    SQLite allows a single writer at a time; funnelling every write of the poller
+    through this thread keeps concurrently polled sources from contending for the lock.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        self.queue.put((future, func, args, kwargs))
+        return future
+
+    def call(self, func, *args, **kwargs):
+        return self.submit(func, *args, **kwargs).result()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                connection.close()
+                return
+            future, func, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+
+class Stage:
+    """One source of the poll cycle.
+
+    `fetch()` runs on its own worker thread and returns the parsed payload.
+    `write(payload)` then runs on the DB writer, once every stage named in
+    `depends_on` has finished. Either part may be omitted. With `skip_on_failure`
+    (the default) the stage is skipped when a dependency failed or was skipped.
+    """
+
+    def __init__(self, name, fetch=None, write=None, depends_on=(), skip_on_failure=True):
+        self.name = name
+        self.fetch = fetch
+        self.write = write
+        self.depends_on = tuple(depends_on)
+        self.skip_on_failure = skip_on_failure
+
+
+class StageResult:
+    def __init__(self, name):
+        self.name = name
+        self.status = 'pending'
+        self.error = None
+        # What write() returned, or fetch() for a stage without a write
+        self.summary = None
+        self.fetch_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.write_seconds = 0.0
+        self.finished_at = None
+
+
+class Pipeline:
+    """Runs stages concurrently, ordering their writes by the dependency graph.
+
+    Without a `db_writer` writes run on the calling thread.
+    """
+
+    def __init__(self, stages, db_writer=None):
+        self.stages = {stage.name: stage for stage in stages}
+        self.db_writer = db_writer
+        self.order = self._topological_order()
+
+    def _topological_order(self):
+        order, visiting, done = [], set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f'Dependency cycle through stage {name}')
+            if name not in self.stages:
+                raise ValueError(f'Unknown stage {name}')
+            visiting.add(name)
+            for dependency in self.stages[name].depends_on:
+                visit(dependency)
+            visiting.discard(name)
+            done.add(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def run_stage(self, name, wait_for_dependencies=None):
+        """Fetch and write one stage and return its StageResult.
+
+        `wait_for_dependencies()`, if given, is called between the two parts; it blocks
+        until the write may go ahead and returns the dependencies that did not complete.
+        """
+        stage = self.stages[name]
+        result = StageResult(name)
+        started = time.perf_counter()
+        try:
+            payload = None
+            if stage.fetch is not None:
+                began = time.perf_counter()
+                payload = stage.fetch()
+                result.fetch_seconds = time.perf_counter() - began
+
+            if wait_for_dependencies is not None:
+                began = time.perf_counter()
+                blocked = wait_for_dependencies()
+                result.wait_seconds = time.perf_counter() - began
+                if blocked and stage.skip_on_failure:
+                    result.status = 'skipped'
+                    result.error = f"dependency {', '.join(blocked)} did not complete"
+                    return result
+
+            if stage.write is not None:
+                began = time.perf_counter()
+                if self.db_writer is None:
+                    payload = stage.write(payload)
+                else:
+                    payload = self.db_writer.call(stage.write, payload)
+                result.write_seconds = time.perf_counter() - began
+            result.summary = payload
+            result.status = 'ok'
+        except Exception as e:
+            result.status = 'failed'
+            result.error = f'{type(e).__name__}: {e}'
+        finally:
+            result.finished_at = time.perf_counter() - started
+        return result
+
+    def run(self):
+        """Run one cycle and return {stage name: StageResult} in dependency order."""
+        results = {}
+        written = {name: threading.Event() for name in self.order}
+        started = time.perf_counter()
+
+        def run_stage(name):
+            def wait_for_dependencies():
+                for dependency in self.stages[name].depends_on:
+                    written[dependency].wait()
+                return [dependency for dependency in self.stages[name].depends_on if results[dependency].status != 'ok']
+
+            try:
+                results[name] = self.run_stage(name, wait_for_dependencies)
+                results[name].finished_at = time.perf_counter() - started
+            finally:
+                written[name].set()
+                # Fetch threads read watermarks; don't leave their connections open between cycles
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=len(self.order), thread_name_prefix='poll-stage') as executor:
+            for name in self.order:
+                executor.submit(run_stage, name)
+        return {name: results[name] for name in self.order}
@@ -0,0 +1,130 @@
+# api/predictions.py
+import numpy as np
+from django.conf import settings
+
+# Columns build_predictions() expects, in this order, one row per HERO ordered by current_rank
+HERO_FIELDS = (
+    'id', 'name', 'current_rank', 'fantasy_score', 'stars',
+    'median_7_days', 'median_14_days', 'change_1_day', 'change_7_days',
+)
+
+DEFAULT_STAR_BUCKETS = {
+    'THRESHOLDS': [15, 32, 50, 67, 82],
+    'STARS': [7, 6, 5, 4, 3, 2],
+}
+
+
+def star_buckets(buckets=None):
+    """(thresholds, stars) arrays from `buckets`, settings.STAR_SWING_BUCKETS by default; see predict_stars()."""
+    buckets = buckets or getattr(settings, 'STAR_SWING_BUCKETS', DEFAULT_STAR_BUCKETS)
+    thresholds = np.asarray(buckets['THRESHOLDS'], dtype=np.float64)
+    stars = np.asarray(buckets['STARS'], dtype=np.int64)
+    if len(stars) != len(thresholds) + 1 or np.any(np.diff(thresholds) <= 0):
+        raise ValueError('STAR_SWING_BUCKETS needs increasing THRESHOLDS and one more STARS entry than thresholds')
+    return thresholds, stars
+
+
+def predict_stars(percentiles, buckets=None):
+    """Stars for each league percentile: STARS[i] for the first threshold the percentile is <= to, else the last entry."""
+    thresholds, stars = buckets or star_buckets()
+    return stars[np.searchsorted(thresholds, percentiles, side='left')]
+
+
+def nullable(values):
+    """float64 array of `values` with None as NaN, plus the mask of values that were set."""
+    array = np.fromiter((np.nan if value is None else value for value in values), dtype=np.float64, count=len(values))
+    return array, ~np.isnan(array)
+
+
+def performance_changes(matrix, hero_ids, short=7, long=30, now=None):
+    """analytics.performance_change() for every hero at once, as of `now`.
+
+    Returns the changes and the mask of heroes the change is defined for; the others
+    are reported as 0, like performance_change() does for them.
+    """
+    with matrix.lock:
+        rows = matrix.rows_for(hero_ids)
+        short_avg = matrix.window_mean(short, now)
+        long_avg = matrix.window_mean(long, now)
+    known = rows >= 0
+    short_avg = np.where(known, short_avg[rows], 0.0) if len(short_avg) else np.zeros(len(rows))
+    long_avg = np.where(known, long_avg[rows], 0.0) if len(long_avg) else np.zeros(len(rows))
+    defined = known & (long_avg != 0)
+    changes = np.divide(short_avg - long_avg, long_avg, out=np.zeros(len(rows)), where=defined)
+    return changes, defined
+
+
+def recovery_potentials(median_7_days, median_14_days, change_1_day):
+    """Weighted mix of the 14 vs 7 day median drop and the last day's change.
+
+    Returns the potentials and the mask of heroes with every input set; the others
+    (heroes stored before huddle sent their score summary) are reported as 0.
+    """
+    m7, has_m7 = nullable(median_7_days)
+    m14, has_m14 = nullable(median_14_days)
+    trend, has_trend = nullable(change_1_day)
+    defined = has_m7 & has_m14 & has_trend
+    normalized_diff = np.divide(m14 - m7, m14, out=np.zeros(len(m14)), where=defined & (m14 != 0))
+    return np.where(defined, normalized_diff * 0.7 + trend * 0.3, 0.0), defined
+
+
+def top_k(magnitude, performance, k):
+    """Indices of the k entries a stable sort on (magnitude, -performance), reverse=True, puts first.
+
+    That is largest magnitude first, then smallest performance, then original position.
+    argpartition narrows the candidates to those that can make the cut, so only they are sorted.
+    """
+    candidates = np.arange(len(magnitude))
+    if len(candidates) > k > 0:
+        kth = magnitude[np.argpartition(magnitude, len(magnitude) - k)[len(magnitude) - k]]
+        above = candidates[magnitude > kth]
+        boundary = candidates[magnitude == kth]
+        needed = k - len(above)
+        if len(boundary) > needed:
+            cut = performance[boundary[np.argpartition(performance[boundary], needed - 1)[needed - 1]]]
+            boundary = boundary[performance[boundary] <= cut]
+        candidates = np.concatenate([above, boundary])
+    order = np.lexsort((candidates, performance[candidates], -magnitude[candidates]))
+    return candidates[order][:k]
+
+
+def build_predictions(rows, matrix, limit=20, buckets=None, now=None):
+    """Potential star losers and gainers among `rows` (HERO_FIELDS tuples ordered by current_rank).
+
+    The percentile of a hero is its rank over the number of rows. Heroes whose
+    predicted stars differ from their current stars are ranked by the size of the
+    change, then by how far their 7 day average fell behind the 30 day one as of `now`.
+    Returns ({'potential_losers': [...], 'potential_gainers': [...]}, skipped rows).
+    """
+    fields = {name: [row[index] for row in rows] for index, name in enumerate(HERO_FIELDS)}
+    ranks, ranked = nullable(fields['current_rank'])
+    percentiles = ranks / len(rows) * 100
+    star_change = np.where(ranked, predict_stars(np.where(ranked, percentiles, 0.0), buckets) - np.asarray(fields['stars'], dtype=np.int64), 0)
+    performance, has_performance = performance_changes(matrix, fields['id'], now=now)
+    recovery, has_recovery = recovery_potentials(fields['median_7_days'], fields['median_14_days'], fields['change_1_day'])
+
+    def hero_data(index):
+        row = dict(zip(HERO_FIELDS, rows[index]))
+        change = int(star_change[index])
+        return {
+            'name': row['name'],
+            'current_rank': row['current_rank'],
+            'fantasy_score': row['fantasy_score'],
+            'current_stars': row['stars'],
+            'predicted_stars': row['stars'] + change,
+            'star_change': change,
+            'performance_change': float(performance[index]) if has_performance[index] else 0,
+            'recovery_potential': float(recovery[index]) if has_recovery[index] else 0,
+            'median_7_days': row['median_7_days'],
+            'median_14_days': row['median_14_days'],
+            'change_1_day': row['change_1_day'],
+            'change_7_days': row['change_7_days'],
+        }
+
+    predictions = {}
+    for key, side in (('potential_losers', star_change < 0), ('potential_gainers', star_change > 0)):
+        indices = np.flatnonzero(side)
+        top = top_k(np.abs(star_change[indices]), performance[indices], limit)
+        predictions[key] = [hero_data(index) for index in indices[top]]
+    skipped = [rows[index] for index in np.flatnonzero(~ranked)]
+    return predictions, skipped
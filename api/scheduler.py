@@ -0,0 +1,257 @@
+# api/scheduler.py
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import connection
+from django.utils import timezone
+
+from .models import PollSourceState
+from .pipeline import Pipeline
+
+
+class Source:
+    """A pipeline Stage and its polling policy.
+
+    Each run fetches and writes the stage once; what it returns is logged as a short
+    summary. Runs start every `interval` seconds (measured from the previous start)
+    give or take `jitter` (a fraction of the interval). A run still going after
+    `deadline` seconds counts as failed. After a failure the next attempt is delayed
+    by `backoff_base` doubled for every consecutive failure, capped at `backoff_max`.
+
+    A stage with `depends_on` only runs once one of those stages has succeeded since
+    its last run, and then at most every `interval` seconds. An interval of 0 disables it.
+    """
+
+    def __init__(self, stage, interval, jitter=0.1, deadline=None, backoff_base=None, backoff_max=900):
+        self.stage = stage
+        self.name = stage.name
+        self.interval = interval
+        self.jitter = jitter
+        self.deadline = deadline
+        self.backoff_base = backoff_base or min(interval, 30)
+        self.backoff_max = backoff_max
+
+    @property
+    def after(self):
+        return self.stage.depends_on
+
+    @property
+    def enabled(self):
+        return self.interval > 0
+
+
+class SourceState:
+    def __init__(self, source):
+        self.source = source
+        self.status = 'idle' if source.enabled else 'disabled'
+        self.future = None
+        self.started = None  # time.monotonic() of the current or last start
+        self.next_run = None if source.after or not source.enabled else 0.0
+        self.triggered = False
+        self.overdue = False
+        self.consecutive_failures = 0
+        self.runs = 0
+        self.failures = 0
+        self.last_started_at = None
+        self.last_finished_at = None
+        self.last_success_at = None
+        self.last_duration = None
+        self.last_error = ''
+
+
+class Scheduler:
+    """Runs every enabled source on its own schedule and thread.
+
+    A slow or failing source only delays itself. Each run goes through a Pipeline of
+    the sources' stages, which checks their dependency graph and sends writes to
+    `db_writer`. State changes are persisted to PollSourceState through `persist` (by
+    default straight to the database) so `poll_status` and /api/poll-status/ can show them.
+    """
+
+    def __init__(self, sources, db_writer=None, persist=None, clock=time.monotonic, rng=random.uniform, log=logging.info):
+        self.states = {source.name: SourceState(source) for source in sources}
+        self.pipeline = Pipeline([source.stage for source in sources], db_writer)
+        self.persist = persist or (lambda func, *args: func(*args))
+        self.clock = clock
+        self.rng = rng
+        self.log = log
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, len(self.states)), thread_name_prefix='poll-source')
+        for state in self.states.values():
+            self._save(state)
+
+    def run_forever(self, stop=None, tick=0.5):
+        stop = stop or threading.Event()
+        try:
+            while not stop.is_set():
+                self.tick()
+                stop.wait(tick)
+        finally:
+            self.executor.shutdown(wait=True)
+
+    def run_once(self, tick=0.1):
+        """Run every enabled source a single time and wait for all of them.
+
+        Sources with `after` set start once every enabled source they follow has finished.
+        If one of those did not succeed, the source is skipped unless its stage has
+        `skip_on_failure` turned off.
+        """
+        with self.lock:
+            pending = {name for name, state in self.states.items() if state.source.enabled}
+            now = self.clock()
+            for state in self.states.values():
+                state.next_run = None
+                if state.source.enabled and not state.source.after:
+                    self._start(state, now)
+        try:
+            while pending:
+                with self.lock:
+                    for state in self._collect():
+                        pending.discard(state.source.name)
+                    now = self.clock()
+                    for name in list(pending):
+                        state = self.states[name]
+                        if state.future is None and not set(state.source.after) & pending:
+                            blocked = [
+                                dependency for dependency in state.source.after
+                                if self.states[dependency].source.enabled and self.states[dependency].status != 'ok'
+                            ]
+                            if blocked and state.source.stage.skip_on_failure:
+                                self._skipped(state, blocked)
+                                pending.discard(name)
+                            else:
+                                self._start(state, now)
+                time.sleep(tick)
+        finally:
+            self.executor.shutdown(wait=True)
+        return {name: state.status for name, state in self.states.items()}
+
+    def tick(self):
+        """Record finished runs, flag runs past their deadline and start every source that is due."""
+        with self.lock:
+            self._collect()
+            now = self.clock()
+            for state in self.states.values():
+                source = state.source
+                if state.future is not None:
+                    if source.deadline and not state.overdue and now - state.started > source.deadline:
+                        state.overdue = True
+                        state.status = 'overdue'
+                        self.log(f'{source.name}: still running after its {source.deadline:.0f}s deadline')
+                        self._save(state)
+                    continue
+                if source.after and state.triggered and state.next_run is None:
+                    state.next_run = now if state.started is None else max(now, state.started + source.interval)
+                if state.next_run is not None and now >= state.next_run:
+                    self._start(state, now)
+
+    def _collect(self):
+        finished = []
+        for state in self.states.values():
+            future = state.future
+            if future is not None and future.done():
+                self._finished(state, future.result())
+                finished.append(state)
+        return finished
+
+    def _start(self, state, now):
+        state.started = now
+        state.next_run = None
+        state.triggered = False
+        state.overdue = False
+        state.status = 'running'
+        state.last_started_at = timezone.now()
+        self._save(state)
+        state.future = self.executor.submit(self._run, state)
+
+    def _run(self, state):
+        try:
+            return self.pipeline.run_stage(state.source.name)
+        finally:
+            # Each source thread reads the database; don't keep its connection between runs
+            connection.close()
+
+    def _skipped(self, state, blocked):
+        state.status = 'skipped'
+        state.last_error = f"dependency {', '.join(blocked)} did not complete"
+        self.log(f'{state.source.name}: skipped, {state.last_error}')
+        self._save(state)
+
+    def _finished(self, state, result):
+        source = state.source
+        now = self.clock()
+        duration = now - state.started
+        error = result.error
+        if error is None and source.deadline and duration > source.deadline:
+            error = f'deadline of {source.deadline:.0f}s exceeded ({duration:.1f}s)'
+
+        state.runs += 1
+        state.last_duration = duration
+        state.last_finished_at = timezone.now()
+        if error is None:
+            state.status = 'ok'
+            state.consecutive_failures = 0
+            state.last_success_at = state.last_finished_at
+            state.last_error = ''
+            if not source.after:
+                state.next_run = state.started + self._jittered(source.interval, source)
+            for other in self.states.values():
+                if source.name in other.source.after and other.source.enabled:
+                    other.triggered = True
+            self.log(f'{source.name}: ok in {duration:.2f}s ({self._timings(result)})' + (f': {result.summary}' if result.summary else ''))
+        else:
+            state.status = 'failed'
+            state.failures += 1
+            state.consecutive_failures += 1
+            state.last_error = str(error)
+            delay = min(source.backoff_max, source.backoff_base * 2 ** (state.consecutive_failures - 1))
+            state.next_run = now + self._jittered(delay, source)
+            self.log(
+                f'{source.name}: failed after {duration:.2f}s ({self._timings(result)}): {error}; '
+                f'attempt {state.consecutive_failures}, retrying in {state.next_run - now:.0f}s'
+            )
+        state.future = None
+        self._save(state)
+
+    def _timings(self, result):
+        return f'fetch {result.fetch_seconds:.2f}s, write {result.write_seconds:.2f}s'
+
+    def _jittered(self, seconds, source):
+        spread = seconds * source.jitter
+        return max(0.0, seconds + self.rng(-spread, spread))
+
+    def _save(self, state):
+        now = self.clock()
+        next_run_at = None
+        if state.next_run is not None:
+            next_run_at = timezone.now() + timedelta(seconds=max(0.0, state.next_run - now))
+        values = {
+            'status': state.status,
+            'interval': state.source.interval,
+            'consecutive_failures': state.consecutive_failures,
+            'runs': state.runs,
+            'failures': state.failures,
+            'last_started_at': state.last_started_at,
+            'last_finished_at': state.last_finished_at,
+            'last_success_at': state.last_success_at,
+            'last_duration': state.last_duration,
+            'last_error': state.last_error,
+            'next_run_at': next_run_at,
+        }
+        self.persist(save_source_state, state.source.name, values)
+
+
+def save_source_state(name, values):
+    PollSourceState.objects.update_or_create(source=name, defaults=values)
+
+
+def source_states():
+    """Persisted state of every polled source, for poll_status and /api/poll-status/."""
+    return list(PollSourceState.objects.order_by('source').values(
+        'source', 'status', 'interval', 'consecutive_failures', 'runs', 'failures', 'last_started_at',
+        'last_finished_at', 'last_success_at', 'last_duration', 'last_error', 'next_run_at',
+    ))
@@ -0,0 +1,143 @@
+# api/search.py
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+
+from .models import Hero
+
+# Fields returned for each search hit; enough for autocomplete without the full hero payload
+SEARCH_FIELDS = ('id', 'handle', 'name', 'profile_image_url_https', 'stars', 'current_rank', 'status')
+
+# Seconds between checks for heroes the poller has written since the last refresh
+SEARCH_INDEX_MAX_AGE = 5
+
+MAX_GRAM = 3
+
+
+def grams(text):
+    """Every substring of up to MAX_GRAM characters, so queries of any length can be answered."""
+    text = text.lower()
+    return {text[i:i + n] for n in range(1, MAX_GRAM + 1) for i in range(len(text) - n + 1)}
+
+
+class HeroSearchIndex:
+    """In-memory n-gram index over hero handles and names.
+
+    A query of up to MAX_GRAM characters is a single dict lookup. Longer queries
+    intersect the posting sets of their trigrams and then confirm the substring
+    match, so results are the same as a case-insensitive `icontains` on handle or name.
+    """
+
+    def __init__(self):
+        self.records = {}
+        self.texts = {}
+        self.postings = {}
+        self.watermark = None
+        self.checked_at = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """Index heroes written since the last refresh (all of them on the first call)."""
+        heroes = Hero.objects.all()
+        if self.watermark is not None:
+            # >= rather than >: a write committed later can carry the same timestamp
+            heroes = heroes.filter(updated_at__gte=self.watermark)
+        rows = list(heroes.values(*SEARCH_FIELDS, 'updated_at'))
+        with self.lock:
+            for row in rows:
+                updated_at = row.pop('updated_at')
+                if updated_at and (self.watermark is None or updated_at > self.watermark):
+                    self.watermark = updated_at
+                self._put(row)
+            indexed = len(self.records)
+        # Deletions leave no updated_at behind. Every live hero is indexed by now,
+        # so more records than heroes means some of them are gone
+        if Hero.objects.count() != indexed:
+            live = set(Hero.objects.values_list('id', flat=True))
+            with self.lock:
+                for hero_id in [hero_id for hero_id in self.records if hero_id not in live]:
+                    self._remove(hero_id)
+        self.checked_at = time.monotonic()
+        return len(rows)
+
+    def _put(self, record):
+        hero_id = record['id']
+        handle = (record['handle'] or '').lower()
+        name = (record['name'] or '').lower()
+        old = self.texts.get(hero_id)
+        if old is not None:
+            if old == (handle, name):
+                self.records[hero_id] = record
+                return
+            for gram in grams(old[0]) | grams(old[1]):
+                self.postings[gram].discard(hero_id)
+        self.records[hero_id] = record
+        self.texts[hero_id] = (handle, name)
+        for gram in grams(handle) | grams(name):
+            self.postings.setdefault(gram, set()).add(hero_id)
+
+    def _remove(self, hero_id):
+        handle, name = self.texts.pop(hero_id)
+        del self.records[hero_id]
+        for gram in grams(handle) | grams(name):
+            self.postings[gram].discard(hero_id)
+
+    def search(self, query, limit=20, offset=0):
+        """Return (total matches, one page of compact records) ranked by match quality, then rank."""
+        query = query.lower()
+        with self.lock:
+            if len(query) <= MAX_GRAM:
+                matches = set(self.postings.get(query, ()))
+            else:
+                candidates = None
+                for i in range(len(query) - MAX_GRAM + 1):
+                    posting = self.postings.get(query[i:i + MAX_GRAM], set())
+                    candidates = posting if candidates is None else candidates & posting
+                    if not candidates:
+                        break
+                matches = {
+                    hero_id for hero_id in candidates or ()
+                    if query in self.texts[hero_id][0] or query in self.texts[hero_id][1]
+                }
+            ranked = sorted(matches, key=lambda hero_id: self._rank_key(hero_id, query))
+            return len(ranked), [self.records[hero_id] for hero_id in ranked[offset:offset + limit]]
+
+    def _rank_key(self, hero_id, query):
+        handle, name = self.texts[hero_id]
+        if handle == query:
+            quality = 0
+        elif handle.startswith(query):
+            quality = 1
+        elif name.startswith(query):
+            quality = 2
+        elif query in handle:
+            quality = 3
+        else:
+            quality = 4
+        current_rank = self.records[hero_id]['current_rank']
+        return quality, current_rank is None, current_rank or 0, handle
+
+
+_search_index = None
+_search_index_lock = threading.Lock()
+
+
+def get_search_index(max_age=SEARCH_INDEX_MAX_AGE):
+    """Process-wide HeroSearchIndex, refreshed from Hero.updated_at at most every `max_age` seconds."""
+    global _search_index
+    with _search_index_lock:
+        if _search_index is None:
+            _search_index = HeroSearchIndex()
+            _search_index.refresh()
+        elif max_age is not None and time.monotonic() - _search_index.checked_at > max_age:
+            _search_index.refresh()
+        return _search_index
+
+
+async def aget_search_index(max_age=SEARCH_INDEX_MAX_AGE):
+    """get_search_index() for async views; only a due refresh leaves the event loop."""
+    index = _search_index
+    if index is not None and (max_age is None or time.monotonic() - index.checked_at <= max_age):
+        return index
+    return await sync_to_async(get_search_index)(max_age)
@@ -1,3 +1,1364 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import wait
+from unittest import mock
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Create your tests here.
+import numpy as np
+import requests
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Avg
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.renderers import JSONRenderer
+
+from . import async_views
+from .analytics import HeroScoreMatrix, get_score_matrix, window_averages
+from .cache import SCOPES, CacheStats, LocalBackend, bump_generation, response_cache
+from .fetcher import DetailFetcher, TokenBucket, parse_retry_after
+from .management.commands import poll_data
+from .management.commands.predict_star_swings import Command as PredictStarSwingsCommand
+from .history import RAW_HEARTBEAT, prune_history, record_history
+from .predictions import performance_changes, predict_stars, top_k
+from .ingest import (
+    CARD_SOURCE, HERO_DETAIL_SOURCE, HERO_SOURCE, TOURNAMENT_SOURCE, HeroPageWriter, build_market_snapshots, bulk_upsert,
+    get_source_cursor, get_source_watermark, ingest_cards, ingest_hero_scores, ingest_tournament_scores, load_watermarks,
+    save_watermarks,
+)
+from .pipeline import DBWriter, Pipeline, Stage
+from .scheduler import Scheduler, Source
+from .search import SEARCH_FIELDS, HeroSearchIndex, get_search_index
+from .serializers import CardSerializer, HeroSerializer
+from .tokens import TokenManager, jwt_expiry
+from .upstream import ResponseCache, UpstreamClient
+from .models import (
+    Card, CardSupply, FloorPrice, Hero, HeroScore, HeroStatHistory, HighestBid, HistoryResolution, MarketPriceHistory, Player,
+    PollSourceState, StarSwingSnapshot, SyncWatermark, TournamentScore,
+)
+
+
+def create_league():
+    """30 heroes with market rows, tournament scores, 40 days of scores and a card each."""
+    for i in range(1, 31):
+        hero = Hero.objects.create(
+            id=f'h{i}', handle=f'handle{i}', name=f'Hero {i}', followers_count=i, is_player=False,
+            stars=i % 5 + 2, status='HERO' if i % 3 else 'PENDING_HERO', current_rank=i,
+            median_7_days=1.0, median_14_days=2.0, change_1_day=0.1, change_7_days=0.2,
+        )
+        for rarity in ('1', '2'):
+            FloorPrice.objects.create(hero=hero, rarity=rarity, price=1.0)
+            HighestBid.objects.create(hero=hero, rarity=rarity, price=1)
+            CardSupply.objects.create(hero=hero, rarity=rarity, amount=1, burnt=0, total=1)
+        for index in range(20):
+            TournamentScore.objects.create(hero=hero, index=index, score=index)
+        for day in range(40):
+            HeroScore.objects.create(hero=hero, date=date.today() - timedelta(days=day), score=day)
+        Card.objects.create(
+            id=f'c{i}', owner='0x0', hero_id=hero.id, rarity=1, hero_rarity_index=f'{hero.id}_1_{i}',
+            token_id=str(i), season=1, created_at=timezone.now(), updated_at=timezone.now(), tx_hash='0x0',
+        )
+    StarSwingSnapshot.objects.create(poll_ts=timezone.now(), etag='x', data={})
+
+
+class LeagueTestCase(TestCase):
+    """Runs against create_league(), with helpers to check the queries a request issues."""
+
+    # "SCAN api_hero" on its own is a full table scan; "SCAN ... USING INDEX" walks an index
+    FULL_SCAN = re.compile(r'^SCAN (TABLE )?(\w+)$')
+
+    @classmethod
+    def setUpTestData(cls):
+        create_league()
+
+    def setUp(self):
+        # Build the in-memory matrix and search index up front: their first load reads whole tables on purpose
+        get_score_matrix()
+        get_search_index()
+        # Start cold so every request reaches the view and its queries
+        response_cache.clear()
+
+    def assertQueriesUseIndexes(self, queries):
+        selects = [query['sql'] for query in queries if query['sql'].lstrip().upper().startswith('SELECT')]
+        self.assertTrue(selects)
+        for sql in selects:
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                plan = [row[-1] for row in cursor.fetchall()]
+            for step in plan:
+                self.assertIsNone(self.FULL_SCAN.match(step), f'Full table scan in {plan} for {sql}')
+                self.assertNotIn('TEMP B-TREE FOR ORDER BY', step, f'Unindexed sort in {plan} for {sql}')
+
+    def data_queries(self, queries):
+        # Leaves out the response cache's generation check
+        return [query for query in queries if 'api_syncwatermark' not in query['sql']]
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return queries
+
+
+class QueryPlanTests(LeagueTestCase):
+    """Every SELECT issued by the read paths must be answered through an index, not a table scan."""
+
+    def test_hero_reads(self):
+        for url in (
+            '/api/heroes/h1/', '/api/hero-market-data/h1/', '/api/hero-market-data/?ids=h1,h2,h3',
+            '/api/hero-tournament-scores/h1/', '/api/hero-performance/h1/',
+        ):
+            self.assertQueriesUseIndexes(self.get(url))
+
+    def test_list_pages(self):
+        for url in (
+            '/api/heroes/?ordering=id&page_size=10', '/api/heroes/?ordering=current_rank&page_size=10',
+            '/api/heroes/?ordering=-created_at&page_size=10&fields=id,handle', '/api/cards/?ordering=created_at&fields=id,hero_id',
+        ):
+            self.assertQueriesUseIndexes(self.get(url))
+
+    def test_export_since(self):
+        with CaptureQueriesContext(connection) as queries:
+            b''.join(self.client.get(f'/api/export/hero-scores.csv?since={date.today()}').streaming_content)
+        self.assertQueriesUseIndexes(queries)
+
+    def test_predict_star_swings(self):
+        self.assertQueriesUseIndexes(self.get('/api/predict-star-swings/'))
+        self.assertQueriesUseIndexes(self.get('/api/predict-star-swings/?as_of=2100-01-01'))
+        with CaptureQueriesContext(connection) as queries:
+            PredictStarSwingsCommand(stdout=io.StringIO()).build_predictions()
+        self.assertQueriesUseIndexes(queries)
+
+    def test_score_matrix_refresh(self):
+        # A matrix left over from another test would not match this league and reload in full
+        with mock.patch('api.analytics._score_matrix', None):
+            matrix = get_score_matrix()
+            with CaptureQueriesContext(connection) as queries:
+                matrix.refresh()
+        self.assertEqual(len(queries), 2)
+        self.assertQueriesUseIndexes(queries)
+
+    def test_search_heroes_by_handle(self):
+        get_search_index().checked_at = 0  # Force the incremental refresh query
+        self.assertQueriesUseIndexes(self.get('/api/search-heroes-by-handle/?handle=handle1'))
+
+    def test_new_heroes(self):
+        with CaptureQueriesContext(connection) as queries:
+            call_command('new_heroes', stdout=io.StringIO())
+        self.assertQueriesUseIndexes(queries)
+
+    def test_history(self):
+        record_history(timezone.now() - timedelta(minutes=5))
+        Hero.objects.filter(id='h1').update(current_rank=99)
+        with CaptureQueriesContext(connection) as queries:
+            record_history()
+        self.assertQueriesUseIndexes(queries)
+        for url in ('/api/hero-history/h1/?resolution=raw', '/api/hero-history/h1/', '/api/hero-market-history/h1/?rarity=2'):
+            self.assertQueriesUseIndexes(self.get(url))
+
+
+class MarketDataTests(LeagueTestCase):
+    def test_snapshot_matches_the_market_tables(self):
+        expected = self.client.get('/api/hero-market-data/h1/').json()
+        self.assertEqual(expected['floor_prices'], [{'rarity': '1', 'price': 1.0}, {'rarity': '2', 'price': 1.0}])
+        Hero.objects.filter(id='h1').update(market_snapshot=build_market_snapshots(['h1'])['h1'])
+        response_cache.clear()
+        queries = self.get('/api/hero-market-data/h1/')
+        # Served from the snapshot column alone
+        self.assertEqual(len(self.data_queries(queries)), 1)
+        self.assertEqual(self.client.get('/api/hero-market-data/h1/').json(), expected)
+
+    def test_batch(self):
+        few = self.get('/api/hero-market-data/?ids=h1,h2,missing')
+        many = self.get(f"/api/hero-market-data/?ids={','.join(f'h{i}' for i in range(1, 31))}")
+        self.assertEqual(len(self.data_queries(few)), 4)
+        self.assertEqual(len(self.data_queries(many)), 4)
+        body = self.client.get('/api/hero-market-data/?ids=h1,h2,missing').json()
+        self.assertEqual([hero['hero_id'] for hero in body['heroes']], ['h1', 'h2'])
+        self.assertEqual(body['not_found'], ['missing'])
+        self.assertEqual(body['heroes'][0], self.client.get('/api/hero-market-data/h1/').json())
+        self.assertEqual(self.client.get('/api/hero-market-data/').status_code, 400)
+
+    def test_missing_hero(self):
+        self.assertEqual(self.client.get('/api/hero-market-data/nope/').status_code, 404)
+
+
+class HeroListTests(LeagueTestCase):
+    def test_pages_follow_the_ordering(self):
+        for ordering, key in (('id', 'id'), ('current_rank', 'current_rank'), ('-created_at', 'created_at')):
+            url = f'/api/heroes/?ordering={ordering}&page_size=10&fields=id,handle'
+            ids = []
+            while url:
+                queries = self.get(url)
+                self.assertEqual(len(self.data_queries(queries)), 1)
+                body = self.client.get(url).json()
+                self.assertTrue(all(set(hero) == {'id', 'handle'} for hero in body['results']))
+                ids.extend(hero['id'] for hero in body['results'])
+                url = body['next']
+            expected = Hero.objects.order_by(ordering, 'id').values_list('id', flat=True)
+            self.assertEqual(ids, list(expected), ordering)
+
+    def test_list_matches_model_serializer(self):
+        Hero.objects.filter(id='h1').update(volume=10 ** 30, description='ünïcode \u2028')
+        for url, queryset, serializer_class in (
+            ('/api/heroes/?ordering=current_rank&page_size=1000', Hero.objects.order_by('current_rank', 'id'), HeroSerializer),
+            ('/api/cards/?page_size=1000', Card.objects.order_by('id'), CardSerializer),
+        ):
+            expected = JSONRenderer().render({
+                'next': None, 'previous': None, 'results': serializer_class(queryset, many=True).data,
+            })
+            self.assertEqual(self.client.get(url).content, expected)
+
+    def test_card_fields(self):
+        body = self.client.get('/api/cards/?ordering=created_at&fields=id,hero_id&page_size=5').json()
+        self.assertEqual(body['results'][0], {'id': 'c1', 'hero_id': 'h1'})
+        self.assertEqual(len(body['results']), 5)
+
+    def test_rejected_parameters(self):
+        self.assertEqual(self.client.get('/api/heroes/?ordering=handle').status_code, 400)
+        self.assertEqual(self.client.get('/api/heroes/?fields=nope').status_code, 400)
+
+
+class ExportTests(LeagueTestCase):
+    def export(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_ndjson(self):
+        response, body = self.export('/api/export/heroes.ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        heroes = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(len(heroes), 30)
+        self.assertEqual(heroes[0]['id'], 'h1')
+        self.assertNotIn('market_snapshot', heroes[0])
+        _, body = self.export('/api/export/hero-scores.ndjson')
+        self.assertEqual(body.count('\n'), 30 * 40)
+
+    def test_csv(self):
+        response, body = self.export('/api/export/cards.csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        lines = body.splitlines()
+        self.assertEqual(len(lines), 1 + 30)
+        self.assertTrue(lines[0].startswith('id,'))
+
+    def test_since(self):
+        _, body = self.export(f'/api/export/hero-scores.csv?since={date.today() - timedelta(days=1)}')
+        lines = body.splitlines()
+        self.assertEqual(lines[0], 'hero_id,date,score')
+        self.assertEqual(len(lines), 1 + 30 * 2)
+        self.assertTrue(all(row.split(',')[1] >= str(date.today() - timedelta(days=1)) for row in lines[1:]))
+
+
+class CachedResponseTests(LeagueTestCase):
+    def test_hit(self):
+        first = self.client.get('/api/hero-market-data/h1/')
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get('/api/hero-market-data/h1/')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(len(queries), 0)
+        # Every header the view set comes back, Vary and Allow included
+        self.assertIn('Accept', first['Vary'])
+        self.assertEqual({**second.headers, 'X-Cache': 'MISS'}, dict(first.headers))
+
+    def test_miss_once_the_bump_commits(self):
+        url = '/api/hero-market-data/h1/'
+        self.client.get(url)
+        with self.captureOnCommitCallbacks() as callbacks:
+            bump_generation('heroes')
+            response_cache.checked_at = None
+            self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        for callback in callbacks:
+            callback()
+        response_cache.checked_at = None
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+    def test_not_modified(self):
+        url = '/api/predict-star-swings/'
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH='"x"')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], '"x"')
+        self.assertEqual(len(queries), 0)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual((response.status_code, response['X-Cache']), (200, 'HIT'))
+
+    def test_lru_eviction(self):
+        stats = CacheStats()
+        backend = LocalBackend(stats, max_entries=2, max_bytes=10)
+        entry = lambda content: {'content': content, 'scopes': ('heroes',)}
+        backend.set('a', entry(b'1'))
+        backend.set('b', entry(b'2'))
+        backend.get('a')
+        backend.set('c', entry(b'3'))
+        # By count: 'b' was the least recently used
+        self.assertEqual(list(backend.entries), ['a', 'c'])
+        backend.set('d', entry(b'12345678'))
+        # By bytes: 1 + 1 + 8 is over 10, so the least recently used 'a' goes
+        self.assertEqual(list(backend.entries), ['c', 'd'])
+        self.assertEqual(backend.info(), {'entries': 2, 'bytes': 9})
+        # Larger than the whole cache: not stored
+        backend.set('e', entry(b'12345678901'))
+        self.assertNotIn('e', backend.entries)
+        self.assertEqual(stats.evictions, 2)
+
+        backend.set('f', {'content': b'4', 'scopes': ('cards',)})
+        backend.invalidate({'cards'})
+        self.assertEqual((list(backend.entries), stats.invalidations), (['d'], 1))
+
+    def test_cache_stats(self):
+        before = self.client.get('/api/cache-stats/').json()
+        first = self.client.get('/api/hero-market-data/h1/')
+        self.client.get('/api/hero-market-data/h1/')
+        self.client.get('/api/hero-market-data/h2/')
+        stats = self.client.get('/api/cache-stats/').json()
+        self.assertEqual((stats['hits'] - before['hits'], stats['misses'] - before['misses']), (1, 2))
+        self.assertEqual(stats['hit_rate'], round(stats['hits'] / (stats['hits'] + stats['misses']), 4))
+        self.assertEqual(stats['entries'], 2)
+        self.assertGreater(stats['bytes'], len(first.content))
+        self.assertEqual(set(stats['generations']), set(SCOPES))
+        self.assertFalse(self.client.get('/api/cache-stats/').has_header('X-Cache'))
+
+    def test_writes_invalidate_their_scopes(self):
+        hero, cards = '/api/hero-market-data/h1/', '/api/cards/?page_size=5'
+        self.client.get(hero)
+        self.client.get(cards)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_generation('cards')
+        response_cache.checked_at = None  # Re-read the generations on the next request
+        self.assertEqual(self.client.get(hero)['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get(cards)['X-Cache'], 'MISS')
+
+        writer = HeroPageWriter()
+        writer.add('h1', hero_defaults(1, name='Renamed'))
+        with self.captureOnCommitCallbacks(execute=True):
+            writer.flush()
+        response_cache.checked_at = None
+        response = self.client.get(hero)
+        self.assertEqual((response['X-Cache'], response.json()['name']), ('MISS', 'Renamed'))
+        self.assertEqual(self.client.get(cards)['X-Cache'], 'HIT')
+
+        with self.assertRaises(ValueError):
+            bump_generation('hero')
+
+    def test_new_generation_refreshes_the_score_matrix(self):
+        with mock.patch('api.analytics._score_matrix', None):
+            response_cache.current_generations()
+            before = get_score_matrix().window_averages(['h1'])['h1'][7]
+            HeroScore.objects.filter(hero_id='h1', date=date.today()).update(score=1000, updated_at=timezone.now())
+            # Same generation and not yet SCORE_MATRIX_MAX_AGE old: the matrix is left alone
+            self.assertEqual(get_score_matrix().window_averages(['h1'])['h1'][7], before)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                bump_generation('scores')
+            response_cache.clear()
+            response_cache.current_generations()
+            self.assertEqual(get_score_matrix().window_averages(['h1'])['h1'][7], before + 1000 / 8)
+
+
+class HistoryTests(LeagueTestCase):
+    def test_hero_history(self):
+        now = timezone.now()
+        for minutes in (3 * 24 * 60, 90, 30, 20, 0):
+            Hero.objects.filter(id='h1').update(current_rank=minutes)
+            record_history(now - timedelta(minutes=minutes))
+        prune_history(now)
+
+        self.assertEqual([point['current_rank'] for point in self.client.get('/api/hero-history/h1/?resolution=raw').json()['points']], [90, 30, 20, 0])
+        # Hour and day rows keep the last sample of their bucket, whatever the raw retention removed
+        body = self.client.get('/api/hero-history/h1/?start=2000-01-01').json()
+        self.assertEqual(body['resolution'], 'day')
+        self.assertEqual(body['points'][0]['current_rank'], 3 * 24 * 60)
+        self.assertEqual(body['points'][-1]['current_rank'], 0)
+
+        points = self.client.get('/api/hero-market-history/h1/?resolution=hour').json()['points']
+        self.assertEqual([(point['rarity'], point['floor_price'], point['highest_bid']) for point in points[:2]], [('1', 1.0, 1), ('2', 1.0, 1)])
+        self.assertEqual(self.client.get('/api/hero-history/h1/?resolution=week').status_code, 400)
+
+    def test_unchanged_samples_skip_raw_rows(self):
+        now = datetime(2024, 6, 10, 15, 0, tzinfo=dt_timezone.utc)
+        raw = lambda model, **filters: model.objects.filter(resolution=HistoryResolution.RAW, **filters).count()
+        self.assertEqual(record_history(now)['raw_heroes'], 20)
+
+        stats = record_history(now + timedelta(minutes=5))
+        self.assertEqual((stats['heroes'], stats['raw_heroes'], stats['raw_prices']), (20, 0, 0))
+        self.assertEqual((raw(HeroStatHistory), raw(MarketPriceHistory)), (20, 40))
+
+        Hero.objects.filter(id='h1').update(current_rank=99)
+        FloorPrice.objects.filter(hero_id='h2', rarity='1').update(price=2.5)
+        stats = record_history(now + timedelta(minutes=10))
+        self.assertEqual((stats['raw_heroes'], stats['raw_prices']), (1, 2))
+        self.assertEqual(raw(HeroStatHistory, hero_id='h1'), 2)
+        self.assertEqual(raw(MarketPriceHistory, hero_id='h2'), 4)
+        self.assertEqual(raw(MarketPriceHistory, hero_id='h1'), 2)
+        # The rollups still end with the latest sample
+        hour = HeroStatHistory.objects.get(hero_id='h1', resolution=HistoryResolution.HOUR, ts=now)
+        self.assertEqual(hour.current_rank, 99)
+
+        # An idle hero still gets a raw row every RAW_HEARTBEAT
+        stats = record_history(now + RAW_HEARTBEAT + timedelta(minutes=5))
+        self.assertEqual((stats['raw_heroes'], stats['raw_prices']), (19, 38))
+        self.assertEqual(record_history(now + RAW_HEARTBEAT + timedelta(minutes=10))['raw_heroes'], 1)
+
+    def test_prune_cuts_on_the_next_resolution(self):
+        now = datetime(2024, 6, 10, 15, 30, tzinfo=dt_timezone.utc)
+        for age in (timedelta(days=2, minutes=10), timedelta(days=2, minutes=40), timedelta(days=90, hours=2), timedelta(days=90, hours=16)):
+            record_history(now - age)
+        prune_history(now)
+        rows = lambda resolution: sorted(HeroStatHistory.objects.filter(hero_id='h1', resolution=resolution).values_list('ts', flat=True))
+        # Raw rows are kept from the hour and hour rows from the day their retention ends in
+        self.assertEqual(rows(HistoryResolution.RAW), [datetime(2024, 6, 8, 15, 20, tzinfo=dt_timezone.utc)])
+        self.assertEqual(
+            rows(HistoryResolution.HOUR),
+            [datetime(2024, 3, 12, 13, tzinfo=dt_timezone.utc), datetime(2024, 6, 8, 14, tzinfo=dt_timezone.utc), datetime(2024, 6, 8, 15, tzinfo=dt_timezone.utc)],
+        )
+
+    def test_history_leaves_the_response_cache(self):
+        # No generation bump is queued for after the commit
+        with self.captureOnCommitCallbacks() as callbacks:
+            record_history()
+        self.assertEqual(callbacks, [])
+        response = self.client.get('/api/hero-history/h1/')
+        self.assertEqual(response['Cache-Control'], 'max-age=60')
+        self.assertFalse(response.has_header('X-Cache'))
+
+
+class SearchTests(TestCase):
+    url = '/api/search-heroes-by-handle/'
+
+    @classmethod
+    def setUpTestData(cls):
+        for i, (handle, name, current_rank) in enumerate((
+            ('racer', 'Hero F', 4), ('qq', 'The Ace', None), ('space', 'Hero D', 3), ('zz', 'Ace Ventura', 2),
+            ('acer', 'Hero B', 1), ('ace', 'Zed', 5), ('nomatch', 'Other', 6),
+        )):
+            Hero.objects.create(id=f'h{i}', **hero_defaults(i, handle=handle, name=name, current_rank=current_rank))
+
+    def setUp(self):
+        response_cache.clear()
+        self.index = HeroSearchIndex()
+        self.index.refresh()
+        # The endpoint must not see an index built for another test's heroes
+        patcher = mock.patch('api.search._search_index', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def handles(self, query, **kwargs):
+        return [hero['handle'] for hero in self.index.search(query, **kwargs)[1]]
+
+    def test_ranking(self):
+        # Exact handle, handle prefix, name prefix, handle substring, name substring; then by current rank
+        self.assertEqual(self.handles('ace'), ['ace', 'acer', 'zz', 'space', 'racer', 'qq'])
+        self.assertEqual(self.handles('ACE'), self.handles('ace'))
+
+    def test_handle_and_name_matches(self):
+        # Longer queries go through the trigram postings and are confirmed on the full text
+        self.assertEqual(self.handles('acer'), ['acer', 'racer'])
+        self.assertEqual(self.handles('ventura'), ['zz'])
+        self.assertEqual(self.handles('hero d'), ['space'])
+        self.assertEqual(self.handles('aced'), [])
+        self.assertEqual(set(self.index.search('a')[1][0]), set(SEARCH_FIELDS))
+
+    def test_limit_and_offset(self):
+        self.assertEqual(self.index.search('ace', limit=2, offset=3), (6, self.index.search('ace')[1][3:5]))
+        body = self.client.get(self.url, {'handle': 'ace', 'limit': 2, 'offset': 1}).json()
+        self.assertEqual((body['count'], body['limit'], body['offset']), (6, 2, 1))
+        self.assertEqual([hero['handle'] for hero in body['heroes']], ['acer', 'zz'])
+
+    def test_incremental_refresh(self):
+        Hero.objects.filter(id='h6').update(handle='acem', updated_at=timezone.now())
+        Hero.objects.create(id='h7', **hero_defaults(7, handle='bace', current_rank=0))
+        Hero.objects.filter(id='h5').delete()
+        self.assertEqual(self.index.refresh(), 2)
+        self.assertEqual(self.handles('ace'), ['acer', 'acem', 'zz', 'bace', 'space', 'racer', 'qq'])
+        self.assertEqual(self.handles('nomatch'), [])
+        self.assertNotIn('h5', self.index.records)
+
+    def test_endpoint_errors(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'handle': 'ace', 'limit': 'ten'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'handle': 'xyz'}).status_code, 404)
+
+
+class HeroPerformanceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        hero = Hero.objects.create(id='h1', **hero_defaults(1))
+        for day, score in enumerate((123.806, 98.123, 110.417, 87.3, 140.02, 99.999, 101.5, 77.77, 120.12)):
+            HeroScore.objects.create(hero=hero, date=date.today() - timedelta(days=day * 4), score=score)
+
+    def setUp(self):
+        response_cache.clear()
+
+    def test_averages_match_sql(self):
+        now = timezone.now()
+        expected = {
+            days: HeroScore.objects.filter(hero_id='h1', date__gte=now - timedelta(days=days)).aggregate(Avg('score'))['score__avg'] or 0
+            for days in (7, 30)
+        }
+        body = self.client.get('/api/hero-performance/h1/').json()
+        self.assertEqual((body['seven_day_avg'], body['thirty_day_avg']), (expected[7], expected[30]))
+        self.assertEqual(body['performance_change'], (expected[7] - expected[30]) / expected[30])
+        self.assertEqual(self.client.get('/api/hero-performance/nope/').status_code, 404)
+
+    async def test_async_view(self):
+        expected = await self.async_client.get('/api/hero-performance/h1/')
+        response = await async_views.hero_performance(AsyncRequestFactory().get('/api/hero-performance/h1/'), hero_id='h1')
+        self.assertEqual(response.content, expected.content)
+
+
+class StarSwingSnapshotTests(TestCase):
+    """/api/predict-star-swings/ serves the materialized snapshots."""
+
+    url = '/api/predict-star-swings/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.older = StarSwingSnapshot.objects.create(poll_ts=datetime(2024, 3, 1, 12, tzinfo=dt_timezone.utc), etag='older', data={'predictions': [1]})
+        cls.newer = StarSwingSnapshot.objects.create(poll_ts=datetime(2024, 3, 2, 12, tzinfo=dt_timezone.utc), etag='newer', data={'predictions': [2]})
+
+    def setUp(self):
+        response_cache.clear()
+
+    def test_latest_snapshot(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.json(), {'predictions': [2]})
+        self.assertEqual(response['ETag'], '"newer"')
+        self.assertEqual(response['Last-Modified'], 'Sat, 02 Mar 2024 12:00:00 GMT')
+
+    def test_conditional_requests(self):
+        for headers in ({'HTTP_IF_NONE_MATCH': '"newer"'}, {'HTTP_IF_MODIFIED_SINCE': 'Sat, 02 Mar 2024 12:00:00 GMT'}):
+            # Answered by the view and then by the response cache
+            for _ in range(2):
+                response = self.client.get(self.url, **headers)
+                self.assertEqual(response.status_code, 304, headers)
+                self.assertEqual(response.content, b'')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"older"').status_code, 200)
+
+    def test_as_of_selects_the_snapshot_at_that_time(self):
+        for as_of, etag in (('2024-03-01T18:00:00Z', '"older"'), ('2024-03-02T12:00:00Z', '"newer"'), ('2024-03-01', '"older"'), ('2100-01-01', '"newer"')):
+            response = self.client.get(self.url, {'as_of': as_of})
+            self.assertEqual(response['ETag'], etag, as_of)
+
+    def test_malformed_as_of(self):
+        for as_of in ('yesterday', '2024-13-01'):
+            self.assertEqual(self.client.get(self.url, {'as_of': as_of}).status_code, 400, as_of)
+
+    def test_no_snapshot_at_as_of(self):
+        response = self.client.get(self.url, {'as_of': '2024-02-01'})
+        self.assertEqual(response.status_code, 404)
+        StarSwingSnapshot.objects.all().delete()
+        response_cache.clear()
+        self.assertEqual(self.client.get(self.url, {'as_of': '2100-01-01'}).status_code, 404)
+
+
+class AsyncViewTests(TestCase):
+    """The async read views return the same bodies as the sync ones."""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_league()
+
+    def setUp(self):
+        response_cache.clear()
+
+    async def test_same_bodies(self):
+        factory = AsyncRequestFactory()
+        for url, view, kwargs in (
+            ('/api/hero-performance/h1/', async_views.hero_performance, {'hero_id': 'h1'}),
+            ('/api/hero-market-data/h1/', async_views.hero_market_data, {'hero_id': 'h1'}),
+            ('/api/hero-tournament-scores/h1/', async_views.hero_tournament_scores, {'hero_id': 'h1'}),
+            ('/api/hero-tournament-scores/nope/', async_views.hero_tournament_scores, {'hero_id': 'nope'}),
+            ('/api/search-heroes-by-handle/?handle=handle1', async_views.search_heroes_by_handle, {}),
+            ('/api/predict-star-swings/', async_views.predict_star_swings, {}),
+        ):
+            expected = await self.async_client.get(url)
+            response_cache.clear()
+            response = await view(factory.get(url), **kwargs)
+            self.assertEqual(response.status_code, expected.status_code, url)
+            self.assertEqual(response.content, expected.content, url)
+
+
+def hero_defaults(index, **fields):
+    return {
+        'handle': f'handle{index}', 'name': f'Hero {index}', 'followers_count': index, 'is_player': False,
+        'stars': 3, 'status': 'HERO', **fields,
+    }
+
+
+class HeroPageWriterTests(TestCase):
+    def market(self, price):
+        return {
+            'floor_prices': [{'rarity': '1', 'price': price}],
+            'highest_bids': [{'rarity': '1', 'price': '100'}],
+            'card_supply': [{'rarity': '1', 'amount': 3, 'burnt': 1, 'total': 4}],
+        }
+
+    def test_bulk_upsert_inserts_then_updates(self):
+        rows = [{'id': f'h{i}', **hero_defaults(i)} for i in range(3)]
+        self.assertEqual(bulk_upsert(Hero, rows, ('id',), ['name'], {'id__in': ['h0', 'h1', 'h2']}), (3, 0))
+        rows = [{'id': 'h1', **hero_defaults(1, name='Renamed')}, {'id': 'h3', **hero_defaults(3)}]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(bulk_upsert(Hero, rows, ('id',), ['name'], {'id__in': ['h1', 'h3']}), (1, 1))
+        # One lookup, one INSERT and one UPDATE, whatever the number of rows
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(Hero.objects.get(id='h1').name, 'Renamed')
+        self.assertEqual(Hero.objects.count(), 4)
+
+    def test_invalid_rows_are_left_out(self):
+        writer = HeroPageWriter()
+        self.assertTrue(writer.add('h1', hero_defaults(1), self.market(0.5), content_hash='a'))
+        self.assertFalse(writer.add('h2', hero_defaults(2, followers_count='many'), content_hash='b'))
+        self.assertFalse(writer.add('h3', hero_defaults(3), {**self.market(0.5), 'card_supply': [{'rarity': '1', 'amount': 'x', 'burnt': 0, 'total': 1}]}))
+        self.assertEqual(writer.errors['h2'], {'followers_count': '“many” value must be an integer.'})
+        self.assertEqual(list(writer.errors['h3']), ['card_supply[1].amount'])
+
+        self.assertEqual(writer.flush(), 1)
+        self.assertEqual(list(Hero.objects.values_list('id', flat=True)), ['h1'])
+        self.assertEqual(Hero.objects.get(id='h1').market_snapshot['floor_prices'], [{'rarity': '1', 'price': 0.5}])
+        self.assertEqual(load_watermarks(HERO_SOURCE, ['h1', 'h2']), {'h1': 'a'})
+        self.assertEqual(writer.errors, {})
+
+        # Market rows are upserted on (hero, rarity)
+        writer.add('h1', {'name': 'Hero 1'}, self.market(0.75), content_hash='c')
+        writer.flush()
+        self.assertEqual(list(FloorPrice.objects.values_list('hero_id', 'price')), [('h1', 0.75)])
+        self.assertEqual(Hero.objects.get(id='h1').followers_count, 1)
+
+    def test_failed_page_rolls_back_its_hashes(self):
+        writer = HeroPageWriter()
+        writer.add('h1', hero_defaults(1), self.market(0.5), content_hash='a')
+        with mock.patch('api.ingest.build_market_snapshots', side_effect=RuntimeError('disk full')):
+            with self.assertRaises(RuntimeError):
+                writer.flush()
+        # Nothing of the page was kept, so the next cycle writes it again
+        self.assertFalse(Hero.objects.exists())
+        self.assertFalse(FloorPrice.objects.exists())
+        self.assertFalse(SyncWatermark.objects.filter(source=HERO_SOURCE).exists())
+
+    def test_list_defaults_clear_the_detail_watermark(self):
+        save_watermarks(HERO_DETAIL_SOURCE, {'h1': 'detail', 'h2': 'detail'})
+        writer = HeroPageWriter()
+        # h1 left HERO status: the list writes empty detail fields. h2 is still a HERO.
+        writer.add('h1', hero_defaults(1, status='PENDING_HERO', current_rank=None), {}, content_hash='a')
+        writer.add('h2', hero_defaults(2), content_hash='b')
+        writer.flush()
+        self.assertEqual(load_watermarks(HERO_DETAIL_SOURCE, ['h1', 'h2']), {'h2': 'detail'})
+
+        # The detail writer keeps its own hashes
+        writer = HeroPageWriter(HERO_DETAIL_SOURCE)
+        writer.add('h1', {'current_rank': 1}, self.market(0.5), content_hash='detail')
+        writer.flush()
+        self.assertEqual(load_watermarks(HERO_DETAIL_SOURCE, ['h1']), {'h1': 'detail'})
+
+
+class HeroScoreIngestTests(TestCase):
+    def setUp(self):
+        for i in range(2):
+            Hero.objects.create(id=f'h{i}', **hero_defaults(i))
+
+    def payload(self, hero_id, scores, **summary):
+        return {
+            'hero_id': hero_id, 'name': f'Hero {hero_id[1:]}',
+            'dates': [f'2024-03-{day:02d}T00:00:00Z' for day in range(1, len(scores) + 1)], 'data': scores,
+            'current_score': scores[-1], 'median_7_days': 0, 'median_14_days': 0, 'change_1_day': 0, 'change_7_days': 0,
+            **summary,
+        }
+
+    def test_only_the_diff_is_written(self):
+        stats = ingest_hero_scores([self.payload('h0', [1, 2, 3]), self.payload('h1', [4, 5])])
+        self.assertEqual(stats, {'heroes': 2, 'heroes_updated': 2, 'scores_created': 5, 'scores_updated': 0})
+
+        # A revised score, a new day and a hero not in the league
+        stats = ingest_hero_scores([self.payload('h0', [1, 2.5, 3, 6], current_score=3), self.payload('h1', [4, 5]), self.payload('h9', [1])])
+        self.assertEqual(stats, {'heroes': 2, 'heroes_updated': 0, 'scores_created': 1, 'scores_updated': 1})
+        self.assertEqual(list(HeroScore.objects.filter(hero_id='h0').order_by('date').values_list('score', flat=True)), [1, 2.5, 3, 6])
+
+        stats = ingest_hero_scores([self.payload('h0', [1, 2.5, 3, 6], current_score=3), self.payload('h1', [4, 5])])
+        self.assertEqual(stats, {'heroes': 2, 'heroes_updated': 0, 'scores_created': 0, 'scores_updated': 0})
+
+    def test_summary_change_updates_the_hero(self):
+        ingest_hero_scores([self.payload('h0', [1, 2]), self.payload('h1', [3])])
+        stamped = Hero.objects.get(id='h1').updated_at
+        stats = ingest_hero_scores([self.payload('h0', [1, 2], median_7_days=1.5), self.payload('h1', [3])])
+        self.assertEqual(stats['heroes_updated'], 1)
+        self.assertEqual(stats['scores_updated'], 0)
+        self.assertEqual(Hero.objects.get(id='h0').median_7_days, 1.5)
+        self.assertEqual(Hero.objects.get(id='h1').updated_at, stamped)
+
+    def test_matrix_refresh_sees_revisions_and_deletions(self):
+        ingest_hero_scores([self.payload('h0', list(range(1, 11))), self.payload('h1', [1, 2])])
+        matrix = HeroScoreMatrix.from_db()
+        # Written by another process: a revision of a day long past and a removed hero
+        ingest_hero_scores([self.payload('h0', [50, *range(2, 11)])])
+        Hero.objects.filter(id='h1').delete()
+        with CaptureQueriesContext(connection) as queries:
+            matrix.refresh()
+        self.assertEqual(matrix.values[matrix.rows_for(['h0'])[0]].tolist(), [50, *range(2, 11)])
+        self.assertEqual(matrix.hero_ids, ['h0'])
+        # Top-up, count, then the full reload the missing rows forced
+        self.assertEqual(len(queries), 3)
+
+        with CaptureQueriesContext(connection) as queries:
+            matrix.refresh()
+        self.assertEqual(len(queries), 2)
+
+    def test_changes_reach_the_score_matrix(self):
+        ingest_hero_scores([self.payload('h0', [1, 2])])
+        matrix = HeroScoreMatrix.from_db()
+        # The process's matrix takes the written rows without a reload
+        with mock.patch('api.analytics._score_matrix', matrix), mock.patch.object(matrix, 'refresh') as refresh:
+            ingest_hero_scores([self.payload('h0', [1, 7, 8]), self.payload('h1', [4])])
+        refresh.assert_not_called()
+        np.testing.assert_array_equal(matrix.values[matrix.rows_for(['h0', 'h1'])], [[1, 7, 8], [4, np.nan, np.nan]])
+
+
+class TournamentIngestTests(TestCase):
+    def setUp(self):
+        for i in range(2):
+            Hero.objects.create(id=f'h{i}', **hero_defaults(i))
+
+    def scores(self, hero_id):
+        return list(TournamentScore.objects.filter(hero_id=hero_id).order_by('index').values_list('score', flat=True))
+
+    def test_unchanged_arrays_are_skipped(self):
+        items = [{'hero_id': 'h0', 'data': [1, 2, 3]}, {'hero_id': 'h1', 'data': [4]}]
+        self.assertEqual(ingest_tournament_scores(items)['heroes_changed'], 2)
+        with CaptureQueriesContext(connection) as queries:
+            stats = ingest_tournament_scores(items)
+        self.assertEqual(stats['heroes_changed'], 0)
+        self.assertFalse([query for query in queries if 'api_tournamentscore' in query['sql'] and not query['sql'].startswith('SELECT')])
+
+        stats = ingest_tournament_scores([{'hero_id': 'h0', 'data': [1, 5, 3]}, {'hero_id': 'h1', 'data': [4]}])
+        self.assertEqual((stats['heroes_changed'], stats['scores_updated']), (1, 1))
+        self.assertEqual(self.scores('h0'), [1, 5, 3])
+
+    def test_shorter_array_deletes_the_tail(self):
+        ingest_tournament_scores([{'hero_id': 'h0', 'data': [1, 2, 3, 4]}, {'hero_id': 'h1', 'data': [5, 6]}])
+        stats = ingest_tournament_scores([{'hero_id': 'h0', 'data': [1, 9]}, {'hero_id': 'h1', 'data': [5, 6]}])
+        self.assertEqual(stats, {'heroes': 2, 'heroes_changed': 1, 'scores_created': 0, 'scores_updated': 1, 'scores_deleted': 2})
+        self.assertEqual(self.scores('h0'), [1, 9])
+        self.assertEqual(self.scores('h1'), [5, 6])
+        self.assertEqual(set(load_watermarks(TOURNAMENT_SOURCE, ['h0', 'h1'])), {'h0', 'h1'})
+
+
+class CardIngestTests(TestCase):
+    def card(self, index, **fields):
+        return {
+            'id': f'c{index}', 'owner': '0xabc', 'hero_id': 'h1', 'rarity': 1, 'hero_rarity_index': str(index),
+            'token_id': str(index), 'season': 1, 'created_at': '2024-01-01T00:00:00Z',
+            'updated_at': f'2024-02-01T00:00:{index:02d}Z', 'tx_hash': '0x0', 'blocknumber': index, **fields,
+        }
+
+    def test_upserts_and_checkpoints(self):
+        stats = ingest_cards([self.card(1), self.card(2), self.card(3, created_at=None)])
+        self.assertEqual(stats['cards'], 2)
+        self.assertEqual(list(stats['errors']), ['c3'])
+        self.assertEqual(get_source_watermark(CARD_SOURCE).second, 2)
+
+        with CaptureQueriesContext(connection) as queries:
+            ingest_cards([self.card(2, owner='0xdef', updated_at='2024-02-01T00:01:00Z')])
+        # One INSERT ... ON CONFLICT per page, no per-card lookups
+        self.assertEqual(len([query for query in queries if 'api_card' in query['sql']]), 1)
+        self.assertEqual(Card.objects.get(id='c2').owner, '0xdef')
+        self.assertEqual(Card.objects.count(), 2)
+        self.assertEqual(get_source_watermark(CARD_SOURCE).minute, 1)
+
+
+class FakePortalResponse:
+    def __init__(self, data):
+        self.data = data
+        self.status_code = 200
+        self.headers = {}
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class FakeCardPortal:
+    """The portal's /card listing: Feathers filters, sorting and paging over `cards`.
+
+    `on_request(number)` runs before each request is answered, to change cards mid-crawl.
+    """
+
+    def __init__(self, cards, on_request=None):
+        self.cards = cards
+        self.on_request = on_request
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def get(self, path, params=None, endpoint=None, conditional=False):
+        with self.lock:
+            self.requests += 1
+            if self.on_request:
+                self.on_request(self.requests)
+            key = lambda card: (parse_datetime(card['updated_at']), card['id'])
+            rows = sorted(self.cards.values(), key=key)
+            if '$or[1][id][$gt]' in params:
+                cursor = (parse_datetime(params['$or[1][updated_at]']), params['$or[1][id][$gt]'])
+                rows = [card for card in rows if key(card) > cursor]
+            skip, limit = params['$skip'], params['$limit']
+            return FakePortalResponse({'total': len(rows), 'data': [dict(card) for card in rows[skip:skip + limit]]})
+
+    def get_json(self, path, params=None):
+        return self.get(path, params).json()
+
+
+class FakeHeroListPortal:
+    """The portal's /hero listing; records the params of every request."""
+
+    def __init__(self, heroes):
+        self.heroes = heroes
+        self.requests = []
+
+    def get(self, path, params=None, endpoint=None, conditional=False):
+        self.requests.append(dict(params))
+        skip = params['$skip']
+        return FakePortalResponse({'total': len(self.heroes), 'data': [dict(hero) for hero in self.heroes[skip:skip + 10]]})
+
+
+class PollHeroListTests(TestCase):
+    def hero(self, index, **fields):
+        return {
+            'id': f'h{index:02d}', 'handle': f'handle{index}', 'name': f'Hero {index}', 'status': 'HERO',
+            'favourites_count': '1,000', 'followers_count': str(index), 'stars': 3,
+            'updated_at': f'2024-02-01T00:{index:02d}:00Z', **fields,
+        }
+
+    def poll_hero_list(self, portal, **kwargs):
+        with mock.patch.object(poll_data, 'portal', portal):
+            return poll_data.Command(stdout=io.StringIO()).poll_hero_list(**kwargs)
+
+    def test_unchanged_heroes_are_skipped(self):
+        heroes = [self.hero(i) for i in range(25)]
+        self.assertEqual(self.poll_hero_list(FakeHeroListPortal(heroes)), '25 heroes, 0 unchanged')
+        self.assertEqual(Hero.objects.get(id='h03').favourites_count, 1000)
+
+        heroes[3] = self.hero(3, name='Renamed')
+        with mock.patch('api.ingest.HeroPageWriter.add', autospec=True, side_effect=HeroPageWriter.add) as add:
+            self.assertEqual(self.poll_hero_list(FakeHeroListPortal(heroes)), '25 heroes, 24 unchanged')
+        self.assertEqual([call.args[1] for call in add.call_args_list], ['h03'])
+        self.assertEqual(Hero.objects.get(id='h03').name, 'Renamed')
+
+        # A full refresh writes every hero again
+        self.assertEqual(self.poll_hero_list(FakeHeroListPortal(heroes), incremental=False), '25 heroes, 0 unchanged')
+
+    def test_changed_since_sends_the_watermark(self):
+        portal = FakeHeroListPortal([self.hero(i) for i in range(3)])
+        self.poll_hero_list(portal, changed_since=True)
+        self.assertNotIn('updated_at[$gt]', portal.requests[0])
+        self.assertEqual(get_source_watermark(HERO_SOURCE).minute, 2)
+
+        portal = FakeHeroListPortal([])
+        self.poll_hero_list(portal, changed_since=True)
+        self.assertEqual(parse_datetime(portal.requests[0]['updated_at[$gt]']), datetime(2024, 2, 1, 0, 2, tzinfo=dt_timezone.utc))
+
+        # Without --changed-since every hero is listed
+        portal = FakeHeroListPortal([])
+        self.poll_hero_list(portal)
+        self.assertNotIn('updated_at[$gt]', portal.requests[0])
+
+
+class PollPlayersTests(TestCase):
+    def test_players_stage_fetches_before_writing(self):
+        portal = mock.Mock()
+        portal.pop_stats.return_value = {}
+        portal.get_json.return_value = [{'id': 'p1', 'name': 'Player 1'}]
+        command = poll_data.Command(stdout=io.StringIO())
+        sources = command.build_sources(None, full_refresh=False, changed_since=False, detail_rps=1, detail_concurrency=1)
+        stage = next(source.stage for source in sources if source.stage.name == 'players')
+        with mock.patch.object(poll_data, 'portal', portal):
+            players = stage.fetch()
+            portal.get_json.assert_called_once_with('/players')
+            # The write runs on the DB writer thread and makes no HTTP call
+            portal.reset_mock()
+            stage.write(players)
+        portal.get_json.assert_not_called()
+        self.assertEqual(Player.objects.get(id='p1').name, 'Player 1')
+
+
+class PollCardsTests(TestCase):
+    def card(self, index, updated_at=None, **fields):
+        return {
+            'id': f'c{index:02d}', 'owner': '0xabc', 'hero_id': 'h1', 'rarity': 1, 'hero_rarity_index': str(index),
+            'token_id': str(index), 'season': 1, 'created_at': '2024-01-01T00:00:00Z',
+            'updated_at': updated_at or f'2024-02-01T00:{index:02d}:00Z', 'tx_hash': '0x0', 'blocknumber': index, **fields,
+        }
+
+    def poll_cards(self, portal, max_pages=100):
+        with mock.patch.object(poll_data, 'portal', portal), mock.patch.object(poll_data, 'CARD_PAGE_SIZE', 5), \
+                mock.patch.object(poll_data, 'CARD_PAGES_PER_BATCH', 4):
+            out = io.StringIO()
+            poll_data.Command(stdout=out).poll_cards(rps=1000, concurrency=1, max_pages=max_pages)
+            return out.getvalue()
+
+    def test_card_updated_mid_crawl(self):
+        cards = {card['id']: card for card in (self.card(i) for i in range(30))}
+
+        def update(number):
+            # After the first page of the batch is read, a card on it changes and moves to the end
+            if number == 2:
+                cards['c02'] = self.card(2, updated_at='2024-03-01T00:00:00Z', owner='0xdef')
+
+        out = self.poll_cards(FakeCardPortal(cards, update))
+        self.assertIn('re-anchoring', out)
+        self.assertEqual(Card.objects.count(), 30)
+        self.assertEqual(Card.objects.get(id='c02').owner, '0xdef')
+        updated_at, card_id = get_source_cursor(CARD_SOURCE)
+        self.assertEqual((updated_at.month, card_id), (3, 'c02'))
+
+    def test_cards_sharing_one_updated_at(self):
+        portal = FakeCardPortal({card['id']: card for card in (self.card(i, updated_at='2024-02-01T00:00:00Z') for i in range(25))})
+        stored = []
+        for _ in range(3):
+            # Two overlapping pages of 5 per run
+            self.poll_cards(portal, max_pages=2)
+            stored.append(Card.objects.count())
+        self.assertEqual(stored, [9, 18, 25])
+        self.assertEqual(get_source_cursor(CARD_SOURCE)[1], 'c24')
+
+
+class PredictionTests(SimpleTestCase):
+    def test_star_buckets(self):
+        percentiles = np.array([0.5, 15, 15.01, 32, 50, 67, 82, 82.5, 100])
+        self.assertEqual(predict_stars(percentiles).tolist(), [7, 7, 6, 6, 5, 4, 3, 2, 2])
+
+    def test_top_k_matches_stable_sort(self):
+        rng = np.random.default_rng(1)
+        for size in (0, 5, 20, 300):
+            magnitude = rng.integers(1, 4, size)
+            performance = rng.choice([0.0, -0.5, 0.25, 1.0], size)
+            expected = sorted(range(size), key=lambda i: (magnitude[i], -performance[i]), reverse=True)[:20]
+            self.assertEqual(top_k(magnitude, performance, 20).tolist(), expected)
+
+
+class PerformanceChangeTests(TestCase):
+    """The matrix reproduces the per-hero SQL averages exactly, not to a tolerance."""
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = np.random.default_rng(7)
+        for i in range(12):
+            hero = Hero.objects.create(id=f'h{i}', **hero_defaults(i))
+            days = range(40, 60) if i == 11 else rng.choice(40, size=int(rng.integers(1, 40)), replace=False)
+            HeroScore.objects.bulk_create([
+                HeroScore(hero=hero, date=date.today() - timedelta(days=int(day)), score=round(float(rng.uniform(0, 250)), 3))
+                for day in days
+            ])
+        Hero.objects.create(id='unscored', **hero_defaults(12))
+
+    def baseline(self, hero_id, days, now):
+        return HeroScore.objects.filter(hero=hero_id, date__gte=now - timedelta(days=days)).aggregate(Avg('score'))['score__avg'] or 0
+
+    def test_matches_per_hero_averages(self):
+        now = timezone.now()
+        hero_ids = list(Hero.objects.order_by('id').values_list('id', flat=True))
+        matrix = HeroScoreMatrix.from_db()
+        changes, defined = performance_changes(matrix, hero_ids, now=now)
+        for hero_id, change, is_defined in zip(hero_ids, changes.tolist(), defined.tolist()):
+            short, long = self.baseline(hero_id, 7, now), self.baseline(hero_id, 30, now)
+            self.assertEqual(change if is_defined else 0, (short - long) / long if long else 0, hero_id)
+        self.assertEqual(defined.tolist().count(False), 2)
+
+        expected = window_averages(hero_ids, now=now)
+        averages = matrix.window_averages(hero_ids, now=now)
+        self.assertEqual({hero_id: averages[hero_id] for hero_id in expected}, expected)
+        self.assertEqual(averages['h11'], {7: 0, 30: 0})
+
+
+class BacktestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_league()
+        heroes = list(Hero.objects.filter(status='HERO').order_by('current_rank'))
+        predicted = predict_stars(np.array([hero.current_rank / len(heroes) * 100 for hero in heroes]))
+        today = timezone.now().replace(hour=12, minute=0, second=0, microsecond=0)
+        for day in range(10):
+            if day == 7:
+                # Every predicted swing has happened a week after the first point
+                for hero, stars in zip(heroes, predicted):
+                    Hero.objects.filter(id=hero.id).update(stars=int(stars))
+            record_history(today - timedelta(days=9 - day))
+        cls.movers = sum(1 for hero, stars in zip(heroes, predicted) if stars != hero.stars)
+
+    def backtest(self, *args, **options):
+        out = io.StringIO()
+        call_command('backtest_star_swings', *args, stdout=out, **options)
+        return out.getvalue()
+
+    def test_calls_scored_against_later_stars(self):
+        output = self.backtest(workers=1, limit=100)
+        self.assertIn('3 points', output)
+        self.assertIn('potential_gainers: precision 100.0%', output)
+        self.assertIn('potential_losers: precision 100.0%', output)
+        self.assertEqual(output.count('recall 100.0%'), 2)
+        self.assertEqual(len(re.findall(r'\d+/\d+ movers', output)), 2)
+        self.assertEqual(sum(int(hits) for hits in re.findall(r'\((\d+)/\d+ movers', output)), 3 * self.movers)
+
+        # A process pool gives the same calls
+        pooled = self.backtest(workers=2, limit=100)
+        summary = lambda text: [line for line in text.splitlines() if 'precision' in line]
+        self.assertEqual(summary(pooled), summary(output))
+        # Other thresholds move the predicted stars away from what happened
+        self.assertNotIn('precision 100.0%', self.backtest('--thresholds=50', '--stars=7,2', workers=1))
+
+
+class FakeUpstream:
+    """Stands in for requests.Session.get: answers with `body` and an ETag, or 304 when it matches."""
+
+    def __init__(self, body):
+        self.body = body
+        self.sent = []
+
+    def __call__(self, url, params=None, headers=None, timeout=None):
+        self.sent.append(headers or {})
+        response = requests.Response()
+        response.url = url
+        etag = f'"{self.body.hex()}"'
+        if (headers or {}).get('If-None-Match') == etag:
+            response.status_code = 304
+            response._content = b''
+        else:
+            response.status_code = 200
+            response._content = self.body
+            response.headers['ETag'] = etag
+        return response
+
+
+class StubPortal(BaseHTTPRequestHandler):
+    """/hero/<id> of a local portal stand-in. `throttled` maps an id to the Retry-After values of its next 429s."""
+
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+    started = []
+    throttled = {}
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        hero_id = self.path.rsplit('/', 1)[-1]
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+            cls.started.append((time.monotonic(), hero_id))
+            retry_after = cls.throttled.get(hero_id, []).pop(0) if cls.throttled.get(hero_id) else None
+        try:
+            if retry_after is not None:
+                self.send_response(429)
+                self.send_header('Retry-After', retry_after)
+                self.end_headers()
+                return
+            time.sleep(0.02)
+            body = json.dumps({'id': hero_id}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+
+class DetailFetcherTests(SimpleTestCase):
+    def setUp(self):
+        StubPortal.in_flight = StubPortal.max_in_flight = 0
+        StubPortal.started = []
+        StubPortal.throttled = {}
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubPortal)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.client = UpstreamClient(f'http://127.0.0.1:{server.server_port}', retries=0)
+
+    def fetch_all(self, fetcher, keys):
+        return {key: (data, error) for key, data, error in fetcher.fetch_all(keys)}
+
+    def test_rate_and_in_flight_limits(self):
+        fetcher = DetailFetcher(self.client, '/hero/{}', rate=40, max_in_flight=3)
+        fetcher.bucket = TokenBucket(40, burst=1)
+        started = time.monotonic()
+        results = self.fetch_all(fetcher, [f'h{i}' for i in range(20)])
+        self.assertEqual({key: data['id'] for key, (data, _) in results.items()}, {f'h{i}': f'h{i}' for i in range(20)})
+        # 19 requests after the first at 40 per second
+        self.assertGreaterEqual(time.monotonic() - started, 19 / 40 - 0.02)
+        self.assertLessEqual(StubPortal.max_in_flight, 3)
+
+    def test_retry_after(self):
+        retry_at = datetime.now(dt_timezone.utc) + timedelta(seconds=1)
+        self.assertAlmostEqual(parse_retry_after(format_datetime(retry_at, usegmt=True)), 1, delta=1)
+        self.assertEqual(parse_retry_after('2.5'), 2.5)
+        self.assertEqual(parse_retry_after('soon', default=3), 3)
+
+        StubPortal.throttled = {
+            'seconds': ['0.3'],
+            'date': [format_datetime(datetime.now(dt_timezone.utc) + timedelta(seconds=1), usegmt=True)],
+            'gone': ['0', '0', '0'],
+        }
+        fetcher = DetailFetcher(self.client, '/hero/{}', rate=100, max_in_flight=3, max_retries=2)
+        results = self.fetch_all(fetcher, ['seconds', 'date', 'gone'])
+        self.assertEqual(results['seconds'], ({'id': 'seconds'}, None))
+        self.assertEqual(results['date'], ({'id': 'date'}, None))
+        # Three 429s in a row exhaust the two retries; the error comes back instead of being raised
+        data, error = results['gone']
+        self.assertIsNone(data)
+        self.assertEqual(error.response.status_code, 429)
+
+        # A 429 pauses the whole pool, not just the worker that got it
+        retried = [at for at, key in StubPortal.started if key == 'seconds'][1]
+        first = StubPortal.started[0][0]
+        self.assertGreaterEqual(retried - first, 0.3)
+
+
+class ResponseCacheTests(SimpleTestCase):
+    def test_conditional_get(self):
+        with tempfile.TemporaryDirectory() as directory:
+            client = UpstreamClient('https://portal.test', cache=ResponseCache(directory))
+            client.session.get = upstream = FakeUpstream(b'{"stars": 3}')
+            first = client.get('/hero/h1', endpoint='/hero/{}', conditional=True)
+            self.assertFalse(first.from_cache)
+            self.assertNotIn('If-None-Match', upstream.sent[0])
+
+            # A second client on the same directory revalidates and gets the body from disk
+            client = UpstreamClient('https://portal.test', cache=ResponseCache(directory))
+            client.session.get = upstream
+            second = client.get('/hero/h1', endpoint='/hero/{}', conditional=True)
+            self.assertEqual(upstream.sent[1]['If-None-Match'], first.headers['ETag'])
+            self.assertTrue(second.from_cache)
+            self.assertEqual(second.content_hash, first.content_hash)
+            self.assertEqual(second.json(), {'stars': 3})
+            self.assertEqual(client.pop_stats()['/hero/{}']['not_modified'], 1)
+
+            upstream.body = b'{"stars": 4}'
+            third = client.get('/hero/h1', endpoint='/hero/{}', conditional=True)
+            self.assertFalse(third.from_cache)
+            self.assertNotEqual(third.content_hash, first.content_hash)
+            self.assertEqual(third.json(), {'stars': 4})
+
+
+class PipelineTests(SimpleTestCase):
+    def setUp(self):
+        self.db_writer = DBWriter()
+        self.addCleanup(self.db_writer.close)
+
+    def test_writes_follow_dependencies(self):
+        writes = []
+
+        def slow_fetch():
+            time.sleep(0.05)
+            return 'a'
+
+        results = Pipeline([
+            Stage('b', fetch=lambda: 'b', write=writes.append, depends_on=['a']),
+            Stage('a', fetch=slow_fetch, write=writes.append),
+            Stage('c', fetch=lambda: 'c', write=writes.append),
+        ], self.db_writer).run()
+        self.assertLess(writes.index('a'), writes.index('b'))
+        self.assertTrue(all(result.status == 'ok' for result in results.values()))
+        self.assertGreater(results['a'].fetch_seconds, 0.04)
+
+    def test_failed_dependency(self):
+        def fail():
+            raise ValueError('upstream down')
+
+        results = Pipeline([
+            Stage('a', fetch=fail),
+            Stage('b', write=lambda payload: None, depends_on=['a']),
+            Stage('c', write=lambda payload: None, depends_on=['a'], skip_on_failure=False),
+        ], self.db_writer).run()
+        self.assertEqual([results[name].status for name in 'abc'], ['failed', 'skipped', 'ok'])
+
+    def test_cycle(self):
+        with self.assertRaises(ValueError):
+            Pipeline([Stage('a', depends_on=['b']), Stage('b', depends_on=['a'])], self.db_writer)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class SchedulerTests(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def scheduler(self, *sources):
+        # No jitter, so run times are exact
+        return Scheduler(sources, clock=self.clock, rng=lambda low, high: 0.0, log=lambda message: None)
+
+    def run_tick(self, scheduler):
+        scheduler.tick()
+        for state in scheduler.states.values():
+            if state.future is not None:
+                wait([state.future])
+        scheduler.tick()
+
+    def test_sources_keep_their_own_interval(self):
+        runs = []
+        scheduler = self.scheduler(
+            Source(Stage('fast', fetch=lambda: runs.append('fast')), interval=10),
+            Source(Stage('slow', fetch=lambda: runs.append('slow')), interval=60),
+            Source(Stage('off', fetch=lambda: runs.append('off')), interval=0),
+        )
+        for now in (0, 10, 20, 60):
+            self.clock.now = now
+            self.run_tick(scheduler)
+        scheduler.executor.shutdown()
+        self.assertEqual(runs.count('fast'), 4)
+        self.assertEqual(runs.count('slow'), 2)
+        self.assertNotIn('off', runs)
+        self.assertEqual(PollSourceState.objects.get(source='off').status, 'disabled')
+
+    def test_failures_back_off_exponentially(self):
+        def fail():
+            raise ValueError('upstream down')
+
+        scheduler = self.scheduler(Source(Stage('flaky', fetch=fail), interval=60, backoff_base=10, backoff_max=25))
+        state = scheduler.states['flaky']
+        delays = []
+        for _ in range(3):
+            self.clock.now = state.next_run
+            self.run_tick(scheduler)
+            delays.append(state.next_run - self.clock.now)
+        scheduler.executor.shutdown()
+        self.assertEqual(delays, [10, 20, 25])
+        saved = PollSourceState.objects.get(source='flaky')
+        self.assertEqual((saved.status, saved.failures, saved.consecutive_failures), ('failed', 3, 3))
+        self.assertEqual(saved.last_error, 'ValueError: upstream down')
+
+    def test_dependent_source_runs_after_success(self):
+        runs = []
+
+        def fail():
+            raise ValueError('upstream down')
+
+        scheduler = self.scheduler(
+            Source(Stage('data', fetch=lambda: runs.append('data')), interval=10),
+            Source(Stage('broken', fetch=fail), interval=10),
+            Source(Stage('report', write=lambda _: runs.append('report'), depends_on=['data', 'broken']), interval=30),
+        )
+        for now in (0, 10, 20):
+            self.clock.now = now
+            self.run_tick(scheduler)
+        scheduler.executor.shutdown()
+        # Triggered by every successful data run, but at most once per 30s interval
+        self.assertEqual(runs, ['data', 'report', 'data', 'data'])
+
+    def test_run_past_deadline_fails(self):
+        scheduler = self.scheduler(Source(Stage('slow', fetch=lambda: setattr(self.clock, 'now', 50)), interval=60, deadline=30, backoff_base=5))
+        self.run_tick(scheduler)
+        scheduler.executor.shutdown()
+        state = scheduler.states['slow']
+        self.assertEqual(state.status, 'failed')
+        self.assertEqual(state.next_run, 55)
+
+    def test_writes_go_through_the_db_writer(self):
+        db_writer = DBWriter()
+        self.addCleanup(db_writer.close)
+        writers = []
+        scheduler = Scheduler(
+            [Source(Stage('data', fetch=lambda: 'payload', write=lambda payload: writers.append((payload, threading.current_thread().name))), interval=10)],
+            db_writer=db_writer, clock=self.clock, log=lambda message: None,
+        )
+        self.run_tick(scheduler)
+        scheduler.executor.shutdown()
+        self.assertEqual(writers, [('payload', 'db-writer')])
+
+    def test_run_once_skips_after_failed_dependency(self):
+        def fail():
+            raise ValueError('upstream down')
+
+        scheduler = self.scheduler(
+            Source(Stage('broken', fetch=fail), interval=10),
+            Source(Stage('report', write=lambda _: None, depends_on=['broken']), interval=10),
+            Source(Stage('summary', write=lambda _: None, depends_on=['broken'], skip_on_failure=False), interval=10),
+        )
+        self.assertEqual(scheduler.run_once(tick=0.01), {'broken': 'failed', 'report': 'skipped', 'summary': 'ok'})
+
+    def test_unknown_dependency(self):
+        with self.assertRaises(ValueError):
+            self.scheduler(Source(Stage('report', depends_on=['missing']), interval=10))
+
+    def test_poll_status(self):
+        scheduler = self.scheduler(Source(Stage('data', fetch=lambda: 'done'), interval=10))
+        self.run_tick(scheduler)
+        scheduler.executor.shutdown()
+        out = io.StringIO()
+        call_command('poll_status', stdout=out)
+        self.assertRegex(out.getvalue(), r'data\s+ok\s+10s\s+1\s+0\s+0')
+        sources = self.client.get('/api/poll-status/').json()['sources']
+        self.assertEqual([(source['source'], source['status'], source['runs']) for source in sources], [('data', 'ok', 1)])
+
+
+def make_jwt(exp):
+    payload = base64.urlsafe_b64encode(json.dumps({'exp': exp}).encode()).rstrip(b'=').decode()
+    return f'header.{payload}.signature'
+
+
+class TokenManagerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.clock.now = 1000.0
+        self.issued = []
+
+    def refresh(self, token):
+        self.issued.append(make_jwt(self.clock.now + 3600))
+        return self.issued[-1]
+
+    def test_refreshes_ahead_of_expiry_and_persists(self):
+        self.assertEqual(jwt_expiry(make_jwt(1234)), 1234.0)
+        self.assertIsNone(jwt_expiry('not-a-jwt'))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'token')
+            tokens = TokenManager(self.refresh, token=make_jwt(2000), path=path, margin=600, clock=self.clock)
+            self.assertEqual(tokens.refresh_if_expiring(), 1000)
+            self.assertEqual(self.issued, [])
+
+            self.clock.now = 1500.0
+            self.assertEqual(tokens.refresh_if_expiring(), 3600)
+            self.assertEqual(tokens.get(), self.issued[0])
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+
+            # A restart picks the saved token over the older configured one
+            restarted = TokenManager(self.refresh, token=make_jwt(2000), path=path, clock=self.clock)
+            self.assertEqual(restarted.get(), self.issued[0])
+            # A rejected token that was already replaced is not refreshed again
+            self.assertEqual(restarted.refresh_if_current(make_jwt(2000)), self.issued[0])
+            self.assertEqual(len(self.issued), 1)
+
+    def test_failed_refresh_waits_before_retrying(self):
+        attempts = []
+        tokens = TokenManager(lambda token: attempts.append(token), token=make_jwt(900), retry_after=300, clock=self.clock)
+        with self.assertRaises(RuntimeError):
+            tokens.get()
+        with self.assertRaises(RuntimeError):
+            tokens.get()
+        self.assertEqual(len(attempts), 1)
+        self.clock.now += 300
+        with self.assertRaises(RuntimeError):
+            tokens.get()
+        self.assertEqual(len(attempts), 2)
@@ -0,0 +1,95 @@
+# api/tokens.py
+import base64
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+
+def jwt_expiry(token):
+    """The `exp` claim of a JWT as a Unix timestamp, or None if it has none. The signature is not checked."""
+    try:
+        payload = token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return float(claims['exp'])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenManager:
+    """Bearer token of an upstream API, renewed ahead of its expiry and kept on disk across restarts.
+
+    `refresh` is called with the current token and returns a new one, or None when it
+    could not get one. Tokens are renewed `margin` seconds before the `exp` of their
+    JWT, or when a caller reports them rejected. Only one refresh runs at a time, and
+    after a failed one the next waits `retry_after` seconds, since each may launch a browser.
+    """
+
+    def __init__(self, refresh, token=None, path=None, margin=600, retry_after=300, clock=time.time):
+        self.refresh = refresh
+        self.path = Path(path) if path else None
+        self.margin = margin
+        self.retry_after = retry_after
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.failed_at = None
+        # A token saved by an earlier run wins over the configured one if it lasts longer
+        self.token = self.longest_lived(token, self.load())
+
+    @staticmethod
+    def longest_lived(*tokens):
+        return max((token for token in tokens if token), key=lambda token: jwt_expiry(token) or 0, default=None)
+
+    def load(self):
+        if self.path is None:
+            return None
+        try:
+            return json.loads(self.path.read_text())['token']
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self):
+        if self.path is None:
+            return
+        temp = self.path.with_name(f'{self.path.name}.{os.getpid()}.tmp')
+        # Readable by the owner only, like any other credential
+        with os.fdopen(os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as file:
+            json.dump({'token': self.token, 'expires_at': jwt_expiry(self.token)}, file)
+        os.replace(temp, self.path)
+
+    def expires_in(self):
+        """Seconds until the current token expires, or None if that is unknown."""
+        expiry = jwt_expiry(self.token) if self.token else None
+        return None if expiry is None else expiry - self.clock()
+
+    def get(self):
+        """The current token, renewed first if it is missing or already expired."""
+        token = self.token
+        expires_in = self.expires_in()
+        if token is None or (expires_in is not None and expires_in <= 0):
+            return self.refresh_if_current(token)
+        return token
+
+    def refresh_if_current(self, token):
+        """Replace `token` unless another caller already did, and return the token to use."""
+        with self.lock:
+            if self.token != token:
+                return self.token
+            if self.failed_at is not None and self.clock() - self.failed_at < self.retry_after:
+                raise RuntimeError(f'Token refresh failed less than {self.retry_after:.0f}s ago')
+            new_token = self.refresh(token)
+            if not new_token or new_token == token:
+                self.failed_at = self.clock()
+                raise RuntimeError('Token refresh did not return a new token')
+            self.failed_at = None
+            self.token = new_token
+            self.save()
+            return self.token
+
+    def refresh_if_expiring(self):
+        """Renew the token if it expires within `margin`. Returns expires_in() afterwards."""
+        expires_in = self.expires_in()
+        if self.token is None or (expires_in is not None and expires_in <= self.margin):
+            self.refresh_if_current(self.token)
+        return self.expires_in()
@@ -0,0 +1,215 @@
+# api/upstream.py
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.not_modified = 0
+        self.bytes = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'not_modified': self.not_modified,
+            'bytes': self.bytes,
+            'avg_ms': round(self.total_seconds / self.requests * 1000, 1) if self.requests else 0.0,
+            'max_ms': round(self.max_seconds * 1000, 1),
+        }
+
+
+class ResponseCache:
+    """On-disk validators and bodies of upstream GET responses, for conditional requests.
+
+    Each URL has a body file and a JSON entry with its ETag, Last-Modified and the
+    SHA-256 of the body. Files are replaced atomically, so concurrent workers and
+    interrupted polls never leave a torn entry behind.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.created = False
+
+    def paths(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return self.directory / f'{key}.json', self.directory / f'{key}.body'
+
+    def lookup(self, url):
+        entry_path, _ = self.paths(url)
+        try:
+            entry = json.loads(entry_path.read_bytes())
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get('url') == url else None
+
+    def read_body(self, url, content_hash):
+        """The stored body of `url`, or None if it is missing or no longer matches `content_hash`."""
+        try:
+            body = self.paths(url)[1].read_bytes()
+        except OSError:
+            return None
+        return body if hashlib.sha256(body).hexdigest() == content_hash else None
+
+    def store(self, url, entry, body):
+        if not self.created:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self.created = True
+        entry_path, body_path = self.paths(url)
+        self._write(body_path, body)
+        self._write(entry_path, json.dumps({'url': url, **entry}).encode())
+
+    def _write(self, path, data):
+        temp = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        temp.write_bytes(data)
+        os.replace(temp, path)
+
+
+class UpstreamClient:
+    """Pooled keep-alive HTTP session for one upstream API.
+
+    Connection and read errors and 5xx responses are retried by urllib3 with
+    jittered exponential backoff. 429 is left to the caller so it can throttle
+    a whole worker pool. Latency and body size are counted per endpoint.
+    Conditional GETs revalidate against `cache`, a ResponseCache, if one is given.
+    """
+
+    def __init__(self, base_url, headers=None, connect_timeout=5, read_timeout=30, retries=3,
+                 backoff_factor=0.5, backoff_jitter=0.5, pool_size=16, cache=None):
+        self.base_url = base_url.rstrip('/')
+        self.cache = cache
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+        self.session.headers.update(headers or {})
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            backoff_factor=backoff_factor,
+            backoff_jitter=backoff_jitter,
+            raise_on_status=False,
+            # Otherwise urllib3 would retry 429s itself and hide them from the caller
+            respect_retry_after_header=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+
+    def get(self, path, params=None, headers=None, endpoint=None, conditional=False):
+        """GET `path` relative to the base URL. `endpoint` groups the stats, e.g. '/hero/{}'.
+
+        A `conditional` request sends the ETag and Last-Modified cached for the URL and
+        sets `content_hash` (SHA-256 of the body) and `from_cache` on the response. A 304
+        keeps its status but carries the cached body, so callers can compare the hash
+        with what they stored last time before parsing anything.
+        """
+        url = f'{self.base_url}{path}'
+        if conditional:
+            return self._get_conditional(url, params, headers, endpoint or path)
+        return self._get(url, params, headers, endpoint or path)
+
+    def _get(self, url, params, headers, endpoint):
+        started = time.monotonic()
+        try:
+            response = self.session.get(url, params=params, headers=headers, timeout=self.timeout)
+        except requests.exceptions.RequestException:
+            self._record(endpoint, started, 0, error=True)
+            raise
+        self._record(endpoint, started, len(response.content), error=response.status_code >= 400,
+                     not_modified=response.status_code == 304)
+        return response
+
+    def _get_conditional(self, url, params, headers, endpoint):
+        url = requests.Request('GET', url, params=params).prepare().url
+        entry = self.cache.lookup(url) if self.cache is not None else None
+        validators = {}
+        if entry is not None:
+            if entry['etag']:
+                validators['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                validators['If-Modified-Since'] = entry['last_modified']
+        response = self._get(url, None, {**(headers or {}), **validators}, endpoint)
+        if response.status_code == 304 and entry is not None:
+            body = self.cache.read_body(url, entry['content_hash'])
+            if body is not None:
+                response._content = body
+                response.content_hash = entry['content_hash']
+                response.from_cache = True
+                return response
+            # The cached body is gone or damaged, so the validators are worthless
+            response = self._get(url, None, headers, endpoint)
+
+        response.content_hash = hashlib.sha256(response.content).hexdigest()
+        response.from_cache = False
+        fresh = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'content_hash': response.content_hash,
+        }
+        if self.cache is not None and response.status_code == 200 and (fresh['etag'] or fresh['last_modified']):
+            if entry is None or any(entry.get(key) != value for key, value in fresh.items()):
+                self.cache.store(url, fresh, response.content)
+        return response
+
+    def get_json(self, path, params=None, headers=None, endpoint=None):
+        response = self.get(path, params=params, headers=headers, endpoint=endpoint)
+        response.raise_for_status()
+        return response.json()
+
+    def _record(self, endpoint, started, size, error=False, not_modified=False):
+        elapsed = time.monotonic() - started
+        with self.stats_lock:
+            stats = self.stats.setdefault(endpoint, EndpointStats())
+            stats.requests += 1
+            stats.errors += int(error)
+            stats.not_modified += int(not_modified)
+            stats.bytes += size
+            stats.total_seconds += elapsed
+            stats.max_seconds = max(stats.max_seconds, elapsed)
+
+    def pop_stats(self):
+        """Return the per-endpoint counters collected so far and start new ones."""
+        with self.stats_lock:
+            stats, self.stats = self.stats, {}
+        return {endpoint: s.as_dict() for endpoint, s in stats.items()}
+
+
+class PortalClient(UpstreamClient):
+    """Client for the fantasy.top portal API."""
+
+    def __init__(self, base_url, api_key, **kwargs):
+        super().__init__(base_url, headers={'x-api-key': api_key or ''}, **kwargs)
+
+
+class HuddleClient(UpstreamClient):
+    """Client for the huddle.wtf analytics API. The bearer token is passed per call since it gets refreshed."""
+
+    def __init__(self, base_url, **kwargs):
+        kwargs.setdefault('read_timeout', 60)
+        super().__init__(base_url, headers={
+            'accept': 'application/json, text/plain, */*',
+            'cache-control': 'no-cache',
+            'expires': '0',
+            'pragma': 'no-cache',
+        }, **kwargs)
+
+    def auth_headers(self, token):
+        return {'authorization': f'Bearer {token}'}
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
@@ -5,12 +6,27 @@ from .views import (
     HeroViewSet,
     PlayerViewSet,
     hero_market_data,
+    hero_market_data_batch,
+    hero_history,
+    hero_market_history,
     hero_performance,
     hero_tournament_scores,
     predict_star_swings,
-    search_heroes_by_handle
+    search_heroes_by_handle,
+    cache_stats,
+    poll_status,
+    export_dataset
 )
 
+if getattr(settings, 'API_ASYNC_VIEWS', False):
+    from .async_views import (
+        hero_market_data,
+        hero_performance,
+        hero_tournament_scores,
+        predict_star_swings,
+        search_heroes_by_handle
+    )
+
 router = DefaultRouter()
 router.register(r'heroes', HeroViewSet)
 router.register(r'cards', CardViewSet)
@@ -20,7 +36,13 @@ urlpatterns = [
     path('', include(router.urls)),
     path('predict-star-swings/', predict_star_swings, name='predict-star-swings'),
     path('hero-performance/<str:hero_id>/', hero_performance, name='hero-performance'),
+    path('hero-market-data/', hero_market_data_batch, name='hero-market-data-batch'),
     path('hero-market-data/<str:hero_id>/', hero_market_data, name='hero-market-data'),
     path('hero-tournament-scores/<str:hero_id>/', hero_tournament_scores, name='hero-tournament-scores'),
+    path('hero-history/<str:hero_id>/', hero_history, name='hero-history'),
+    path('hero-market-history/<str:hero_id>/', hero_market_history, name='hero-market-history'),
 	path('search-heroes-by-handle/', search_heroes_by_handle, name='search-heroes-by-handle'),
+    path('cache-stats/', cache_stats, name='cache-stats'),
+    path('poll-status/', poll_status, name='poll-status'),
+    path('export/<str:dataset>.<str:fmt>', export_dataset, name='export-dataset'),
 ]
\ No newline at end of file
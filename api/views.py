@@ -1,39 +1,125 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from .models import Hero, HeroScore, Card, Player, FloorPrice, HighestBid, CardSupply, TournamentScore
-from .serializers import HeroSerializer, CardSerializer, PlayerSerializer
-from django.db.models import Avg, Subquery
+from .models import Hero, Card, Player, FloorPrice, HighestBid, CardSupply, TournamentScore, StarSwingSnapshot, HeroStatHistory, HistoryResolution, MarketPriceHistory
+from .serializers import HeroSerializer, CardSerializer, PlayerSerializer, ValuesSerializer, requested_fields
+from .pagination import KeysetCursorPagination
+from .analytics import performance_change, window_averages
+from .search import get_search_index
+from .cache import cached_response, response_cache
+from .ingest import build_market_snapshots
+from .scheduler import source_states
+from .history import HERO_STAT_FIELDS, MARKET_PRICE_FIELDS, history_points, resolution_for
+from .export import CONTENT_TYPES, ENCODERS, EXPORTS, export_rows, parse_since
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import require_GET
+from django.utils.decorators import method_decorator
+from django.db.models import Prefetch, Subquery
 from django.utils import timezone
-from datetime import timedelta
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import http_date
+from datetime import datetime, time, timedelta, timezone as dt_timezone
 from .management.commands.predict_star_swings import Command as PredictStarSwingsCommand
 from rest_framework.permissions import AllowAny
 from rest_framework.decorators import permission_classes
 import json
 
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+class SparseFieldsetViewMixin:
+	# Only load the columns that ?fields= asks for, plus what the cursor needs
+	def get_queryset(self):
+		queryset = super().get_queryset()
+		fields = requested_fields(self.request, self.get_serializer_class()().fields)
+		if fields:
+			queryset = queryset.only(*fields, *self.cursor_ordering_fields)
+		return queryset
+
+	# Lists are built from values() rows; the output is identical to the serializer's
+	def list(self, request, *args, **kwargs):
+		values_serializer = ValuesSerializer(self.get_serializer())
+		queryset = self.filter_queryset(self.get_queryset()).values(*values_serializer.sources, *self.cursor_ordering_fields)
+		page = self.paginate_queryset(queryset)
+		data = [values_serializer.to_representation(row) for row in (queryset if page is None else page)]
+		return Response(data) if page is None else self.get_paginated_response(data)
+
 @permission_classes([AllowAny])
-class HeroViewSet(viewsets.ReadOnlyModelViewSet):
+@method_decorator(cached_response('heroes'), name='dispatch')
+class HeroViewSet(SparseFieldsetViewMixin, viewsets.ReadOnlyModelViewSet):
 	queryset = Hero.objects.all()
 	serializer_class = HeroSerializer
+	pagination_class = KeysetCursorPagination
+	cursor_ordering_fields = ('id', 'current_rank', 'created_at')
 
 @permission_classes([AllowAny])
-class CardViewSet(viewsets.ReadOnlyModelViewSet):
+@method_decorator(cached_response('cards'), name='dispatch')
+class CardViewSet(SparseFieldsetViewMixin, viewsets.ReadOnlyModelViewSet):
 	queryset = Card.objects.all()
 	serializer_class = CardSerializer
+	pagination_class = KeysetCursorPagination
+	cursor_ordering_fields = ('id', 'created_at')
 
 @permission_classes([AllowAny])
 class PlayerViewSet(viewsets.ReadOnlyModelViewSet):
 	queryset = Player.objects.all()
 	serializer_class = PlayerSerializer
 
+@cached_response('predictions', 'heroes', 'scores')
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def predict_star_swings(request):
-	command = PredictStarSwingsCommand()
-	json_data = command.handle()
-	data = json.loads(json_data)
-	return Response(data)
+	snapshots = StarSwingSnapshot.objects.order_by('-poll_ts')
+
+	as_of = request.query_params.get('as_of')
+	if as_of:
+		as_of_ts = parse_as_of(as_of)
+		if as_of_ts is None:
+			return Response({'error': 'as_of must be an ISO date or datetime'}, status=status.HTTP_400_BAD_REQUEST)
+		snapshots = snapshots.filter(poll_ts__lte=as_of_ts)
 
+	snapshot = snapshots.only('id', 'poll_ts', 'etag').first()
+	if snapshot is None:
+		if as_of:
+			return Response({'error': 'No predictions available for the given as_of'}, status=status.HTTP_404_NOT_FOUND)
+		# Nothing has been materialized by the poller yet
+		command = PredictStarSwingsCommand()
+		json_data = command.handle()
+		data = json.loads(json_data)
+		return Response(data)
+
+	etag = f'"{snapshot.etag}"'
+	last_modified = int(snapshot.poll_ts.timestamp())
+	not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+	if not_modified is not None:
+		return not_modified
+
+	data = StarSwingSnapshot.objects.values_list('data', flat=True).get(id=snapshot.id)
+	response = Response(data)
+	response['ETag'] = etag
+	response['Last-Modified'] = http_date(last_modified)
+	return response
+
+def parse_as_of(value):
+	try:
+		# Checked first: parse_datetime() also accepts a bare date, as midnight
+		as_of_date = parse_date(value)
+		if as_of_date is not None:
+			# A bare date means "as of the end of that day"
+			as_of = datetime.combine(as_of_date, time.max)
+		else:
+			as_of = parse_datetime(value)
+			if as_of is None:
+				return None
+	except ValueError:
+		return None
+	if timezone.is_naive(as_of):
+		as_of = timezone.make_aware(as_of, dt_timezone.utc)
+	return as_of
+
+@cached_response('heroes', 'scores')
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def hero_performance(request, hero_id):
@@ -42,52 +128,74 @@ def hero_performance(request, hero_id):
 	except Hero.DoesNotExist:
 		return Response({'error': 'Hero not found'}, status=status.HTTP_404_NOT_FOUND)
 
-	now = timezone.now()
-	seven_days_ago = now - timedelta(days=7)
-	thirty_days_ago = now - timedelta(days=30)
-
-	seven_day_avg = HeroScore.objects.filter(
-		hero=hero, 
-		date__gte=seven_days_ago
-	).aggregate(Avg('score'))['score__avg'] or 0
-
-	thirty_day_avg = HeroScore.objects.filter(
-		hero=hero, 
-		date__gte=thirty_days_ago
-	).aggregate(Avg('score'))['score__avg'] or 0
-
-	performance_change = (seven_day_avg - thirty_day_avg) / thirty_day_avg if thirty_day_avg else 0
+	averages = window_averages([hero.id]).get(hero.id, {7: 0, 30: 0})
 
 	return Response({
 		'hero_id': hero.id,
 		'name': hero.name,
-		'seven_day_avg': seven_day_avg,
-		'thirty_day_avg': thirty_day_avg,
-		'performance_change': performance_change
+		'seven_day_avg': averages[7],
+		'thirty_day_avg': averages[30],
+		'performance_change': performance_change(averages)
 	})
 
+MARKET_DATA_FIELDS = ('id', 'name', 'volume', 'last_sale', 'market_snapshot')
+MARKET_DATA_MAX_IDS = 200
+
+def market_data(hero_id, name, volume, last_sale, snapshot):
+	return {
+		'hero_id': hero_id,
+		'name': name,
+		'floor_prices': snapshot['floor_prices'],
+		'highest_bids': snapshot['highest_bids'],
+		'card_supplies': snapshot['card_supplies'],
+		'volume': volume,
+		'last_sale': last_sale
+	}
+
+@cached_response('heroes')
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def hero_market_data(request, hero_id):
-	try:
-		hero = Hero.objects.get(id=hero_id)
-	except Hero.DoesNotExist:
+	# One primary-key lookup: the poller keeps the market tables mirrored in Hero.market_snapshot
+	hero = Hero.objects.filter(id=hero_id).values(*MARKET_DATA_FIELDS).first()
+	if hero is None:
 		return Response({'error': 'Hero not found'}, status=status.HTTP_404_NOT_FOUND)
 
-	floor_prices = FloorPrice.objects.filter(hero=hero)
-	highest_bids = HighestBid.objects.filter(hero=hero)
-	card_supplies = CardSupply.objects.filter(hero=hero)
+	snapshot = hero['market_snapshot']
+	if snapshot is None:
+		snapshot = build_market_snapshots([hero_id])[hero_id]
+	return Response(market_data(hero['id'], hero['name'], hero['volume'], hero['last_sale'], snapshot))
+
+@cached_response('heroes')
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def hero_market_data_batch(request):
+	ids = [hero_id for hero_id in request.query_params.get('ids', '').split(',') if hero_id]
+	if not ids:
+		return Response({'error': 'ids parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
+	if len(ids) > MARKET_DATA_MAX_IDS:
+		return Response({'error': f'At most {MARKET_DATA_MAX_IDS} ids per request'}, status=status.HTTP_400_BAD_REQUEST)
+
+	# Four queries whatever the number of heroes: the heroes, then one per market table
+	heroes = Hero.objects.filter(id__in=ids).only('id', 'name', 'volume', 'last_sale').prefetch_related(
+		Prefetch('floor_prices', queryset=FloorPrice.objects.order_by('hero_id', 'rarity')),
+		Prefetch('highest_bids', queryset=HighestBid.objects.order_by('hero_id', 'rarity')),
+		Prefetch('card_supplies', queryset=CardSupply.objects.order_by('hero_id', 'rarity')),
+	)
+	found = {}
+	for hero in heroes:
+		found[hero.id] = market_data(hero.id, hero.name, hero.volume, hero.last_sale, {
+			'floor_prices': [{'rarity': fp.rarity, 'price': fp.price} for fp in hero.floor_prices.all()],
+			'highest_bids': [{'rarity': hb.rarity, 'price': hb.price} for hb in hero.highest_bids.all()],
+			'card_supplies': [{'rarity': cs.rarity, 'amount': cs.amount, 'burnt': cs.burnt, 'total': cs.total} for cs in hero.card_supplies.all()],
+		})
 
 	return Response({
-		'hero_id': hero.id,
-		'name': hero.name,
-		'floor_prices': [{'rarity': fp.rarity, 'price': fp.price} for fp in floor_prices],
-		'highest_bids': [{'rarity': hb.rarity, 'price': hb.price} for hb in highest_bids],
-		'card_supplies': [{'rarity': cs.rarity, 'amount': cs.amount, 'burnt': cs.burnt, 'total': cs.total} for cs in card_supplies],
-		'volume': hero.volume,
-		'last_sale': hero.last_sale
+		'heroes': [found[hero_id] for hero_id in dict.fromkeys(ids) if hero_id in found],
+		'not_found': [hero_id for hero_id in dict.fromkeys(ids) if hero_id not in found]
 	})
 
+@cached_response('heroes', 'tournaments')
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def hero_tournament_scores(request, hero_id):
@@ -108,6 +216,77 @@ def hero_tournament_scores(request, hero_id):
 		'tournament_scores': tournament_scores_data
 	})
 
+HISTORY_DEFAULT_RANGE = timedelta(days=7)
+# History gains a sample every poll, so it is left to HTTP caches rather than the
+# response cache, which would then be emptied after every sample
+HISTORY_MAX_AGE = 60
+
+def history_range(request):
+	"""(resolution, start, end) from ?start=&end=&resolution=, or an error Response."""
+	now = timezone.now()
+	end = now
+	if request.query_params.get('end'):
+		end = parse_as_of(request.query_params['end'])
+		if end is None:
+			return Response({'error': 'end must be an ISO date or datetime'}, status=status.HTTP_400_BAD_REQUEST)
+	start = end - HISTORY_DEFAULT_RANGE
+	if request.query_params.get('start'):
+		try:
+			start = parse_since(request.query_params['start'])
+		except ValueError:
+			return Response({'error': 'start must be an ISO date or datetime'}, status=status.HTTP_400_BAD_REQUEST)
+	if start > end:
+		return Response({'error': 'start must not be after end'}, status=status.HTTP_400_BAD_REQUEST)
+
+	resolution = request.query_params.get('resolution', 'auto')
+	if resolution == 'auto':
+		return resolution_for(start, now), start, end
+	labels = {choice.label: choice for choice in HistoryResolution}
+	if resolution not in labels:
+		return Response({'error': f"resolution must be one of: auto, {', '.join(labels)}"}, status=status.HTTP_400_BAD_REQUEST)
+	return labels[resolution], start, end
+
+@cache_control(max_age=HISTORY_MAX_AGE)
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def hero_history(request, hero_id):
+	parsed = history_range(request)
+	if isinstance(parsed, Response):
+		return parsed
+	resolution, start, end = parsed
+	if not Hero.objects.filter(id=hero_id).exists():
+		return Response({'error': 'Hero not found'}, status=status.HTTP_404_NOT_FOUND)
+
+	return Response({
+		'hero_id': hero_id,
+		'resolution': resolution.label,
+		'start': start,
+		'end': end,
+		'points': history_points(HeroStatHistory, HERO_STAT_FIELDS, hero_id, resolution, start, end),
+	})
+
+@cache_control(max_age=HISTORY_MAX_AGE)
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def hero_market_history(request, hero_id):
+	parsed = history_range(request)
+	if isinstance(parsed, Response):
+		return parsed
+	resolution, start, end = parsed
+	if not Hero.objects.filter(id=hero_id).exists():
+		return Response({'error': 'Hero not found'}, status=status.HTTP_404_NOT_FOUND)
+
+	filters = {}
+	if request.query_params.get('rarity'):
+		filters['rarity'] = request.query_params['rarity']
+	return Response({
+		'hero_id': hero_id,
+		'resolution': resolution.label,
+		'start': start,
+		'end': end,
+		'points': history_points(MarketPriceHistory, MARKET_PRICE_FIELDS, hero_id, resolution, start, end, ordering=('ts', 'rarity'), **filters),
+	})
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def search_heroes_by_handle(request):
@@ -115,13 +294,50 @@ def search_heroes_by_handle(request):
 	if not handle:
 		return Response({'error': 'Handle parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
 
-	heroes = Hero.objects.filter(handle__icontains=handle)
-	
-	if not heroes.exists():
-		return Response({'error': 'No heroes found with the given handle'}, status=status.HTTP_404_NOT_FOUND)
+	try:
+		limit = min(max(int(request.query_params.get('limit', SEARCH_DEFAULT_LIMIT)), 1), SEARCH_MAX_LIMIT)
+		offset = max(int(request.query_params.get('offset', 0)), 0)
+	except ValueError:
+		return Response({'error': 'limit and offset must be integers'}, status=status.HTTP_400_BAD_REQUEST)
 
-	serializer = HeroSerializer(heroes, many=True)
+	# Matches handle or name, ranked exact > prefix > substring, then by current rank
+	count, heroes = get_search_index().search(handle, limit=limit, offset=offset)
+
+	if not count:
+		return Response({'error': 'No heroes found with the given handle'}, status=status.HTTP_404_NOT_FOUND)
 
 	return Response({
-		'heroes': serializer.data
-	})
\ No newline at end of file
+		'count': count,
+		'limit': limit,
+		'offset': offset,
+		'heroes': heroes
+	})
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def cache_stats(request):
+	return Response(response_cache.metrics())
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def poll_status(request):
+	# Not cached: the poller updates these rows without bumping the response cache generation
+	return Response({'sources': source_states()})
+
+# Plain Django view: DRF content negotiation would reject Accept: text/csv and similar
+@require_GET
+def export_dataset(request, dataset, fmt):
+	if dataset not in EXPORTS or fmt not in ENCODERS:
+		return JsonResponse({'error': f"Unknown export. Use /api/export/<{'|'.join(EXPORTS)}>.<{'|'.join(ENCODERS)}>"}, status=status.HTTP_404_NOT_FOUND)
+
+	since = request.GET.get('since')
+	if since:
+		try:
+			since = parse_since(since, date_only=dataset == 'hero-scores')
+		except ValueError:
+			return JsonResponse({'error': 'since must be an ISO date or datetime'}, status=status.HTTP_400_BAD_REQUEST)
+
+	columns, rows = export_rows(dataset, since or None)
+	response = StreamingHttpResponse(ENCODERS[fmt](columns, rows), content_type=CONTENT_TYPES[fmt])
+	response['Content-Disposition'] = f'attachment; filename="{dataset}.{fmt}"'
+	return response
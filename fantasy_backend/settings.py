@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -93,11 +94,40 @@ WSGI_APPLICATION = 'fantasy_backend.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        # DATABASE_PATH points a command at another file, e.g. a fixture DB for backtest_star_swings
+        'NAME': os.environ.get('DATABASE_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
 
+# Response cache for the read API (api/cache.py)
+# Entries live until the poller commits its next write to the data they were built from.
+# 'local' keeps a per-process LRU; 'django' stores entries in CACHES[ALIAS] (e.g. a FileBasedCache or Redis)
+# so workers share them.
+
+API_RESPONSE_CACHE = {
+    'BACKEND': 'local',
+    'ALIAS': 'default',
+    'MAX_ENTRIES': 5000,
+    'MAX_BYTES': 64 * 1024 * 1024,
+    'TIMEOUT': 3600,
+    'GENERATION_CHECK_INTERVAL': 2,
+}
+
+# Route the read endpoints to the async views in api/async_views.py.
+# Only worth enabling when serving fantasy_backend.asgi with an ASGI server (uvicorn, daphne, ...).
+
+API_ASYNC_VIEWS = False
+
+# Stars predict_star_swings expects for a league percentile (rank / number of HEROs * 100):
+# STARS[i] up to and including THRESHOLDS[i], the last STARS entry past the last threshold.
+
+STAR_SWING_BUCKETS = {
+    'THRESHOLDS': [15, 32, 50, 67, 82],
+    'STARS': [7, 6, 5, 4, 3, 2],
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 